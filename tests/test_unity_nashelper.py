@@ -0,0 +1,321 @@
+#!/usr/bin/python
+"""
+tests of unity_nashelper.py: parsing, diffing, journaling and error classification
+functions, and round trips of the command line against the Unity simulator
+(tools/unity_sim.py)
+
+usage:
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(TESTS), "unity_nashelper.py")
+SIMULATOR = os.path.join(os.path.dirname(TESTS), "tools", "unity_sim.py")
+
+sys.argv = [SCRIPT]
+sys.path.insert(0, os.path.dirname(SCRIPT))
+import unity_nashelper as u
+
+
+def snapshotRow(ID, name, source, state="Ready"):
+    # csv row of a Snapshot as returned by iterRows
+    return [ID, name, state, "no", source, "File System", "", ""]
+
+
+class ProxySharesTest(unittest.TestCase):
+
+    def test_parse(self):
+        output = "share=share1 target=nas1 path=/snap1/dir1\nname=share two target=nas2 path=/snap 2/dir\n\nno share here\n"
+        self.assertEqual(u.parseProxyShares(output), {
+            "share1": ("nas1", "/snap1/dir1"),
+            "share two": ("nas2", "/snap 2/dir"),
+        })
+
+    def test_diff(self):
+        current = {
+            "same": ("nas1", "/snap/same"),
+            "moved": ("nas1", "/oldsnap/moved"),
+            "other": ("nas2", "/snap/other"),
+        }
+        desired = [("same", "/snap/same"), ("moved", "/snap/moved"), ("other", "/snap/other"), ("new", "/snap/new")]
+        operations, unchanged = u.diffProxyShares("nas1", desired, current)
+        self.assertEqual(unchanged, 1)
+        self.assertEqual(operations, [
+            ("moved", ["-proxy_share", "-remove", "-share", "moved"]),
+            ("moved", ["-proxy_share", "-add", "nas1", "-share", "moved", "-path", "/snap/moved"]),
+            ("other", ["-proxy_share", "-remove", "-share", "other"]),
+            ("other", ["-proxy_share", "-add", "nas1", "-share", "other", "-path", "/snap/other"]),
+            ("new", ["-proxy_share", "-add", "nas1", "-share", "new", "-path", "/snap/new"]),
+        ])
+
+    def test_diff_nothing_to_do(self):
+        desired = [("a", "/snap/a"), ("b", "/snap/b")]
+        operations, unchanged = u.diffProxyShares("nas1", desired, dict((name, ("nas1", path)) for name, path in desired))
+        self.assertEqual((operations, unchanged), ([], 2))
+
+
+class ClassifyErrorTest(unittest.TestCase):
+
+    def test_overload(self):
+        self.assertEqual(u.classifyError("Error: The system is busy. Try again later."), "overload")
+        self.assertEqual(u.classifyError("HTTP 503 Service Unavailable"), "overload")
+
+    def test_unreachable_is_retried_for_changes_too(self):
+        self.assertEqual(u.classifyError("Unable to connect to the storage system"), "transient")
+        self.assertEqual(u.classifyError("connect: Connection refused", readonly=False), "transient")
+
+    def test_transient_only_for_reads(self):
+        output = "error: connection reset by peer"
+        self.assertEqual(u.classifyError(output, readonly=True), "transient")
+        self.assertEqual(u.classifyError(output, readonly=False), "permanent")
+
+    def test_timeout(self):
+        self.assertEqual(u.classifyError("", timedout=True, readonly=True), "transient")
+        self.assertEqual(u.classifyError("", timedout=True, readonly=False), "permanent")
+
+    def test_permanent(self):
+        self.assertEqual(u.classifyError("Error 2100: nas1 : unknown command -foo"), "permanent")
+        self.assertEqual(u.classifyError(None), "permanent")
+
+
+class ColumnStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [
+            snapshotRow("38654705001", "fs1_snap1", "res_1"),
+            snapshotRow("38654705002", "fs1_snap2", "res_1", "Destroying"),
+            snapshotRow("38654705003", "fs2_snap1", "res_2"),
+            snapshotRow("38654705004", '"fs2, snap2"', "res_2"),
+            snapshotRow("0123", "odd_id", "res_3"),
+        ]
+        self.store = u.ColumnStore(u.Snapshot, [list(row) for row in self.rows], chunk=2)
+
+    def test_rows_round_trip(self):
+        self.assertEqual(self.store.count, len(self.rows))
+        for n, row in enumerate(self.rows):
+            self.assertEqual(self.store.row(n), [u.decodeText(value) for value in row])
+
+    def test_equal(self):
+        self.assertEqual(self.store.equal("source", "res_2"), [2, 3])
+        self.assertEqual(self.store.equal("source", "res_9"), [])
+        self.assertEqual(self.store.equal("name", "fs1_snap2"), [1])
+        self.assertEqual(self.store.equal("id", "0123"), [4])
+
+    def test_prefix(self):
+        self.assertEqual(self.store.prefix("name", "fs2_"), [2])
+        self.assertEqual(self.store.prefix("name", "fs"), [0, 1, 2, 3])
+
+    def test_records(self):
+        snaps = self.store.records(self.store.equal("state", "Destroying"))
+        self.assertEqual([(snap.id, snap.name, snap.source) for snap in snaps], [("38654705002", "fs1_snap2", "res_1")])
+
+    def test_sizes(self):
+        rows = [["res_1", "fs1", "", "OK", "", "nas_1", "pool_1", "pool1", "UFS64", "CIFS", "", "", "", "100 (100B)", "40", "", "5"],
+                ["res_2", "fs2", "", "OK", "", "nas_1", "pool_1", "pool1", "UFS64", "CIFS", "", "", "", "n/a", "60", "300", "0"]]
+        store = u.ColumnStore(u.Filesystem, rows)
+        self.assertEqual(list(store.sizes("size")), [100, -1])
+        self.assertEqual(list(store.sizes("maxsize")), [-1, 300])
+        self.assertEqual(store.value(store.names.index("size"), 1), "n/a")
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_same_row_after_decoding(self):
+        row = ["res_1", '"fs1"', "", "OK", "", "nas_1", "pool_1", "pool1", "UFS64", "CIFS", "", "", "", "100 (100B)", "40", "", "5"]
+        fs = u.Filesystem.fromRow(list(row))
+        self.assertTrue(fs.sameRow(list(row)))
+        fs.size, fs.name
+        self.assertTrue(fs.sameRow(list(row)))
+        changed = list(row)
+        changed[13] = "200 (200B)"
+        self.assertFalse(fs.sameRow(changed))
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.saved = (u.inventory, u.resume)
+        snap = u.Snapshot.fromRow(snapshotRow("38654705001", "fs1" + u.DRTEST_SNAP_SUFFIX, "res_1"))
+        fs = u.Filesystem.fromRow(["res_1", "fs1", "", "OK", "", "nas_1", "pool_1", "pool1", "UFS64", "CIFS", "", "", "", "100", "40", "", "5"])
+        nas = u.Nasserver.fromRow(["nas_1", "nas1"] + [""] * (len(u.Nasserver.columns) - 2))
+        u.inventory = u.Inventory([fs], [nas], [snap])
+        self.fs, self.nas, self.snap = fs, nas, snap
+
+    def tearDown(self):
+        u.inventory, u.resume = self.saved
+        shutil.rmtree(self.workdir, True)
+
+    def record(self, journal):
+        journal.record("snapshot", nas="nas1", filesystem="fs1", fsid="res_1", name=self.snap.name, id=self.snap.id)
+        journal.record("proxyshares", nas="nas1", filesystem="fs1", shares=["share1"])
+
+    def test_resume_same_nas_servers(self):
+        u.resume = False
+        journal = u.Journal(os.path.join(self.workdir, "journal"))
+        journal.begin(["nas1"])
+        self.record(journal)
+        u.resume = True
+        resumed = u.Journal(os.path.join(self.workdir, "journal"))
+        resumed.begin(["nas1"])
+        self.assertEqual(resumed.choice(self.fs), ("reuse", self.snap.name, self.snap))
+        self.assertEqual(resumed.proxyshares, {"fs1": ["share1"]})
+        other = u.Journal(os.path.join(self.workdir, "journal"))
+        other.begin(["nas2"])
+        self.assertEqual(other.proxyshares, {})
+        self.assertNotEqual(other.filename, resumed.filename)
+
+    def test_fs_done(self):
+        u.resume = False
+        journal = u.Journal(os.path.join(self.workdir, "journal"))
+        journal.begin(["nas1"])
+        self.record(journal)
+        path = "/" + self.snap.name + "/dir1"
+        self.assertTrue(journal.fsDone(self.fs, self.nas, {"share1": ("nas1", path)}))
+        # proxy share of another nas server, of another snapshot or missing
+        self.assertFalse(journal.fsDone(self.fs, self.nas, {"share1": ("nas2", path)}))
+        self.assertFalse(journal.fsDone(self.fs, self.nas, {"share1": ("nas1", "/fs1_other/dir1")}))
+        self.assertFalse(journal.fsDone(self.fs, self.nas, {"share1": ("nas1", "/" + self.snap.name + "x/dir1")}))
+        self.assertFalse(journal.fsDone(self.fs, self.nas, {}))
+        # snapshot deleted since the journal was written
+        u.inventory = u.Inventory([self.fs], [self.nas], [])
+        self.assertFalse(journal.fsDone(self.fs, self.nas, {"share1": ("nas1", path)}))
+
+    def test_finish_removes_journal(self):
+        u.resume = False
+        journal = u.Journal(os.path.join(self.workdir, "journal"))
+        journal.begin(["nas1"])
+        self.assertTrue(os.path.exists(journal.filename))
+        journal.finish()
+        self.assertFalse(os.path.exists(journal.filename))
+
+
+class SimulatorTest(unittest.TestCase):
+    # unity_nashelper.py command lines run against the simulator, every test with its
+    # own simulator state and home directory (inventory cache, journal, socket)
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.env = dict(os.environ)
+        self.env.update({
+            "HOME": self.workdir,
+            "PYTHONUNBUFFERED": "1",
+            "UNITY_SIM_NAS": "2",
+            "UNITY_SIM_FS": "8",
+            "UNITY_SIM_SHARES": "24",
+            "UNITY_SIM_SNAPS": "16",
+            "UNITY_SIM_STATE": os.path.join(self.workdir, "state"),
+            "UNITY_NASHELPER_UEMCLI": "{} {} uemcli".format(sys.executable, SIMULATOR),
+            "UNITY_NASHELPER_SVC_NAS": "{} {} svc_nas".format(sys.executable, SIMULATOR),
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, True)
+
+    def run_helper(self, *args, **env):
+        # run unity_nashelper.py answering "y" to every question (with --trace, unless
+        # traced=False: --trace is not served by --daemon)
+        # output -> (exit status, output, types of the commands run)
+        trace = os.path.join(self.workdir, "trace.jl")
+        if os.path.exists(trace):
+            os.remove(trace)
+        if env.pop("traced", True):
+            args += ("--trace", trace)
+        environ = dict(self.env, **env)
+        proc = subprocess.Popen([sys.executable, SCRIPT] + list(args), cwd=self.workdir, env=environ, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate("y\n" * 1000)[0]
+        types = []
+        if os.path.exists(trace):
+            with open(trace) as f:
+                types = [line["type"] for line in map(json.loads, f) if line.get("event") == "command"]
+        return proc.returncode, output, types
+
+    def test_testdr_rerun_changes_nothing(self):
+        status, output, types = self.run_helper("--testDR", "-nas", "nas01")
+        self.assertIn("DR test environment ready", output)
+        self.assertEqual(types.count("svc_nas batch"), 1) # all proxy shares of nas01 in one batch
+        self.assertEqual(types.count("uemcli /prot/snap create"), 4)
+        status, output, types = self.run_helper("--testDR", "-nas", "nas01")
+        self.assertIn("DR test environment ready", output)
+        self.assertNotIn("uemcli /prot/snap create", types)
+        self.assertNotIn("svc_nas batch", types)
+
+    def test_testdr_resume(self):
+        status, output, types = self.run_helper("--testDR", "-nas", "nas01", "nas02", UNITY_SIM_FAIL="-path")
+        self.assertIn("--resume", output)
+        self.assertEqual(types.count("uemcli /prot/snap create"), 8)
+        journals = [name for name in os.listdir(self.workdir) if name.startswith(".unity_nashelper.journal")]
+        self.assertEqual(len(journals), 1)
+        status, output, types = self.run_helper("--testDR", "-nas", "nas01", "nas02", "--resume")
+        self.assertIn("Resuming DR run", output)
+        self.assertIn("2 of 2 NAS servers ready", output)
+        self.assertNotIn("uemcli /prot/snap create", types)
+        self.assertNotIn("uemcli /net/nas/server create", types)
+        self.assertEqual(types.count("svc_nas batch"), 2)
+        self.assertFalse([name for name in os.listdir(self.workdir) if name.startswith(".unity_nashelper.journal")])
+
+    def test_plan_apply(self):
+        status, output, types = self.run_helper("--testDR", "-nas", "nas01", "nas02", "--plan", "plan.json")
+        self.assertIn("plan written to plan.json", output)
+        self.assertNotIn("uemcli /prot/snap create", types)
+        with open(os.path.join(self.workdir, "plan.json")) as f:
+            plan = json.load(f)
+        self.assertEqual([nasplan["name"] for nasplan in plan["nasservers"]], ["nas01", "nas02"])
+        # global options before and after --apply (README example)
+        status, output, types = self.run_helper("--apply", "plan.json", "--maxproc", "4")
+        self.assertIn("2 of 2 NAS servers ready", output)
+        self.assertEqual(types.count("svc_nas batch"), 2)
+        status, output, types = self.run_helper("--testDR", "-nas", "nas01", "nas02", "--plan", "again.json")
+        with open(os.path.join(self.workdir, "again.json")) as f:
+            plan = json.load(f)
+        self.assertEqual([nasplan["proxyshares"] for nasplan in plan["nasservers"]], [[], []])
+        shutil.rmtree(self.env["UNITY_SIM_STATE"], True)
+        status, output, types = self.run_helper("--maxproc", "4", "--timeout", "60", "--apply", "plan.json")
+        self.assertIn("2 of 2 NAS servers ready", output)
+
+    def test_snap_second_name(self):
+        status, output, types = self.run_helper("--snap", "fs00001", "mysnap")
+        self.assertIn("Creating snapshot name (mysnap) of filesystem (fs00001)", output)
+        for args in (["nas01", "mysnap"], ["fs0000*", "mysnap"], ["fs00001", "fs0*x"]):
+            status, output, types = self.run_helper("--snap", *args)
+            self.assertIn("Could not find filesystem or NAS server", output)
+            self.assertNotIn("uemcli /prot/snap create", types)
+
+    def test_daemon_keeps_its_options(self):
+        log = open(os.path.join(self.workdir, "daemon.log"), "w+")
+        daemon = subprocess.Popen([sys.executable, SCRIPT, "--daemon", "--interval", "1"], cwd=self.workdir, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            socketFile = os.path.join(self.workdir, ".unity_nashelper.sock")
+            for n in range(100):
+                if os.path.exists(socketFile):
+                    break
+                time.sleep(0.1)
+            status, output, types = self.run_helper("--showSNAP", "fs00001_snap1", "--debug", traced=False)
+            self.assertIn("name: fs00001_snap1", output)
+            # answered by the daemon: a query run directly reads the inventory cache
+            self.assertIn("calling showSNAP", output)
+            self.assertNotIn("inventory cache", output)
+            log.seek(0, 2)
+            start = log.tell()
+            time.sleep(2.5)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+        log.seek(start)
+        refreshes = log.read()
+        log.close()
+        self.assertIn("inventory refreshed", refreshes)
+        self.assertNotIn("calling loadInventory", refreshes)
+
+
+if __name__ == "__main__":
+    unittest.main()
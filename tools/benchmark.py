@@ -0,0 +1,179 @@
+#!/usr/bin/python
+"""
+benchmark of unity_nashelper.py against the Unity simulator (tools/unity_sim.py)
+
+times csv parsing (getItems), uemcli listings (get* functions and loadInventory),
+name/id lookups of the inventory and a full --testDR run of one nas server,
+results can be saved and compared with a previous run to track regressions
+
+usage:
+python tools/benchmark.py [--size small|large] [--latency seconds] [--repeat N]
+                          [--parallel N] [--save file.json] [--compare file.json]
+
+--size       synthetic array, small: 5 nas servers, 50 filesystems, 200 shares,
+             300 snapshots; large (default): 50 nas servers, 10k filesystems,
+             60k shares, 100k snapshots
+--latency    seconds added to every uemcli/svc_nas call (default 0)
+--repeat     runs of every benchmark, median is reported (default 3)
+--parallel   --parallel value of the --testDR run (default 4)
+--save       write results to a json file
+--compare    compare results with a json file written by --save, exit code is 1
+             if a benchmark is more than 20% slower
+"""
+
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import random
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(TOOLS), "unity_nashelper.py")
+SIMULATOR = os.path.join(TOOLS, "unity_sim.py")
+
+SIZES = {
+    "small": {"NAS": 5, "FS": 50, "SHARES": 200, "SNAPS": 300},
+    "large": {"NAS": 50, "FS": 10000, "SHARES": 60000, "SNAPS": 100000},
+}
+REGRESSION_THRESHOLD = 1.2 # slower than 120% of the compared run
+LOOKUPS = 1000 # lookups timed by every lookup benchmark
+
+def usage():
+    print(__doc__)
+    exit(2)
+
+def parseArgs(args):
+    # parse command arguments
+    # input -> list of arguments
+    # output -> dictionary of options
+    options = {"size": "large", "latency": "0", "repeat": 3, "parallel": 4, "save": None, "compare": None}
+    while args:
+        arg = args.pop(0)
+        if arg in ("--size", "--latency", "--repeat", "--parallel", "--save", "--compare") and args:
+            options[arg[2:]] = args.pop(0)
+        else:
+            usage()
+    if options["size"] not in SIZES:
+        usage()
+    try:
+        options["repeat"] = int(options["repeat"])
+        options["parallel"] = int(options["parallel"])
+        float(options["latency"])
+    except ValueError:
+        usage()
+    return options
+
+def setupSimulator(options, workdir):
+    # point unity_nashelper.py to the simulator (environment is inherited by --testDR run)
+    # input -> options, temporary directory for simulator state
+    for name, value in SIZES[options["size"]].items():
+        os.environ["UNITY_SIM_" + name] = str(value)
+    os.environ["UNITY_SIM_LATENCY"] = options["latency"]
+    os.environ["UNITY_SIM_STATE"] = os.path.join(workdir, "state")
+    os.environ["UNITY_NASHELPER_UEMCLI"] = "{} {} uemcli".format(sys.executable, SIMULATOR)
+    os.environ["UNITY_NASHELPER_SVC_NAS"] = "{} {} svc_nas".format(sys.executable, SIMULATOR)
+    # inventory cache of --testDR run is kept in the temporary directory
+    os.environ["HOME"] = workdir
+
+def measure(name, function, repeat, results):
+    # run a benchmark and record the median time
+    # input -> benchmark name, function without arguments, number of runs, results dictionary
+    times = []
+    for n in range(repeat):
+        start = time.time()
+        items = function()
+        times.append(time.time() - start)
+    times.sort()
+    results[name] = times[len(times) // 2]
+    print("{:<28} {:>10} {:>10.4f} {:>10.4f}".format(name, items if items is not None else "", times[0], results[name]))
+
+def testDR(options, workdir, nasname):
+    # run "--testDR -nas nasname" from a clean simulator state, existing DR
+    # snapshots are reused
+    # input -> options, temporary directory, nas server name
+    # output -> number of lines printed by unity_nashelper.py
+    shutil.rmtree(os.environ["UNITY_SIM_STATE"], True)
+    cmd = [sys.executable, SCRIPT, "--testDR", "-nas", nasname, "--parallel", str(options["parallel"])]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate("y\n" * 100000)[0]
+    if proc.returncode or output.find("DR test environment ready") < 0:
+        print(output)
+        print("--testDR run failed")
+        exit(1)
+    return len(output.splitlines())
+
+def compare(options, results, filename):
+    # print the ratio of every benchmark to a previous run
+    # input -> options, results dictionary, json file written by --save
+    # output -> True if no benchmark is slower than REGRESSION_THRESHOLD
+    with open(filename) as f:
+        saved = json.load(f)
+    previous = saved["results"]
+    if saved.get("array") != SIZES[options["size"]] or saved.get("latency") != options["latency"]:
+        print("\nwarning: {} was run with array {} and latency {}s".format(filename, saved.get("array"), saved.get("latency")))
+    ok = True
+    print("\n{:<28} {:>10} {:>10} {:>8}".format("compared to " + os.path.basename(filename), "before", "now", "ratio"))
+    for name in sorted(results):
+        if name not in previous or not previous[name]:
+            continue
+        ratio = results[name] / previous[name]
+        flag = ""
+        if ratio > REGRESSION_THRESHOLD:
+            flag = "REGRESSION"
+            ok = False
+        print("{:<28} {:>10.3f} {:>10.3f} {:>7.2f}x {}".format(name, previous[name], results[name], ratio, flag))
+    return ok
+
+def main():
+    options = parseArgs(sys.argv[1:])
+    workdir = tempfile.mkdtemp(prefix="unity_nashelper_bench.")
+    try:
+        setupSimulator(options, workdir)
+        sys.argv = [SCRIPT]
+        sys.path.insert(0, os.path.dirname(SCRIPT))
+        import unity_nashelper as u
+        u.INVENTORY_CACHE_FILE = os.path.join(workdir, "inventory.cache")
+        print("array {} {}, latency {}s, median of {} runs".format(options["size"], SIZES[options["size"]], options["latency"], options["repeat"]))
+        print("\n{:<28} {:>10} {:>10} {:>10}".format("benchmark", "items", "best (s)", "median (s)"))
+        results = {}
+        repeat = options["repeat"]
+
+        lines = subprocess.check_output(u.snapshot_show).splitlines()
+        measure("getItems", lambda: len([u.getItems(line) for line in lines]), repeat, results)
+        for function in (u.getPools, u.getNASservers, u.getFilesystems, u.getShares, u.getSnapshots):
+            measure(function.__name__, lambda: len(function()), repeat, results)
+        measure("loadInventory", lambda: (u.loadInventory(), len(u.snapshots))[1], repeat, results)
+        u.writeInventoryCache(dict((name, getattr(u, var)) for name, function, var, cls in u.INVENTORY_LISTINGS))
+        measure("loadInventory (cached)", lambda: (u.loadInventory(cached=True), len(u.snapshots))[1], repeat, results)
+
+        random.seed(0)
+        fs = random.sample(u.fileSystems, min(LOOKUPS, len(u.fileSystems)))
+        nas = [random.choice(u.nasServers) for n in range(LOOKUPS)]
+        snaps = random.sample(u.snapshots, min(LOOKUPS, len(u.snapshots)))
+        shares = random.sample(u.shares, min(LOOKUPS, len(u.shares)))
+        lookups = [
+            ("getFSbyName", u.getFSbyName, [f.name for f in fs]),
+            ("getFSbyID", u.getFSbyID, [f.id for f in fs]),
+            ("getNASbyName", u.getNASbyName, [n.name for n in nas]),
+            ("getNASbyID", u.getNASbyID, [n.id for n in nas]),
+            ("getSnapByName", u.getSnapByName, [s.name for s in snaps]),
+            ("getSnapByID", u.getSnapByID, [s.id for s in snaps]),
+            ("getSharebyName", u.getSharebyName, [s.name for s in shares]),
+        ]
+        for name, function, keys in lookups:
+            measure(name, lambda: len([function(key) for key in keys]), repeat, results)
+
+        measure("testDR", lambda: testDR(options, workdir, u.nasServers[0].name), 1, results)
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump({"array": SIZES[options["size"]], "latency": options["latency"], "results": results}, f, indent=2, sort_keys=True)
+        if options["compare"] and not compare(options, results, options["compare"]):
+            exit(1)
+    finally:
+        shutil.rmtree(workdir, True)
+
+if __name__ == '__main__':
+    main()
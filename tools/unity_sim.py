@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+"""
+Unity simulator used to run and measure unity_nashelper.py away from a real array
+
+it stands in for both "uemcli" and "svc_nas": the command is taken from the
+first argument (uemcli / svc_nas) or from the name the script is invoked as,
+point unity_nashelper.py to it with
+
+export UNITY_NASHELPER_UEMCLI="python tools/unity_sim.py uemcli"
+export UNITY_NASHELPER_SVC_NAS="python tools/unity_sim.py svc_nas"
+
+synthetic array size, latency and state are driven by environment variables
+
+UNITY_SIM_NAS       number of NAS servers (default 5)
+UNITY_SIM_FS        number of filesystems (default 50)
+UNITY_SIM_SHARES    number of CIFS shares (default 200)
+UNITY_SIM_SNAPS     number of snapshots (default 300)
+UNITY_SIM_POOLS     number of storage pools (default 2)
+UNITY_SIM_LATENCY   seconds slept on every call (default 0)
+UNITY_SIM_STATE     directory holding created/deleted objects between calls
+                    (if not set mutations are accepted but not persisted)
+UNITY_SIM_FAIL      comma separated list of words; a call whose command line
+                    contains one of them fails (e.g. "/stor/prov/fs/cifs")
+UNITY_SIM_BUSY      percent of calls failing with an overload error ("system is
+                    busy"), to exercise retries and circuit breaker (default 0)
+UNITY_SIM_FLAKY     percent of calls failing with a connection error (default 0)
+UNITY_SIM_COMMAS    1 to have descriptions with commas in csv output (default 1)
+
+replicated nas servers are nas01, nas02... with filesystems fs00001, fs00002...
+spread round robin on them, shares share00001... on filesystems and snapshots
+<fs>_snapN (every 20th is a DR testing snapshot <fs>_TESTDR_ddMonYYYY)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+
+ENV = os.environ
+
+def setting(name, default):
+    # integer value of a UNITY_SIM_* environment variable
+    return int(ENV.get("UNITY_SIM_" + name, default))
+
+NAS_COUNT = setting("NAS", 5)
+FS_COUNT = setting("FS", 50)
+SHARE_COUNT = setting("SHARES", 200)
+SNAP_COUNT = setting("SNAPS", 300)
+POOL_COUNT = max(1, setting("POOLS", 2))
+COMMAS = setting("COMMAS", 1)
+BUSY = setting("BUSY", 0)
+FLAKY = setting("FLAKY", 0)
+LATENCY = float(ENV.get("UNITY_SIM_LATENCY", "0"))
+STATE_DIR = ENV.get("UNITY_SIM_STATE", "")
+
+GB = 1024 ** 3
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+NAS_HEADER = ["ID", "Name", "NetBIOS name", "SP", "Storage pool", "Tenant", "Interface",
+              "NFS enabled", "NFSv3 enabled", "NFSv4 enabled", "CIFS enabled",
+              "Multiprotocol sharing enabled", "Unix directory service", "Health state"]
+FS_HEADER = ["ID", "Name", "Description", "Health state", "File system", "Server",
+             "Storage pool ID", "Storage pool", "Format", "Protocol", "Access policy",
+             "Folder rename policy", "Locking policy", "Size", "Size used", "Maximum size",
+             "Protection size used"]
+SNAP_HEADER = ["ID", "Name", "State", "Attached", "Source", "Source Type", "Members",
+               "Attach details"]
+SHARE_HEADER = ["ID", "Name", "Description", "File system", "Local path", "Export path"]
+POOL_HEADER = ["ID", "Name", "Total space", "Remaining space", "Subscription percent",
+               "Number of drives", "RAID level", "Stripe length", "Rebalancing",
+               "Health state", "Protection size used", "Non-base size used"]
+SESSION_HEADER = ["ID", "Name", "Session type", "Synchronization type", "Resource type",
+                  "Sync state", "Health state", "Local role", "Source resource",
+                  "Destination resource"]
+
+
+def size(value):
+    # uemcli size format (i.e. "10737418240 (10.0G)")
+    return "{} ({:.1f}G)".format(value, float(value) / GB)
+
+
+def nasName(i):
+    return "nas{:02d}".format(i)
+
+
+def fsName(j):
+    return "fs{:05d}".format(j)
+
+
+# listings: generators of csv rows of the synthetic array plus objects created in state
+
+def pools(state):
+    for p in range(1, POOL_COUNT + 1):
+        total = 100 * 1024 * GB
+        free = total // (p + 1)
+        yield ["pool_{}".format(p), "pool{}".format(p), size(total), size(free),
+               "{}%".format(40 + p), "12", "RAID5", "5", "no", "OK (5)", size(p * 10 * GB),
+               size(p * 50 * GB)]
+
+
+def nasServers(state):
+    for i in range(1, NAS_COUNT + 1):
+        p = (i - 1) % POOL_COUNT + 1
+        yield ["nas_{}".format(i), nasName(i), nasName(i).upper(), "spa" if i % 2 else "spb",
+               "pool{}".format(p), "tenant{}".format(i % 3) if i % 4 else "", "if_{}".format(i),
+               "yes", "yes", "no", "yes", "no", "", "OK (5)"]
+    for nas_id, name, pool in state["nas_created"]:
+        yield [nas_id, name, name.upper(), "spa", pool, "", "", "no", "no", "no", "no", "no",
+               "", "OK (5)"]
+
+
+def filesystems(state):
+    for j in range(1, FS_COUNT + 1):
+        i = (j - 1) % NAS_COUNT + 1
+        p = (i - 1) % POOL_COUNT + 1
+        total = (j % 20 + 1) * 10 * GB
+        used = total * (j % 9 + 1) // 10
+        description = "filesystem {}, owner team{}".format(j, j % 7) if COMMAS and j % 3 == 0 else ""
+        yield ["res_{}".format(j), fsName(j), description, "OK (5)", "fs_{}".format(j),
+               "nas_{}".format(i), "pool_{}".format(p), "pool{}".format(p), "UFS64", "CIFS",
+               "Native", "Forbidden", "Mandatory", size(total), size(used), size(total * 4),
+               size(used // 10)]
+
+
+def shares(state):
+    for k in range(1, SHARE_COUNT + 1):
+        j = (k - 1) % FS_COUNT + 1
+        description = "share {}, dept {}".format(k, k % 11) if COMMAS and k % 4 == 0 else ""
+        name = "share{:05d}".format(k)
+        yield ["SMBShare_{}".format(k), name, description, "res_{}".format(j),
+               "/dir{}".format(k), "\\\\{}\\{}".format(nasName((j - 1) % NAS_COUNT + 1).upper(), name)]
+
+
+def snapshots(state):
+    deleted = set(state["snaps_deleted"])
+    per_fs = {}
+    for s in range(1, SNAP_COUNT + 1):
+        j = (s - 1) % FS_COUNT + 1
+        snap_id = str(38654705000 + s)
+        if snap_id in deleted:
+            continue
+        n = per_fs.get(j, 0) + 1
+        per_fs[j] = n
+        if s % 20 == 0:
+            name = "{}_TESTDR_{:02d}{}{}".format(fsName(j), s % 28 + 1, MONTHS[s % 12], 2019 + s % 5)
+        else:
+            name = "{}_snap{}".format(fsName(j), n)
+        yield [snap_id, name, "Ready", "no", "res_{}".format(j), "File System",
+               "", ""]
+    for snap_id, name, source in state["snaps_created"]:
+        if snap_id not in deleted:
+            yield [snap_id, name, "Ready", "no", source, "File System", "", ""]
+
+
+def sessions(state):
+    for i in range(1, NAS_COUNT + 1):
+        yield ["81604378625_FNM00{}_{}".format(i, i), "rep_sess_nas_{}".format(i), "nas server",
+               "async", "NAS Server", "Idle", "OK (5)", "Destination", "nas_{}".format(i),
+               "nas_{}".format(i)]
+
+
+def emptyState():
+    return {"snaps_created": [], "snaps_deleted": [], "nas_created": [], "proxy": {},
+            "proxy_shares": {}, "next_id": 1}
+
+
+class State:
+    # objects created/deleted by previous calls, kept in UNITY_SIM_STATE/state.json
+    # (locked for the whole call so that concurrent calls are serialized)
+
+    def __init__(self):
+        self.path = os.path.join(STATE_DIR, "state.json") if STATE_DIR else ""
+        self.fh = None
+        self.data = emptyState()
+
+    def __enter__(self):
+        if self.path:
+            import fcntl
+            if not os.path.isdir(STATE_DIR):
+                os.makedirs(STATE_DIR)
+            self.fh = open(self.path, "a+")
+            fcntl.flock(self.fh, fcntl.LOCK_EX)
+            self.fh.seek(0)
+            text = self.fh.read()
+            if text:
+                self.data = json.loads(text)
+        return self.data
+
+    def __exit__(self, *exc):
+        if self.fh:
+            self.fh.seek(0)
+            self.fh.truncate()
+            self.fh.write(json.dumps(self.data))
+            self.fh.close()
+
+
+def quote(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+def writeCSV(header, rows):
+    out = sys.stdout
+    out.write(",".join(header) + "\n")
+    for row in rows:
+        out.write(",".join(quote(v) for v in row) + "\n")
+
+
+def fail(message, code=1):
+    # uemcli style error
+    sys.stdout.write("Operation failed. Error code: 0x{:x}\n{}\n".format(0x7d13005, message))
+    sys.exit(code)
+
+
+def uemcli(args):
+    # uemcli [options] <object path> [-id ID|-name NAME|-fs ID] show|create|delete [params]
+    options = {}
+    while args and args[0].startswith("-") and args[0] not in ("-id", "-name"):
+        opt = args.pop(0)
+        if opt in ("-u", "-d", "-port", "-p"):
+            options[opt] = args.pop(0)
+    if not args:
+        fail("Missing object path")
+    obj = args.pop(0)
+    qualifier = {}
+    while args and args[0] in ("-id", "-name", "-fs"):
+        key = args.pop(0)
+        qualifier[key] = args.pop(0)
+    action = args.pop(0) if args else "show"
+    params = {}
+    while args:
+        key = args.pop(0)
+        if key == "-detail":
+            params[key] = True
+        elif args:
+            params[key] = args.pop(0)
+    listings = {
+        "/net/nas/server": (NAS_HEADER, nasServers),
+        "/stor/prov/fs": (FS_HEADER, filesystems),
+        "/prot/snap": (SNAP_HEADER, snapshots),
+        "/stor/prov/fs/cifs": (SHARE_HEADER, shares),
+        "/stor/config/pool": (POOL_HEADER, pools),
+        "/prot/rep/session": (SESSION_HEADER, sessions),
+    }
+    with State() as state:
+        if action == "show":
+            if obj not in listings:
+                fail("Unknown object {}".format(obj))
+            header, rows = listings[obj]
+            selected = rows(state)
+            if qualifier:
+                if "-id" in qualifier:
+                    selected = [r for r in selected if r[0] == qualifier["-id"]]
+                if "-name" in qualifier:
+                    selected = [r for r in selected if r[1] == qualifier["-name"]]
+                if "-fs" in qualifier:
+                    selected = [r for r in selected if r[3] == qualifier["-fs"]]
+                if not selected:
+                    fail("The specified object does not exist or has been deleted.")
+            writeCSV(header, selected)
+        elif obj == "/prot/snap" and action == "create":
+            snap_id = str(48654705000 + state["next_id"])
+            state["next_id"] += 1
+            state["snaps_created"].append([snap_id, params.get("-name", ""), params.get("-source", "")])
+            sys.stdout.write("ID = {}\nOperation completed successfully.\n".format(snap_id))
+        elif obj == "/prot/snap" and action == "delete":
+            state["snaps_deleted"].append(qualifier.get("-id", ""))
+            sys.stdout.write("Operation completed successfully.\n")
+        elif obj == "/net/nas/server" and action == "create":
+            nas_id = "nas_{}".format(1000 + state["next_id"])
+            state["next_id"] += 1
+            state["nas_created"].append([nas_id, params.get("-name", ""), params.get("-pool", "")])
+            sys.stdout.write("ID = {}\nOperation completed successfully.\n".format(nas_id))
+        else:
+            fail("Unsupported command {} {}".format(obj, action))
+
+
+def nasExists(state, name):
+    if any(r[1] == name for r in nasServers(state)):
+        return True
+    return False
+
+
+def svc_nas(args):
+    # svc_nas <server> -proxy|-proxy_share -show|-add|-remove [params]
+    if len(args) < 2:
+        sys.stdout.write("usage: svc_nas <server> <command>\n")
+        sys.exit(2)
+    server = args.pop(0)
+    command = args.pop(0)
+    options = {}
+    action = args.pop(0) if args else "-show"
+    while args:
+        key = args.pop(0)
+        options[key] = args.pop(0) if args and not args[0].startswith("-") else ""
+    with State() as state:
+        if not nasExists(state, server):
+            sys.stdout.write("Error 4023: {} : unknown host\n".format(server))
+            sys.exit(1)
+        if command == "-proxy":
+            if action == "-show":
+                if server in state["proxy"]:
+                    sys.stdout.write("{} :\nNAS server: {}\n".format(server, state["proxy"][server]))
+                else:
+                    sys.stdout.write("{} : done\n".format(server))
+            elif action == "-add":
+                target = list(options.keys())[0] if options else ""
+                state["proxy"][server] = target
+                sys.stdout.write("{} : done\n".format(server))
+        elif command == "-proxy_share":
+            table = state["proxy_shares"].setdefault(server, {})
+            if action == "-show":
+                sys.stdout.write("{} :\n".format(server))
+                for name in sorted(table):
+                    target, path = table[name]
+                    sys.stdout.write("share={} target={} path={}\n".format(name, target, path))
+            elif action == "-add":
+                target = [k for k in options if k not in ("-share", "-path")]
+                name = options.get("-share", "")
+                if name in table:
+                    sys.stdout.write("Error 4020: {} : share {} already exists\n".format(server, name))
+                    sys.exit(1)
+                table[name] = [target[0] if target else "", options.get("-path", "")]
+                sys.stdout.write("{} : commands processed: 1\ncommand(s) succeeded\n".format(server))
+            elif action == "-remove":
+                name = options.get("-share", "")
+                if name not in table:
+                    sys.stdout.write("Error 4020: {} : share {} not found\n".format(server, name))
+                    sys.exit(1)
+                del table[name]
+                sys.stdout.write("{} : commands processed: 1\ncommand(s) succeeded\n".format(server))
+        else:
+            sys.stdout.write("Error 2100: {} : unknown command {}\n".format(server, command))
+            sys.exit(1)
+
+
+def main():
+    args = sys.argv[1:]
+    tool = os.path.basename(sys.argv[0])
+    if args and args[0] in ("uemcli", "svc_nas"):
+        tool = args.pop(0)
+    if LATENCY:
+        time.sleep(LATENCY)
+    for word in ENV.get("UNITY_SIM_FAIL", "").split(","):
+        if word and word in " ".join(args):
+            fail("Simulated failure ({})".format(word), 2)
+    chance = random.uniform(0, 100)
+    if chance < BUSY:
+        fail("The system is busy. Try again later.", 2)
+    if chance < BUSY + FLAKY:
+        fail("Unable to connect to the storage system: connection reset by peer", 3)
+    try:
+        if tool.startswith("svc_nas"):
+            svc_nas(args)
+        else:
+            uemcli(args)
+        sys.stdout.flush()
+    except IOError:
+        # reader closed the pipe before the end of a listing
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -26,10 +26,32 @@ to test NAS DR using Proxy NAS feature following macro steps are automated by th
 """
 
 from sys import argv
+import sys
 import os
 import subprocess
 import datetime
 import time
+import threading
+import Queue
+import marshal
+import csv
+import pipes
+import re
+import json
+import math
+import atexit
+import contextlib
+import fnmatch
+import collections
+import heapq
+import itertools
+import array
+import bisect
+import socket
+import signal
+import random
+import hashlib
+import SocketServer
 
 d = datetime.datetime.now()
 
@@ -43,25 +65,70 @@ script = argv[0]
 version="1.0.0"
 
 debug = 0 # from 0 to 3 to increase output verbosity
+parallel = 1 # number of filesystems set up concurrently by --testDR (--parallel N)
+refresh = False # True to ignore the local inventory cache (--refresh)
+traceFile = "" # json lines trace of external commands written at exit (--trace FILE)
+outputFormat = "" # json, jsonl or csv output of --show* commands (--output FORMAT)
+planFile = "" # --testDR writes the plan of its actions to this file instead of running them (--plan FILE)
+resume = False # True to skip --testDR steps completed by the previous run (--resume)
+columnar = False # True to keep --show* listings in columns and build objects only for displayed rows (--columnar)
+sudoBatch = False # True to run svc_nas batches through one "sudo -n sh" when svc_nas is run through sudo (--sudo-batch)
+serving = False # True while --daemon answers queries from its in-memory inventory
 
 # Customization
 DRTEST_PROXYNAS_SUFFIX = "_TESTDR"
 DRTEST_SNAP_SUFFIX = "_TESTDR_" + d.today().strftime("%d%b%Y")
 DRTEST_SNAP_RETENTION = "15d" # 15 Days of DR Testing Snapshot retention
+DRTEST_PLAN_VERSION = 1 # format of --plan files
+DRTEST_PURGE_RATE = 5 # max DR snapshots deleted per second by --purgeSNAP (--rate N to change it)
+DRTEST_JOURNAL_FILE = os.path.expanduser("~/.unity_nashelper.journal") # completed --testDR steps, read by --resume (one file per set of nas servers)
+INVENTORY_CACHE_FILE = os.path.expanduser("~/.unity_nashelper.cache") # inventory used by --show* commands
+INVENTORY_CACHE_TTL = 300 # seconds a cached inventory is valid (--ttl N to change it, --refresh to bypass it)
+SVC_NAS_BATCH_SIZE = 200 # max svc_nas commands run by a single shell (sudo shell only with --sudo-batch)
+DAEMON_SOCKET = os.path.expanduser("~/.unity_nashelper.sock") # UNIX socket of --daemon, used by --show* commands when present
+DAEMON_REFRESH_INTERVAL = 60 # seconds between two inventory refreshes of --daemon (--interval N to change it)
+INVENTORY_EVENTS_KEPT = 10000 # change events found by inventory refreshes kept until read
+REPORT_TOP = 10 # filesystems with the least growth headroom listed by --report capacity (--top N to change it)
+MAX_PROCESSES = 8 # max uemcli/svc_nas processes running at the same time (--maxproc N to change it, --parallel N if larger)
+SVC_NAS_PROCESSES_SHARE = 0.5 # share of MAX_PROCESSES for svc_nas processes (or batches) running at the same time
+COMMAND_TIMEOUTS = {"uemcli": 600, "svc_nas": 300} # seconds before a command is stopped (--timeout N to change both)
+SVC_NAS_BATCH_COMMAND_TIMEOUT = 10 # seconds added to the svc_nas timeout of a batch for every command in it
+KILL_GRACE = 5 # seconds between SIGTERM and SIGKILL of a command stopped
+MAX_CALL_RATE = 0 # max uemcli/svc_nas calls started per second, 0 for no limit (--maxrate N to set one)
+RETRY_ATTEMPTS = 4 # retries of a uemcli/svc_nas call failing with a transient error (--retries N to change it)
+RETRY_DELAY = 1 # seconds before the first retry, doubled at every retry (with random jitter)
+RETRY_MAX_DELAY = 30 # max seconds between two retries
+BREAKER_PAUSE = 30 # seconds every uemcli/svc_nas call waits after the array reports overload
+BREAKER_MAX_PAUSE = 300 # max pause, doubled while the array keeps reporting overload
+# uemcli/svc_nas errors worth a retry: the call was refused by an overloaded management
+# service (pauses every call, circuit breaker) or did not reach the array, in both cases
+# nothing was done and any call can run again; after other transient errors the call
+# may have been done, only calls that read are run again
+OVERLOAD_ERRORS = re.compile(r"the (storage )?system is (too )?busy|management (service|server) is (busy|overloaded)|too many (concurrent )?requests|request (was )?throttled|503 service unavailable", re.I)
+UNREACHABLE_ERRORS = re.compile(r"connection refused|(unable|cannot|could not|failed) to connect|no route to host|network is unreachable", re.I)
+TRANSIENT_ERRORS = re.compile(r"connection (reset|closed|aborted|timed out)|temporarily unavailable|operation timed out", re.I)
 
-cli = "/usr/bin/uemcli -silent"
+# uemcli and svc_nas commands can be replaced (i.e. by tools/unity_sim.py away from a real array)
+cli = os.environ.get("UNITY_NASHELPER_UEMCLI", "/usr/bin/uemcli") + " -silent"
+svcnas = os.environ.get("UNITY_NASHELPER_SVC_NAS", "sudo -n svc_nas")
+if svcnas.split()[0] == "sudo" and "-n" not in svcnas.split():
+    # commands run in the background (see startProcess), sudo must fail instead of asking a password
+    svcnas = "sudo -n" + svcnas[len("sudo"):]
 uemcli_user = "admin"
 nasServer_show = (cli + " /net/nas/server show -output csv").split()
 filesystem_show = (cli + " /stor/prov/fs show -output csv").split()
 snapshot_show = (cli + " /prot/snap show -output csv").split()
 share_show = (cli + " /stor/prov/fs/cifs show -output csv").split()
 pool_show = (cli + " /stor/config/pool show -output csv").split()
+replication_show = (cli + " /prot/rep/session show -detail -output csv").split()
 
 # input value of filesystem and nas server, snapshot is fs + DRTEST_SNAP_SUFFIX
 fileSystem=""
 share=""
 snapshot=""
 nasServer=""
+drNasServers=[] # nas server names given to --testDR
+allReplicated = False # --testDR of all replicated nas servers (--all-replicated)
 pool_id=""
 # list of all fs / nas server / snap / cifs shares from unity system
 fileSystems=[]
@@ -81,8 +148,17 @@ def usage():
     -----
 
     to automate creation of Unity XT NAS disaster recovery testing env:
-    {} --testDR -nas NASserverName
+    {} --testDR -nas NASserverName [NASserverName ...] [--parallel N] [--maxproc N]
+    {} --testDR --all-replicated [--parallel N] [--maxproc N]
+    (add --resume to continue a --testDR run stopped halfway with the same NAS servers)
+
+    to write the actions of a --testDR run to a file without running them, then run them:
+    {} --testDR -nas NASserverName [NASserverName ...] --plan plan.json
+    {} --apply plan.json [--maxproc N]
     
+    to delete DR snapshots older than N days (default {}) or not used by proxy shares:
+    {} --purgeSNAP [Filesystem|pattern|NASserverName ...] [--older-than N] [--unattached] [--dry-run] [--rate N]
+
     to show Proxy NAS share(s) info:
     {} --showPROXYSHARE NASserverName
 
@@ -92,14 +168,30 @@ def usage():
     to create a filesystem snapshot:
     {} --snap Filesystem <snap name>
 
+    to create snapshots of several filesystems at the same time (filesystem names,
+    glob patterns like "fs0*" or NAS server names for all their filesystems):
+    {} --snap Filesystem|pattern|NASserverName [...] [-name <snap name>] [--maxproc N]
+
+    to keep the inventory in memory and answer --show* commands of other runs (NAS, FS,
+    SNAP, SHARE, NASFS, NASSHARE) from it, they run directly when no daemon is running:
+    {} --daemon [--interval N]
+    (every refresh prints the objects created, deleted or changed since the previous one)
+
+    to report provisioned, used and snapshot protection space per pool, NAS server and
+    tenant, and the filesystems with the least growth headroom:
+    {} --report capacity [--top N]
+
     to show NAS server(s) info:
     {} --showNAS NASserverName
 
     to show file system(s) info:
     {} --showFS <filesystem name>
 
-    to show snapshot(s) info:
+    to show snapshot(s) info (filters are applied while the listing is read, --limit N
+    stops reading after N snapshots or keeps the first N of --sort id|name|state|source,
+    -column for descending order):
     {} --showSNAP <snap name>
+    {} --showSNAP [<snap name>] [-fs Filesystem] [-prefix P] [-match REGEX] [-state S] [--dr] [--limit N] [--sort column]
 
     to show share(s) info:
     {} --showSHARE <share name>
@@ -111,7 +203,39 @@ def usage():
     {} --showNASSHARE <share name>
 
     add --debug switch to see verbose output
-    '''.format(script,script,script,script,script,script,script,script,script,script))
+
+    --plan reuses DR snapshots already present, edit the "action" of a snapshot in the plan
+    file ("create", "reuse", "recreate") before --apply to change it
+
+    add --output json|jsonl|csv switch to --show* and --report commands to get all the
+    columns of the objects (sizes in bytes) in a format for other programs
+
+    add --timings switch to print at exit how long uemcli/svc_nas commands took by phase and
+    by command type, --trace FILE to also write every command to FILE (json lines)
+
+    add --parallel N switch to --testDR to set up snapshot and proxy shares of N filesystems at the same time
+    (with several NAS servers they are all set up at the same time, --maxproc N limits the
+    uemcli/svc_nas commands running at the same time, default {} or --parallel N if larger,
+    svc_nas commands are limited to half of them)
+
+    proxy share svc_nas commands run one by one through "sudo -n svc_nas", add --sudo-batch
+    switch to --testDR and --apply to run up to {} of them through one "sudo -n sh -s":
+    sudo must then allow sh without password to the service account (a root shell, wider
+    than svc_nas alone), i.e. in sudoers "service ALL=(root) NOPASSWD: /bin/sh"
+
+    add --timeout N switch to stop a uemcli/svc_nas command still running after N seconds
+    (default {} for uemcli, {} for svc_nas), interrupt twice to stop running commands
+
+    uemcli/svc_nas calls refused by a busy array or not reaching it (and "show" calls
+    failing with a transient error) are retried with an exponential backoff, --retries N changes the number of retries (default {}),
+    when the array reports overload every call is paused for {} seconds or more,
+    --maxrate N limits the calls started per second (default no limit)
+
+    --show* commands use a local inventory cache valid for {} seconds:
+    add --refresh switch to bypass it, --ttl N to change its validity
+    (add --columnar switch on very large arrays to keep listings in compact columns
+    and build objects only for the NAS servers, filesystems, shares and snapshots shown)
+    '''.format(script,script,script,script,snapRetentionDays(),script,script,script,script,script,script,script,script,script,script,script,script,script,script,MAX_PROCESSES,SVC_NAS_BATCH_SIZE,COMMAND_TIMEOUTS["uemcli"],COMMAND_TIMEOUTS["svc_nas"],RETRY_ATTEMPTS,BREAKER_PAUSE,INVENTORY_CACHE_TTL))
 
 def about():
 	# print about
@@ -123,27 +247,144 @@ Helper script to make easier some unity tasks
 '''.format(script,version))
 
 
+def decodeText(value):
+    # uemcli csv value without enclosing quotes
+    return value.strip('"')
+
+def decodeSize(value):
+    # uemcli csv size value in bytes, i.e. "107374182400 (100.0G)" -> "107374182400"
+    # (the same value can be decoded more than once)
+    return value.split("(")[0].strip().strip('"')
+
+
+class Field(object):
+    # record column decoded on first access, decoded value replaces the raw one
+    # in the record row and a bit of the record mask marks it as decoded
+
+    def __init__(self, index, decode=decodeText):
+        self.index = index
+        self.bit = 1 << index
+        self.decode = decode
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        row = obj._row
+        if not obj._decoded & self.bit:
+            if row[self.index] is None:
+                # value not known yet (record built without a uemcli show)
+                obj.load()
+            row[self.index] = self.decode(row[self.index])
+            obj._decoded |= self.bit
+        return row[self.index]
+
+    def export(self, obj):
+        # decoded value for --output, sizes as integers (None if not available)
+        value = self.__get__(obj, None)
+        if self.decode is decodeSize:
+            return int(value) if value.isdigit() else None
+        return value
+
+
+class Record(object):
+    # compact uemcli csv row: raw values are kept in a list and decoded only when
+    # an attribute is read (see Field), values of "interned" columns are shared
+    # between records; values not known (None) are read with a uemcli show of the
+    # record id the first time one of them is needed
+    __slots__ = ("_row", "_decoded")
+    columns = ()
+    interned = ()
+    objectPath = "" # uemcli object path
+
+    def __init__(self, row):
+        for n in self.interned:
+            if type(row[n]) is str:
+                row[n] = intern(row[n])
+        self._row = row
+        self._decoded = 0
+
+    def row(self):
+        # raw (or already decoded) values of the record, in columns order
+        return self._row
+
+    def load(self):
+        # read the values not known yet with "uemcli <objectPath> -id <id> show"
+        # (values still not available are set to "")
+        if debug > 0:
+            print("calling {}.load({})".format(self.__class__.__name__, self._row[0]))
+        cmd = cli.split() + [self.objectPath, "-id", self._row[0], "show", "-output", "csv"]
+        try:
+            found = list(iterRecords(cmd, self.__class__))
+        except Exception as e:
+            if debug > 0:
+                print("could not read {} ({}): {}".format(self.__class__.__name__, self._row[0], e))
+            found = []
+        values = found[0]._row if found else [""] * len(self._row)
+        for n, value in enumerate(values):
+            if self._row[n] is None:
+                self._row[n] = intern(value) if n in self.interned else value
+
+    @classmethod
+    def fields(cls):
+        # (attribute name, Field) of the record class in columns order
+        if "_fields" not in cls.__dict__:
+            found = [(field.index, name, field) for klass in reversed(cls.__mro__) for name, field in vars(klass).items() if isinstance(field, Field)]
+            cls._fields = [(name, field) for index, name, field in sorted(found)]
+        return cls._fields
+
+    def sameRow(self, row):
+        # True if a csv row (as returned by iterRows) has the values of the record,
+        # columns already decoded are compared with the decoded csv value
+        if len(row) != len(self._row):
+            return False
+        if not self._decoded:
+            return row == self._row
+        for name, field in self.fields():
+            if self._decoded & field.bit and field.decode(row[field.index]) != self._row[field.index]:
+                return False
+        return all(self._decoded & (1 << n) or value == current for n, (value, current) in enumerate(zip(row, self._row)))
+
+    def values(self):
+        # decoded values of all the columns (see Field.export) in columns order
+        return [field.export(self) for name, field in self.fields()]
+
+    @classmethod
+    def fromRow(cls, row):
+        # create a record from a list returned by row() (marshal keeps strings interned)
+        record = cls.__new__(cls)
+        record._row = row
+        record._decoded = 0
+        return record
+
+
 """
 NAS SERVER
 ID,Name,NetBIOS name,SP,Storage pool,Tenant,Interface,NFS enabled,NFSv3 enabled,NFSv4 enabled,CIFS enabled,Multiprotocol sharing enabled,Unix directory service,Health state
 """
 
 
-class Pool:
+class Pool(Record):
+    # uemcli csv header of the constructor arguments
+    columns = ("ID", "Name", "Total space", "Remaining space|Free space", "Subscription percent", "Number of drives|Drives", "RAID level", "Stripe length", "Rebalancing", "Health state", "Protection size used", "Non-base size used")
+    objectPath = "/stor/config/pool"
+    __slots__ = ()
+    id = Field(0)
+    name = Field(1)
+    totalspace = Field(2, decodeSize)
+    freespace = Field(3, decodeSize)
+    subscriptionpercent = Field(4)
+    numberofdrives = Field(5)
+    raidlevel = Field(6)
+    stripelength = Field(7)
+    rebalancing = Field(8)
+    health = Field(9)
+    protectionsize = Field(10, decodeSize)
+    nonbasesizeused = Field(11, decodeSize)
+    # columns with few distinct values (raidlevel, stripelength, rebalancing, health)
+    interned = (6, 7, 8, 9)
 
     def __init__(self,id,name,totalspace,freespace,subscriptionpercent,numberofdrives,raidlevel,stripelength,rebalancing,health,protectionsize,nonbasesizeused):
-	self.id = id.strip('"')
-	self.name = name.strip('"')
-	self.totalspace = totalspace.split("(")[0][0:-1].strip('"')
-	self.freespace = freespace.split("(")[0][0:-1].strip('"')
-	self.subscriptionpercent = subscriptionpercent.strip('"')
-	self.numberofdrives = numberofdrives.strip('"')
-	self.raidlevel = raidlevel.strip('"')
-	self.stripelength = stripelength.strip('"')
-	self.rebalancing = rebalancing.strip('"')
-	self.health = health .strip('"')
-	self.protectionsize = protectionsize.split("(")[0][0:-1].strip('"')
-	self.nonbasesizeused = nonbasesizeused.split("(")[0][0:-1].strip('"')
+        Record.__init__(self, [id, name, totalspace, freespace, subscriptionpercent, numberofdrives, raidlevel, stripelength, rebalancing, health, protectionsize, nonbasesizeused])
 
     def show(self):
 	print("id: {}".format(self.id))
@@ -159,24 +400,31 @@ class Pool:
         return cond
 	
 
-class Nasserver:
+class Nasserver(Record):
+    # uemcli csv header of the constructor arguments
+    columns = ("ID", "Name", "NetBIOS name", "SP", "Storage pool", "Tenant", "Interface", "NFS enabled", "NFSv3 enabled", "NFSv4 enabled", "CIFS enabled", "Multiprotocol sharing enabled", "Unix directory service", "Health state")
+    objectPath = "/net/nas/server"
+    __slots__ = ()
+    id = Field(0)
+    name = Field(1)
+    netbios = Field(2)
+    sp = Field(3)
+    poolname = Field(4)
+    tenant = Field(5)
+    interface = Field(6)
+    nfsEnabled = Field(7)
+    nfs3Enabled = Field(8)
+    nfs4Enabled = Field(9)
+    cifsEnabled = Field(10)
+    multiprotocol = Field(11)
+    unixDirectoryService = Field(12)
+    health = Field(13)
+    # columns with few distinct values (sp, poolname, tenant, nfsEnabled, nfs3Enabled, nfs4Enabled, cifsEnabled, multiprotocol, unixDirectoryService, health)
+    interned = (3, 4, 5, 7, 8, 9, 10, 11, 12, 13)
 
     def __init__(self, id, name, netbios, sp, poolname, tenant, interface, nfsEnabled, nfs3Enabled, nfs4Enabled, cifsEnabled, multiprotocol, unixDirectoryService, health):
-        self.id = id.strip('"')
-        self.name = name.strip('"')
-        self.netbios = netbios.strip('"')
-        self.sp = sp.strip('"')
-        self.poolname = poolname.strip('"')
-        self.tenant = tenant.strip('"')
-        self.interface = interface.strip('"')
-        self.nfsEnabled = nfsEnabled.strip('"')
-        self.nfs3Enabled = nfs3Enabled.strip('"')
-        self.nfs4Enabled = nfs4Enabled.strip('"')
-        self.cifsEnabled = cifsEnabled.strip('"')
-        self.multiprotocol = multiprotocol.strip('"')
-        self.unixDirectoryService = unixDirectoryService.strip('"')
-        self.health = health.strip('"')
-    
+        Record.__init__(self, [id, name, netbios, sp, poolname, tenant, interface, nfsEnabled, nfs3Enabled, nfs4Enabled, cifsEnabled, multiprotocol, unixDirectoryService, health])
+
     def show(self):
 	print("id: {}".format(self.id))
 	print("name: {}".format(self.name))
@@ -199,16 +447,23 @@ CIFS SHARE
 ID,Name,Description,File system,Local path,Export path
 
 """
-class Share:
+class Share(Record):
+    # uemcli csv header of the constructor arguments
+    columns = ("ID", "Name", "Description", "File system", "Local path", "Export path")
+    objectPath = "/stor/prov/fs/cifs"
+    __slots__ = ()
+    id = Field(0)
+    name = Field(1)
+    description = Field(2)
+    filesystem = Field(3)
+    path = Field(4)
+    export = Field(5)
+    # columns with few distinct values (filesystem)
+    interned = (3,)
 
     def __init__(self, id, name, description, filesystem, path, export):
-        self.id = id.strip('"')
-        self.name = name.strip('"')
-        self.description = description.strip('"')
-        self.filesystem = filesystem.strip('"')
-        self.path = path.strip('"')
-        self.export = export.strip('"')
-    
+        Record.__init__(self, [id, name, description, filesystem, path, export])
+
     def show(self):
 	print("id: {}".format(self.id))
 	print("name: {}".format(self.name))
@@ -222,26 +477,33 @@ class Share:
 FILESYSTEM
 ID,Name,Description,Health state,File system,Server,Storage pool ID,Storage pool,Format,Protocol,Access policy,Folder rename policy,Locking policy,Size,Size used,Maximum size,Protection size used
 """
-class Filesystem:
+class Filesystem(Record):
+    # uemcli csv header of the constructor arguments
+    columns = ("ID", "Name", "Description", "Health state", "File system", "Server", "Storage pool ID", "Storage pool", "Format", "Protocol", "Access policy", "Folder rename policy", "Locking policy", "Size", "Size used", "Maximum size", "Protection size used")
+    objectPath = "/stor/prov/fs"
+    __slots__ = ()
+    id = Field(0)
+    name = Field(1)
+    description = Field(2)
+    health = Field(3)
+    filesystem = Field(4)
+    server = Field(5)
+    poolid = Field(6)
+    poolname = Field(7)
+    format = Field(8)
+    protocol = Field(9)
+    accessPolicy = Field(10)
+    folderRenamePolicy = Field(11)
+    lockingPolicy = Field(12)
+    size = Field(13, decodeSize)
+    sizeused = Field(14, decodeSize)
+    maxsize = Field(15, decodeSize)
+    protsizeused = Field(16, decodeSize)
+    # columns with few distinct values (health, server, poolid, poolname, format, protocol, accessPolicy, folderRenamePolicy, lockingPolicy)
+    interned = (3, 5, 6, 7, 8, 9, 10, 11, 12)
 
     def __init__(self, id, name, description,health,filesystem,server,poolid,poolname,format,protocol,accessPolicy,folderRenamePolicy,lockingPolicy,size,sizeused,maxsize,protsizeused):
-        self.id = id.strip('"')
-        self.name = name.strip('"')
-        self.description = description.strip('"')
-        self.health = health.strip('"')
-        self.filesystem = filesystem.strip('"')
-        self.server = server.strip('"')
-        self.poolid = poolid.strip('"')
-        self.poolname = poolname.strip('"')
-        self.format = format.strip('"')
-        self.protocol = protocol.strip('"')
-        self.accessPolicy = accessPolicy.strip('"')
-        self.folderRenamePolicy = folderRenamePolicy.strip('"')
-        self.lockingPolicy = lockingPolicy.strip('"')
-        self.size = size.split("(")[0][0:-1].strip('"')
-        self.sizeused = sizeused.split("(")[0][0:-1].strip('"')
-        self.maxsize = maxsize.split("(")[0][0:-1].strip('"')
-        self.protsizeused = protsizeused.split("(")[0][0:-1].strip('"')
+        Record.__init__(self, [id, name, description, health, filesystem, server, poolid, poolname, format, protocol, accessPolicy, folderRenamePolicy, lockingPolicy, size, sizeused, maxsize, protsizeused])
 
     def show(self):
 	print("id: {}".format(self.id))
@@ -260,16 +522,24 @@ class Filesystem:
 SNAPSHOT
 ID,Name,State,Attached,Source,Source Type,Members,Attach details
 """
-class Snapshot:
+class Snapshot(Record):
+    # uemcli csv header of the constructor arguments
+    columns = ("ID", "Name", "State", "Attached", "Source", "Source Type", "Members", "Attach details")
+    objectPath = "/prot/snap"
+    __slots__ = ()
+    id = Field(0)
+    name = Field(1)
+    state = Field(2)
+    attached = Field(3)
+    source = Field(4)
+    sourcetype = Field(5)
+    members = Field(6)
+    attachDetails = Field(7)
+    # columns with few distinct values (state, attached, source, sourcetype)
+    interned = (2, 3, 4, 5)
 
     def __init__(self, id, name, state,attached,source,sourcetype,members,attachDetails):
-        self.id = id.strip('"')
-        self.name = name.strip('"')
-        self.state = state.strip('"')
-        self.source = source.strip('"')
-        self.sourcetype = sourcetype.strip('"')
-        self.members = members.strip('"')
-        self.attachDetails = attachDetails.strip('"')
+        Record.__init__(self, [id, name, state, attached, source, sourcetype, members, attachDetails])
 
     def show(self):
         print("id: {}".format(self.id))
@@ -283,7 +553,99 @@ class Snapshot:
         cond = self.state
         return cond
 
-  
+
+class Inventory(object):
+    # unity objects of the uemcli listings indexed in one pass by id, by name
+    # (first object listed with that name, as a scan of the list would return)
+    # and by relationship: nas server id -> filesystems, filesystem id -> shares,
+    # filesystem id -> snapshots (Snapshot.source)
+
+    def __init__(self, filesystems=None, nasservers=None, snapshots=None, shares=None, pools=None):
+        # lists are extended in place by add* methods: a new list for every one not given
+        self.lock = threading.Lock()
+        self.filesystems = filesystems = filesystems if filesystems is not None else []
+        self.nasservers = nasservers = nasservers if nasservers is not None else []
+        self.snapshots = snapshots = snapshots if snapshots is not None else []
+        self.shares = shares = shares if shares is not None else []
+        self.pools = pools = pools if pools is not None else []
+        self.fsById = {}
+        self.fsByName = {}
+        self.fsByNas = {}
+        for fs in filesystems:
+            self.fsById[fs.id] = fs
+            self.fsByName.setdefault(fs.name, fs)
+            self.fsByNas.setdefault(fs.server, []).append(fs)
+        self.nasById = {}
+        self.nasByName = {}
+        for nas in nasservers:
+            self.nasById[nas.id] = nas
+            self.nasByName.setdefault(nas.name, nas)
+        self.snapById = {}
+        self.snapByName = {}
+        self.snapsByFs = {}
+        for snap in snapshots:
+            self.snapById[snap.id] = snap
+            self.snapByName.setdefault(snap.name, snap)
+            self.snapsByFs.setdefault(snap.source, []).append(snap)
+        self.shareById = {}
+        self.shareByName = {}
+        self.sharesByFs = {}
+        for share in shares:
+            self.shareById[share.id] = share
+            self.shareByName.setdefault(share.name, share)
+            self.sharesByFs.setdefault(share.filesystem, []).append(share)
+        self.poolById = {}
+        self.poolByName = {}
+        for pool in pools:
+            self.poolById[pool.id] = pool
+            self.poolByName.setdefault(pool.name, pool)
+
+    def filesystemsOf(self, nasID):
+        # filesystems served by a nas server id
+        return self.fsByNas.get(nasID, [])
+
+    def sharesOf(self, fsID):
+        # shares exported from a filesystem id
+        return self.sharesByFs.get(fsID, [])
+
+    def snapshotsOf(self, fsID):
+        # snapshots of a filesystem id
+        return self.snapsByFs.get(fsID, [])
+
+    def addSnapshot(self, snap):
+        # add a newly created snapshot to snapshot list and indexes
+        with self.lock:
+            self.snapshots.append(snap)
+            self.snapById[snap.id] = snap
+            self.snapByName.setdefault(snap.name, snap)
+            self.snapsByFs.setdefault(snap.source, []).append(snap)
+
+    def removeSnapshot(self, snapID):
+        # remove a deleted snapshot from snapshot list and indexes
+        with self.lock:
+            snap = self.snapById.pop(snapID, None)
+            if snap is None:
+                return
+            self.snapshots.remove(snap)
+            self.snapsByFs[snap.source].remove(snap)
+            if self.snapByName.get(snap.name) is snap:
+                del self.snapByName[snap.name]
+                for other in self.snapshots:
+                    if other.name == snap.name:
+                        self.snapByName[snap.name] = other
+                        break
+
+    def addNasserver(self, nas):
+        # add a newly created nas server to nas server list and indexes
+        with self.lock:
+            self.nasservers.append(nas)
+            self.nasById[nas.id] = nas
+            self.nasByName.setdefault(nas.name, nas)
+
+inventory = Inventory() # indexes of the global object lists, rebuilt by loadInventory()
+inventoryLock = threading.RLock() # held while global object lists are replaced and by --daemon queries
+
+
 def secondsInHumanReadableTime(seconds):
     # get time expressed in seconds and return time in days, hours, minutes....
     # input -> seconds
@@ -393,20 +755,398 @@ def getattrs(obj):
     print("ATTR \'%s\'->%r" % (obj.__class__.__name__, obj.__dict__.keys()))
 
 
+class ThreadOutput(object):
+    # stdout replacement used while worker threads are running:
+    # what a worker prints is kept in its own buffer, main thread writes go through
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, "buffer", None)
+        if buf is None:
+            self.stream.write(text)
+        else:
+            buf.append(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def capture(self):
+        # start collecting output of the calling thread
+        self.local.buffer = []
+
+    def release(self):
+        # stop collecting output of the calling thread and return it
+        text = "".join(self.local.buffer)
+        self.local.buffer = None
+        return text
+
+
+def commandType(cmd):
+    # short name of an external command used to group timings
+    # (i.e. "uemcli /prot/snap create", "svc_nas -proxy_share -show")
+    # input -> command line as string or argument list
+    # output -> string
+    words = cmd.split() if isinstance(cmd, basestring) else list(cmd)
+    silent = words.index("-silent") if "-silent" in words else len(words)
+    for n, word in enumerate(words):
+        if word.startswith("/") and n > silent:
+            # uemcli object path (after cli options), action follows the object
+            # qualifiers (-id ID, -name NAME...)
+            m = n + 1
+            while m < len(words) and words[m].startswith("-"):
+                m += 2
+            return "uemcli {} {}".format(word, words[m] if m < len(words) else "")
+        if word in ("-proxy", "-proxy_share"):
+            return "svc_nas {} {}".format(word, words[n+1] if n + 1 < len(words) else "")
+    return os.path.basename(words[0]) if words else ""
+
+class Timings(object):
+    # wall clock time and exit status of external commands (uemcli, svc_nas) grouped
+    # by phase of the run (inventory, proxy NAS, snapshot, proxy shares), collected
+    # when --timings is set and printed at exit
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.commands = [] # (phase, phase object, command type, command, start, elapsed, wait, status)
+        self.phases = [] # (phase, phase object, start, elapsed)
+
+    def current(self):
+        # phase of the calling thread
+        return getattr(self.local, "phase", ("other", ""))
+
+    @contextlib.contextmanager
+    def phase(self, kind, obj=""):
+        # commands run by the calling thread inside a "with" block belong to phase kind of object obj
+        previous = self.current()
+        self.local.phase = (kind, obj)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.local.phase = previous
+            if self.enabled:
+                with self.lock:
+                    self.phases.append((kind, obj, start, time.time() - start))
+
+    def command(self, cmd, start, wait, status, ctype=None):
+        # record an external command started at start (after waiting wait seconds for a process slot)
+        if not self.enabled:
+            return
+        elapsed = time.time() - start
+        if not isinstance(cmd, basestring):
+            cmd = " ".join(cmd)
+        kind, obj = self.current()
+        with self.lock:
+            self.commands.append((kind, obj, ctype or commandType(cmd), cmd, start, elapsed, wait, status))
+
+    def percentile(self, values, q):
+        # nearest rank percentile of a sorted list
+        return values[max(0, int(math.ceil(q * len(values))) - 1)]
+
+    def byType(self):
+        # command type -> sorted list of elapsed times, number of failures
+        types = {}
+        for kind, obj, ctype, cmd, start, elapsed, wait, status in self.commands:
+            times, failed = types.get(ctype, ([], 0))
+            times.append(elapsed)
+            types[ctype] = (times, failed + (status != 0))
+        for times, failed in types.values():
+            times.sort()
+        return types
+
+    def summary(self):
+        # print timings of phases and of commands by type
+        if self.phases:
+            print("\n{:<16} {:>6} {:>10} {:>10} {:>10}  {}".format("phase", "runs", "wall (s)", "total (s)", "max (s)", "slowest"))
+        kinds = []
+        for kind, obj, start, elapsed in self.phases:
+            if kind not in kinds:
+                kinds.append(kind)
+        for kind in kinds:
+            phases = [(start, elapsed, obj) for k, obj, start, elapsed in self.phases if k == kind]
+            wall = max(start + elapsed for start, elapsed, obj in phases) - min(start for start, elapsed, obj in phases)
+            slowest = max(phases, key=lambda phase: phase[1])
+            print("{:<16} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}  {}".format(kind, len(phases), wall, sum(elapsed for start, elapsed, obj in phases), slowest[1], slowest[2]))
+        print("\n{:<36} {:>6} {:>6} {:>10} {:>8} {:>8} {:>8}".format("command", "count", "failed", "total (s)", "p50", "p95", "max"))
+        types = self.byType()
+        for ctype in sorted(types, key=lambda t: -sum(types[t][0])):
+            times, failed = types[ctype]
+            print("{:<36} {:>6} {:>6} {:>10.2f} {:>8.3f} {:>8.3f} {:>8.3f}".format(ctype, len(times), failed, sum(times), self.percentile(times, 0.5), self.percentile(times, 0.95), times[-1]))
+        waited = sum(wait for kind, obj, ctype, cmd, start, elapsed, wait, status in self.commands)
+        if waited >= 0.01:
+            print("\ncommands waited {:.2f}s in total for a free process slot (--maxproc {})".format(waited, MAX_PROCESSES))
+        clientPolicy.report()
+
+    def writeTrace(self, filename):
+        # write phases, commands and per command type breakdown as json lines
+        with open(filename, "w") as f:
+            for kind, obj, start, elapsed in self.phases:
+                f.write(json.dumps({"event": "phase", "phase": kind, "object": obj, "start": start, "elapsed": elapsed}) + "\n")
+            for kind, obj, ctype, cmd, start, elapsed, wait, status in self.commands:
+                f.write(json.dumps({"event": "command", "phase": kind, "object": obj, "type": ctype, "command": cmd, "start": start, "elapsed": elapsed, "wait": wait, "status": status}) + "\n")
+            types = self.byType()
+            for ctype in sorted(types):
+                times, failed = types[ctype]
+                f.write(json.dumps({"event": "summary", "type": ctype, "count": len(times), "failed": failed, "total": sum(times), "p50": self.percentile(times, 0.5), "p95": self.percentile(times, 0.95), "max": times[-1]}) + "\n")
+
+timings = Timings()
+
+def printTimings():
+    # print timings summary and write the trace file at exit (--timings, --trace FILE)
+    sys.stdout = sys.__stdout__
+    timings.summary()
+    if traceFile:
+        try:
+            timings.writeTrace(traceFile)
+            print("\ntrace written to {}".format(traceFile))
+        except IOError as e:
+            print("cannot write trace file ({}): {}".format(traceFile, e))
+
+
+def runParallel(function, items, workers, failfast=True):
+    # run function(item) for every item using a bounded pool of worker threads
+    # output of every job is printed in items order as soon as the previous jobs are done
+    # after the first failure (exception or exit()) no new job is started unless
+    # failfast is False, jobs already running are left to complete
+    # input -> function, list of items, max number of concurrent jobs, stop on first failure
+    # output -> list of (result, error) in items order (error is None if job succeeded,
+    #           "not started" if the job was skipped after a failure)
+    results = [(None, "not started")] * len(items)
+    outputs = [None] * len(items)
+    todo = Queue.Queue()
+    done = Queue.Queue()
+    stop = threading.Event()
+    for index in range(len(items)):
+        todo.put(index)
+    out = ThreadOutput(sys.stdout)
+
+    def worker():
+        while not stop.is_set():
+            try:
+                index = todo.get_nowait()
+            except Queue.Empty:
+                break
+            out.capture()
+            try:
+                results[index] = (function(items[index]), None)
+            except SystemExit as e:
+                results[index] = (None, "exit({})".format(e.code if e.code is not None else ""))
+                if failfast:
+                    stop.set()
+            except Exception as e:
+                print("{}: {}".format(e.__class__.__name__, e))
+                results[index] = (None, e)
+                if failfast:
+                    stop.set()
+            outputs[index] = out.release()
+            done.put(index)
+        done.put(None)
+
+    if debug > 0:
+        print("calling runParallel({},{} items,{} workers)".format(function.__name__, len(items), workers))
+    threads = []
+    for n in range(min(workers, len(items))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        threads.append(t)
+    sys.stdout = out
+    try:
+        for t in threads:
+            t.start()
+        running = len(threads)
+        next_output = 0
+        while running > 0:
+            try:
+                index = done.get(True, 0.5)
+            except Queue.Empty:
+                continue
+            except KeyboardInterrupt:
+                if stop.is_set():
+                    print("\nUser interruption, stopping running commands...")
+                    cancelCommands()
+                else:
+                    print("\nUser interruption, waiting for running jobs to complete (interrupt again to stop them)...")
+                    stop.set()
+                continue
+            if index is None:
+                running -= 1
+            while next_output < len(items) and outputs[next_output] is not None:
+                out.stream.write(outputs[next_output])
+                next_output += 1
+    finally:
+        sys.stdout = out.stream
+    # jobs completed after a skipped one are printed at the end
+    for index in range(len(items)):
+        if index >= next_output and outputs[index]:
+            sys.stdout.write(outputs[index])
+    return results
+
+
 def cmdParser():
     # parse command arguments and start program function according to arguments
     global filesystem
     global nasServer
+    global drNasServers
+    global allReplicated
     global debug
+    global parallel
+    global MAX_PROCESSES
+    global MAX_CALL_RATE
+    global RETRY_ATTEMPTS
+    global refresh
+    global columnar
+    global sudoBatch
+    global traceFile
+    global outputFormat
+    global planFile
+    global resume
+    global INVENTORY_CACHE_TTL
     if len(argv) == 1:
         return False
     else:
         command=argv.pop(0)
+    if queryDaemon(argv):
+        exit()
     evaluated_args = []
     while len(argv)>0:
         if "--debug" in argv:
             argv.remove("--debug")
             debug = 1
+        elif "--refresh" in argv:
+            argv.remove("--refresh")
+            refresh = True
+        elif "--columnar" in argv:
+            argv.remove("--columnar")
+            columnar = True
+        elif "--timings" in argv:
+            argv.remove("--timings")
+            if not timings.enabled:
+                timings.enabled = True
+                atexit.register(printTimings)
+        elif "--resume" in argv:
+            argv.remove("--resume")
+            resume = True
+        elif "--sudo-batch" in argv:
+            argv.remove("--sudo-batch")
+            sudoBatch = True
+        elif "--plan" in argv:
+            i = argv.index("--plan")
+            if i + 1 >= len(argv):
+                print("--plan requires the name of the plan file to write")
+                return False
+            planFile = argv[i+1]
+            del argv[i:i+2]
+        elif "--output" in argv:
+            i = argv.index("--output")
+            if i + 1 >= len(argv) or argv[i+1] not in ("json", "jsonl", "csv"):
+                print("--output requires one of the formats json, jsonl, csv")
+                return False
+            outputFormat = argv[i+1]
+            del argv[i:i+2]
+        elif "--trace" in argv:
+            i = argv.index("--trace")
+            if i + 1 >= len(argv):
+                print("--trace requires the name of the json lines file to write")
+                return False
+            traceFile = argv[i+1]
+            del argv[i:i+2]
+            if not timings.enabled:
+                timings.enabled = True
+                atexit.register(printTimings)
+        elif "--ttl" in argv:
+            i = argv.index("--ttl")
+            try:
+                INVENTORY_CACHE_TTL = int(argv[i+1])
+            except (IndexError, ValueError):
+                print("--ttl requires the number of seconds a cached inventory is valid")
+                return False
+            del argv[i:i+2]
+        elif "--parallel" in argv:
+            i = argv.index("--parallel")
+            try:
+                parallel = int(argv[i+1])
+            except (IndexError, ValueError):
+                print("--parallel requires the number of filesystems to process at the same time")
+                return False
+            if parallel < 1:
+                print("--parallel must be at least 1")
+                return False
+            del argv[i:i+2]
+            # without --maxproc (still in argv, it is parsed after --parallel) more
+            # filesystems at the same time also allow more commands at the same time
+            if "--maxproc" not in argv and parallel > MAX_PROCESSES:
+                MAX_PROCESSES = parallel
+                setProcessLimits()
+        elif "--timeout" in argv:
+            try:
+                i = argv.index("--timeout")
+                timeout = int(argv[i+1])
+            except (IndexError, ValueError):
+                print("--timeout requires the number of seconds before a uemcli/svc_nas command is stopped")
+                return False
+            for family in COMMAND_TIMEOUTS:
+                COMMAND_TIMEOUTS[family] = timeout
+            del argv[i:i+2]
+        elif "--maxrate" in argv:
+            i = argv.index("--maxrate")
+            try:
+                MAX_CALL_RATE = float(argv[i+1])
+            except (IndexError, ValueError):
+                print("--maxrate requires the number of uemcli/svc_nas calls per second (0 for no limit)")
+                return False
+            clientPolicy.setRate(MAX_CALL_RATE)
+            del argv[i:i+2]
+        elif "--retries" in argv:
+            i = argv.index("--retries")
+            try:
+                RETRY_ATTEMPTS = int(argv[i+1])
+            except (IndexError, ValueError):
+                print("--retries requires the number of retries of a uemcli/svc_nas call failing with a transient error")
+                return False
+            del argv[i:i+2]
+        elif "--maxproc" in argv:
+            i = argv.index("--maxproc")
+            try:
+                MAX_PROCESSES = int(argv[i+1])
+            except (IndexError, ValueError):
+                print("--maxproc requires the number of uemcli/svc_nas commands to run at the same time")
+                return False
+            if MAX_PROCESSES < 1:
+                print("--maxproc must be at least 1")
+                return False
+            setProcessLimits()
+            del argv[i:i+2]
+        elif "--apply" in argv:
+            # after the options above: they are parsed wherever they are in argv
+            i = argv.index("--apply")
+            if i + 1 >= len(argv):
+                print("--apply requires the name of a plan file written by --plan")
+                return False
+            filename = argv[i+1]
+            del argv[i:i+2]
+            if argv:
+                print("wrong arguments")
+                return False
+            applyDrPlan(filename)
+            exit()
+        elif ("--daemon" in argv):
+            argv.remove("--daemon")
+            evaluated_args.append("--daemon")
+            interval = DAEMON_REFRESH_INTERVAL
+            try:
+                if "--interval" in argv:
+                    i = argv.index("--interval")
+                    interval = int(argv[i+1])
+                    del argv[i:i+2]
+            except (IndexError, ValueError):
+                print("--interval requires the number of seconds between inventory refreshes")
+                return False
+            serveDaemon(interval)
+            exit()
         elif  ("--help" in argv) or ("-h" in argv) or ("-?" in argv):
             evaluated_args.append("--help")
             return False
@@ -446,6 +1186,18 @@ def cmdParser():
             else:
                 print("wrong arguments")
             exit()
+        elif ("--showNASFS" in argv):
+            evaluated_args.append("--showNASFS")
+            argv.remove("--showNASFS")
+            if debug > 0:
+                print("evaluated args {}".format(evaluated_args))
+            if len(argv) == 1:
+                showNASFS(argv[0])
+            elif len(argv) == 0:
+                showNASFS()
+            else:
+                print("wrong arguments")
+            exit()
         elif ("--showSHARE" in argv):
             evaluated_args.append("--showSHARE")
             argv.remove("--showSHARE")
@@ -463,12 +1215,38 @@ def cmdParser():
             argv.remove("--showSNAP")
             if debug > 0:
                 print("evaluated args {}".format(evaluated_args))
-            if len(argv) == 1:
+            filters = {}
+            for option in SNAP_FILTERS:
+                if option in argv:
+                    i = argv.index(option)
+                    if SNAP_FILTERS[option] is None:
+                        filters[option] = True
+                        del argv[i]
+                    elif i+1 < len(argv):
+                        filters[option] = argv[i+1]
+                        del argv[i:i+2]
+                    else:
+                        print("{} requires a value".format(option))
+                        exit()
+            try:
+                if "--limit" in filters:
+                    filters["--limit"] = int(filters["--limit"])
+                if "-match" in filters:
+                    filters["-match"] = re.compile(filters["-match"])
+            except (ValueError, re.error) as e:
+                print("wrong --limit or -match value ({})".format(e))
+                exit()
+            if filters.get("--sort", "name").lstrip("-") not in SNAP_SORT_COLUMNS:
+                print("--sort accepts {} (add - for descending order)".format(", ".join(sorted(SNAP_SORT_COLUMNS))))
+                exit()
+            if len(argv) > 1:
+                print("wrong arguments")
+            elif filters:
+                showSnapMatches(argv[0] if argv else None, filters)
+            elif len(argv) == 1:
                 showSNAP(argv[0])
-            elif len(argv) == 0:
-                showSNAP()
             else:
-                print("wrong arguments")
+                showSNAP()
             exit()
         elif ("--showNAS" in argv):
             evaluated_args.append("--showNAS")
@@ -494,30 +1272,88 @@ def cmdParser():
             else:
                 print("wrong arguments")
             exit()
+        elif ("--report" in argv):
+            i = argv.index("--report")
+            report = argv[i+1] if i+1 < len(argv) else ""
+            del argv[i:i+2]
+            evaluated_args.append("--report")
+            top = REPORT_TOP
+            try:
+                if "--top" in argv:
+                    i = argv.index("--top")
+                    top = int(argv[i+1])
+                    del argv[i:i+2]
+            except (IndexError, ValueError):
+                print("--top requires a number of filesystems")
+                return False
+            if report != "capacity" or argv:
+                print("wrong arguments, available reports: capacity")
+                return False
+            reportCapacity(top)
+            exit()
+        elif ("--purgeSNAP" in argv):
+            argv.remove("--purgeSNAP")
+            evaluated_args.append("--purgeSNAP")
+            days = snapRetentionDays()
+            unattached = False
+            dryrun = False
+            rate = DRTEST_PURGE_RATE
+            try:
+                if "--older-than" in argv:
+                    i = argv.index("--older-than")
+                    days = int(argv[i+1])
+                    del argv[i:i+2]
+                if "--rate" in argv:
+                    i = argv.index("--rate")
+                    rate = float(argv[i+1])
+                    del argv[i:i+2]
+            except (IndexError, ValueError):
+                print("--older-than requires a number of days, --rate a number of snapshots per second")
+                return False
+            if "--unattached" in argv:
+                argv.remove("--unattached")
+                unattached = True
+            if "--dry-run" in argv:
+                argv.remove("--dry-run")
+                dryrun = True
+            purgeSNAP(argv, days, unattached, dryrun, rate)
+            exit()
         elif ("--SNAP" in argv) or ("--snap" in argv):
             if ("--SNAP" in argv):
                 argv.remove("--SNAP")
             else:
                 argv.remove("--snap")  
             evaluated_args.append("--snap")
-            if len(argv) == 1: # if only one arg is provided then filesystem to snap is the argument
-                createFsSnap(argv[0],"")
-            elif len(argv) == 2: # if two args are provided then filesystem to snap and snapshot name are the arguments
-                createFsSnap(argv[0],argv[1])
-            else:
+            snapname = ""
+            if "-name" in argv:
+                i = argv.index("-name")
+                if i + 1 >= len(argv):
+                    print("-name requires the snapshot name")
+                    return False
+                snapname = argv[i+1]
+                del argv[i:i+2]
+            if len(argv) == 0:
                 print("wrong arguments!")
                 usage()
+            else: # filesystems, glob patterns or nas servers to snap, (filesystem, snapshot name) as before
+                createFsSnaps(argv, snapname)
             exit()
         elif ("--testDR" in argv):
             evaluated_args.append("--testDR")
             argv.remove("--testDR")
-            # if 2 arguments are available in the arg list then must be "--nasserver","nas name"
-            if (len(argv) == 2) and ("-nas" in argv):
+            # remaining arguments must be "--all-replicated" or "-nas","nas name"[,"nas name"...]
+            if argv == ["--all-replicated"]:
+                argv.remove("--all-replicated")
+                evaluated_args.append("--all-replicated")
+                allReplicated = True
+                return True
+            if (len(argv) >= 2) and (argv[0] == "-nas"):
                 argv.remove("-nas")
                 evaluated_args.append("-nas")
-                evaluated_args.append(argv[0])
-                nasServer = argv[0] 
-                argv.remove(argv[0])
+                evaluated_args.extend(argv)
+                drNasServers = [name for name in argv if name != "-nas"]
+                nasServer = drNasServers[0]
+                del argv[:]
                 return True
         else:
             print ("\nWrong arguments specified in the command !")
@@ -525,70 +1361,608 @@ def cmdParser():
     return False
 
 
+processSlots = None # free slots for uemcli/svc_nas processes (setProcessLimits)
+familySlots = {} # free slots for processes of every command family (setProcessLimits)
+runningCommands = set() # Watchdog of every command running
+runningLock = threading.Lock()
+cancelled = threading.Event() # set by cancelCommands(), no command is started after it
+monitorStop = threading.Event() # set at exit to stop the thread checking running commands
+monitorThread = None
+nullInput = open(os.devnull) # stdin of commands run without input (startProcess)
+
+CommandResult = collections.namedtuple("CommandResult", "cmd status stdout stderr elapsed")
+
+def setProcessLimits():
+    # process slots of all commands and of every command family from MAX_PROCESSES
+    # (again after --maxproc or --parallel changed it): uemcli can use all of them,
+    # svc_nas SVC_NAS_PROCESSES_SHARE of them
+    global processSlots
+    processSlots = threading.BoundedSemaphore(MAX_PROCESSES)
+    familySlots["uemcli"] = threading.BoundedSemaphore(MAX_PROCESSES)
+    familySlots["svc_nas"] = threading.BoundedSemaphore(max(1, int(MAX_PROCESSES * SVC_NAS_PROCESSES_SHARE)))
+
+setProcessLimits()
+
+class RateLimiter(object):
+    # let callers (from any thread) go on at most rate times per second
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next = 0
+
+    def wait(self):
+        # output -> seconds waited
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return start - now
+
+def classifyError(output, timedout=False, readonly=False):
+    # kind of a failed uemcli/svc_nas call from its output
+    # input -> command output, True if command was stopped by its timeout, True if
+    #          command only reads (a create/delete/add timed out or failing with a
+    #          transient error may have been done and is not run again)
+    # output -> "overload", "transient" (both are retried) or "permanent"
+    output = output or ""
+    if timedout:
+        return "transient" if readonly else "permanent"
+    if OVERLOAD_ERRORS.search(output):
+        return "overload"
+    if UNREACHABLE_ERRORS.search(output):
+        return "transient"
+    if readonly and TRANSIENT_ERRORS.search(output):
+        return "transient"
+    return "permanent"
+
+def readOnly(cmd):
+    # True for uemcli "show" and svc_nas "-show" commands
+    return commandType(cmd).endswith("show")
+
+class ClientPolicy(object):
+    # retries, rate limit and circuit breaker of uemcli/svc_nas calls, shared by all
+    # threads: every call waits while the breaker is open and for the calls per second
+    # ceiling of --maxrate if any (admit), a call failing with a transient error is run
+    # again after a jittered exponential backoff (retry), an overload error opens the
+    # breaker for BREAKER_PAUSE seconds (doubled while the array keeps reporting it)
+
+    def __init__(self, rate):
+        self.limiter = RateLimiter(rate)
+        self.lock = threading.Lock()
+        self.openUntil = 0
+        self.trips = 0 # overload errors in a row, reset by a successful call
+        self.calls = 0
+        self.retries = 0
+        self.exhausted = 0
+        self.throttled = 0
+        self.throttledTime = 0.0
+        self.pauses = 0
+        self.pausedTime = 0.0
+        self.reported = False
+
+    def setRate(self, rate):
+        self.limiter = RateLimiter(rate)
+
+    def admit(self):
+        # wait until a new call can start
+        while not cancelled.is_set():
+            pause = self.openUntil - time.time()
+            if pause <= 0:
+                break
+            cancelled.wait(pause)
+        waited = self.limiter.wait()
+        with self.lock:
+            self.calls += 1
+            if waited > 0:
+                self.throttled += 1
+                self.throttledTime += waited
+
+    def succeeded(self):
+        with self.lock:
+            self.trips = 0
+
+    def trip(self):
+        # array reports overload: pause every call (once for the calls failing together)
+        with self.lock:
+            now = time.time()
+            if now < self.openUntil:
+                return
+            pause = min(BREAKER_MAX_PAUSE, BREAKER_PAUSE * 2 ** self.trips)
+            self.trips += 1
+            self.pauses += 1
+            self.pausedTime += pause
+            self.openUntil = now + pause
+        print("array reports overload, uemcli/svc_nas calls paused for {}s".format(pause))
+
+    def retry(self, cmd, output, attempt, timedout=False):
+        # decide if a failed call is run again, wait for the backoff if it is
+        # input -> command (or label), output of the failed call, retries already done,
+        #          True if call was stopped by its timeout
+        # output -> True to run the call again
+        kind = classifyError(output, timedout, readOnly(cmd))
+        if kind == "permanent":
+            return False
+        if attempt >= RETRY_ATTEMPTS:
+            with self.lock:
+                self.exhausted += 1
+            return False
+        if kind == "overload":
+            self.trip()
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt))
+        with self.lock:
+            self.retries += 1
+        if debug > 0:
+            print("{} failed ({}), retry {} of {} in {:.1f}s".format(commandType(cmd), kind, attempt + 1, RETRY_ATTEMPTS, delay))
+        cancelled.wait(delay)
+        return True
+
+    def summary(self):
+        # one line of counters for run summaries
+        line = "uemcli/svc_nas calls: {}, retries: {}".format(self.calls, self.retries)
+        if self.exhausted:
+            line += " ({} calls still failing after {} retries)".format(self.exhausted, RETRY_ATTEMPTS)
+        if MAX_CALL_RATE > 0:
+            line += ", throttled: {} ({:.1f}s, --maxrate {:g})".format(self.throttled, self.throttledTime, MAX_CALL_RATE)
+        line += ", circuit breaker pauses: {} ({}s)".format(self.pauses, int(self.pausedTime))
+        return line
+
+    def report(self):
+        # print summary() once (end of a run, then --timings summary at exit)
+        if not self.reported:
+            self.reported = True
+            print(self.summary())
+
+clientPolicy = ClientPolicy(MAX_CALL_RATE)
+
+class CommandTimeout(subprocess.CalledProcessError):
+    # command killed after its timeout
+    def __str__(self):
+        return "Command '{}' killed after {}s timeout".format(self.cmd if isinstance(self.cmd, basestring) else " ".join(self.cmd), self.timeout)
+
+class CommandCancelled(subprocess.CalledProcessError):
+    # command killed (or not started) by cancelCommands()
+    def __str__(self):
+        return "Command '{}' cancelled".format(self.cmd if isinstance(self.cmd, basestring) else " ".join(self.cmd))
+
+class Watchdog(object):
+    # stop a running command after timeout seconds or when commands are cancelled:
+    # SIGTERM first (sudo passes it to svc_nas), SIGKILL if still running after KILL_GRACE
+    # seconds, sent to the process group of the command (see startProcess) so that
+    # commands started by sh are stopped too; deadlines are checked by monitorCommands()
+
+    def __init__(self, cmd, proc, timeout):
+        global monitorThread
+        self.cmd = cmd
+        self.proc = proc
+        self.timeout = timeout
+        self.deadline = time.time() + timeout
+        self.killAt = None
+        self.reason = None
+        self.abandoned = False
+        with runningLock:
+            runningCommands.add(self)
+            if monitorThread is None:
+                monitorThread = threading.Thread(target=monitorCommands)
+                monitorThread.daemon = True
+                monitorThread.start()
+                atexit.register(stopMonitor)
+
+    def check(self, now):
+        # stop the command if its deadline is passed, kill it after KILL_GRACE
+        if self.abandoned and self.proc.poll() is not None:
+            with runningLock:
+                runningCommands.discard(self)
+        elif self.reason is None and now >= self.deadline:
+            self.stop("timeout")
+        elif self.killAt is not None and now >= self.killAt:
+            self.killAt = None
+            self.kill()
+
+    def stop(self, reason):
+        if self.reason is not None or self.proc.poll() is not None:
+            return
+        self.reason = reason
+        if debug > 0:
+            print("stopping command ({}): {}".format(reason, commandType(self.cmd)))
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+        except OSError:
+            return
+        self.killAt = time.time() + KILL_GRACE
+
+    def kill(self):
+        if self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def abandon(self):
+        # caller stops waiting for the command (i.e. user interruption): stop it, the
+        # monitor kills it after KILL_GRACE and forgets it once it has exited
+        self.abandoned = True
+        self.stop("cancelled")
+
+    def done(self, output=None):
+        # command completed: raise CommandTimeout or CommandCancelled if it was stopped
+        # (a command completed successfully while it was stopped is kept)
+        with runningLock:
+            runningCommands.discard(self)
+        if self.proc.returncode == 0:
+            return
+        if self.reason == "timeout":
+            error = CommandTimeout(self.proc.returncode, self.cmd, output=output)
+            error.timeout = self.timeout
+            raise error
+        if self.reason == "cancelled":
+            raise CommandCancelled(self.proc.returncode, self.cmd, output=output)
+
+def monitorCommands():
+    # check the running commands every 0.2s until exit (one thread for all commands)
+    while not monitorStop.wait(0.2):
+        now = time.time()
+        with runningLock:
+            watchdogs = list(runningCommands)
+        for watchdog in watchdogs:
+            watchdog.check(now)
+
+def stopMonitor():
+    # at exit: kill commands still running (i.e. started by threads of loadInventory()
+    # when the main thread is interrupted), they would be left running on their own,
+    # then stop monitorCommands() thread before the interpreter shuts down
+    with runningLock:
+        watchdogs = list(runningCommands)
+    for watchdog in watchdogs:
+        watchdog.kill()
+    monitorStop.set()
+    monitorThread.join(1)
+
+def startProcess(cmd, **options):
+    # subprocess.Popen of a command (string through sh, argument list directly) in its
+    # own process group: a user interruption does not reach it and Watchdog can stop
+    # it with every process it started; the group is in the background, a command
+    # reading the terminal would be stopped (SIGTTIN) until its timeout, so its stdin
+    # is /dev/null unless input is given and sudo is run with -n (svcnas) to fail at
+    # once when it would ask a password
+    if options.get("stdin") is None:
+        options["stdin"] = nullInput
+    return subprocess.Popen(cmd, shell=isinstance(cmd, basestring), preexec_fn=os.setpgrp, **options)
+
+def cancelCommands():
+    # stop all running commands and refuse new ones (second user interruption)
+    cancelled.set()
+    with runningLock:
+        watchdogs = list(runningCommands)
+    for watchdog in watchdogs:
+        watchdog.stop("cancelled")
+
+def commandFamily(cmd):
+    # "svc_nas" for svcnas commands, "uemcli" for every other command (slots and timeouts)
+    return "svc_nas" if (cmd if isinstance(cmd, basestring) else " ".join(cmd)).startswith(svcnas) else "uemcli"
+
+@contextlib.contextmanager
+def commandSlots(cmd, family):
+    # wait for the client policy (circuit breaker, calls per second), then for a free
+    # slot of the command family and of the process limit
+    # output -> seconds waited, CommandCancelled if commands were cancelled
+    clientPolicy.admit()
+    queued = time.time()
+    with familySlots[family]:
+        with processSlots:
+            if cancelled.is_set():
+                raise CommandCancelled(-1, cmd)
+            yield time.time() - queued
+
+def runCommand(cmd, input=None, capture=True, timeout=None, family=None, label=None, ctype=None):
+    # run a command (string through sh, argument list directly) within the slots of its
+    # family, stopped after its timeout, stdout and stderr are collected (unless capture
+    # is False: they go to the terminal)
+    # input -> command, text for stdin, capture, timeout in seconds (COMMAND_TIMEOUTS of
+    #          the family if None), family ("uemcli", "svc_nas"), command and type
+    #          recorded by timings (cmd and its commandType if None)
+    # output -> CommandResult, CommandTimeout or CommandCancelled if command was stopped
+    # a call failing with a transient error is run again (clientPolicy), unless its
+    # output goes to the terminal
+    attempt = 0
+    while True:
+        try:
+            result = runCommandOnce(cmd, input, capture, timeout, family, label, ctype)
+        except CommandTimeout as e:
+            if not capture or not clientPolicy.retry(cmd, e.output, attempt, timedout=True):
+                raise
+        else:
+            if result.status == 0:
+                clientPolicy.succeeded()
+                return result
+            if not capture or not clientPolicy.retry(cmd, (result.stdout or "") + (result.stderr or ""), attempt):
+                return result
+        attempt += 1
+
+def runCommandOnce(cmd, input, capture, timeout, family, label, ctype):
+    # single run of runCommand()
+    family = family or commandFamily(cmd)
+    if timeout is None:
+        timeout = COMMAND_TIMEOUTS[family]
+    with commandSlots(cmd, family) as wait:
+        start = time.time()
+        status = -1
+        stdout = None
+        try:
+            pipe = subprocess.PIPE if capture else None
+            proc = startProcess(cmd, stdin=subprocess.PIPE if input is not None else None, stdout=pipe, stderr=pipe)
+            watchdog = Watchdog(cmd, proc, timeout)
+            try:
+                stdout, stderr = proc.communicate(input)
+            except BaseException:
+                # user interruption does not reach the command (own process group), stop it
+                watchdog.abandon()
+                raise
+            watchdog.done(stdout)
+            status = proc.returncode
+            return CommandResult(cmd, status, stdout, stderr, time.time() - start)
+        finally:
+            timings.command(label or cmd, start, wait, status, ctype)
+
+def runCommands(cmds, timeout=None):
+    # run independent commands at the same time (each waits for a slot of its family)
+    # input -> list of command lines, timeout of every command
+    # output -> list of CommandResult or exception in cmds order
+    results = runParallel(lambda cmd: runCommand(cmd, timeout=timeout), cmds, len(cmds), failfast=False)
+    return [result if error is None else error for result, error in results]
+
+def checkOutput(cmd, timeout=None):
+    # subprocess.check_output(cmd, shell=True) waiting for a free process slot, so that
+    # concurrent jobs never run more than MAX_PROCESSES uemcli/svc_nas at the same time
+    # input -> command line, timeout in seconds (family default if None)
+    # output -> command output, CalledProcessError if command fails or is stopped
+    result = runCommand(cmd, timeout=timeout)
+    if result.stderr:
+        sys.stderr.write(result.stderr)
+    if result.status:
+        raise subprocess.CalledProcessError(result.status, cmd, output=result.stdout)
+    return result.stdout
+
+def systemCMD(cmd, timeout=None):
+    # os.system(cmd) (output goes to the terminal) within the process limit
+    # input -> command line, timeout in seconds (family default if None)
+    # output -> exit status (-1 if command was stopped)
+    try:
+        return runCommand(cmd, capture=False, timeout=timeout).status
+    except subprocess.CalledProcessError as e:
+        print(e)
+        return -1
+
+def iterLines(cmd, timeout=None):
+    # run a uemcli command and yield its output lines while uemcli is still running:
+    # output is read line by line from a buffered pipe (readline returns as soon as
+    # a line is complete); the first lines are held until there are 10 of them so
+    # that a call failing with a transient error (uemcli errors are printed on stdout)
+    # is run again (clientPolicy) before anything is yielded
+    # input -> uemcli command as argument list, timeout in seconds (family default if None)
+    # output -> generator of strings, CalledProcessError if uemcli fails or is stopped
+    # (a process slot is held until the output is read)
+    attempt = 0
+    while True:
+        held = []
+        lines = streamLines(cmd, timeout)
+        try:
+            for line in lines:
+                if held is None:
+                    yield line
+                    continue
+                held.append(line)
+                if len(held) == 10:
+                    for line in held:
+                        yield line
+                    held = None
+            clientPolicy.succeeded()
+            for line in held or []:
+                yield line
+            return
+        except CommandCancelled:
+            raise
+        except subprocess.CalledProcessError as e:
+            if held is None or not clientPolicy.retry(cmd, e.output, attempt, timedout=isinstance(e, CommandTimeout)):
+                raise
+        finally:
+            lines.close()
+        attempt += 1
+
+def streamLines(cmd, timeout=None):
+    # single run of iterLines()
+    family = commandFamily(cmd)
+    with commandSlots(cmd, family) as wait:
+        start = time.time()
+        try:
+            proc = startProcess(cmd, stdout=subprocess.PIPE, bufsize=-1)
+        except:
+            timings.command(cmd, start, wait, -1)
+            raise
+        watchdog = Watchdog(cmd, proc, COMMAND_TIMEOUTS[family] if timeout is None else timeout)
+        head = []
+        completed = False
+        try:
+            for line in iter(proc.stdout.readline, ""):
+                if len(head) < 10:
+                    head.append(line.rstrip("\n"))
+                yield line
+            completed = True
+        finally:
+            if not completed and proc.poll() is None:
+                # generator closed before the end of the listing, or user interruption
+                # (it does not reach uemcli, in its own process group)
+                watchdog.kill()
+            proc.stdout.close()
+            retcode = proc.wait()
+            timings.command(cmd, start, wait, retcode)
+            if completed:
+                watchdog.done("\n".join(head))
+            else:
+                with runningLock:
+                    runningCommands.discard(watchdog)
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, cmd, output="\n".join(head))
+
+def iterCSV(cmd):
+    # run a uemcli "show -output csv" command and yield its rows (header included)
+    # while uemcli is still running, quoted fields with commas or new lines inside
+    # are handled by csv module
+    # input -> uemcli command as argument list
+    # output -> generator of lists of strings, CalledProcessError if uemcli fails
+    return csv.reader(iterLines(cmd))
+
+def csvColumns(header, columns):
+    # map record columns to positions of a uemcli csv header
+    # (alternative header names of a column are separated by "|", if a column is
+    # not in the header its position is used when header has as many columns as record)
+    # input -> header row, tuple of column names
+    # output -> list of positions (None for a column not available)
+    names = [name.strip().lower() for name in header]
+    positions = []
+    for n, column in enumerate(columns):
+        position = None
+        for name in column.lower().split("|"):
+            if name in names:
+                position = names.index(name)
+                break
+        if position is None and len(names) == len(columns):
+            position = n
+        positions.append(position)
+    if debug > 1:
+        print("csv columns {} -> {}".format(header, positions))
+    return positions
+
+def iterRows(cmd, cls):
+    # yield the rows of a uemcli csv listing in the column order of a record class
+    # (Filesystem, Snapshot...) as soon as every row is read, columns are taken by
+    # header name
+    # input -> uemcli command as argument list, record class
+    # output -> generator of lists of strings
+    rows = iterCSV(cmd)
+    header = next(rows, None)
+    if header is None:
+        return
+    positions = csvColumns(header, cls.columns)
+    # when header matches the record columns the csv row is used as it is
+    same = positions == range(len(cls.columns))
+    for row in rows:
+        if not row:
+            continue
+        if debug > 2:
+            print("-- {} csv row --> {}".format(cls.__name__, row))
+        if not same or len(row) != len(positions):
+            row = [row[n] if n is not None and n < len(row) else "" for n in positions]
+        yield row
+
+def iterRecords(cmd, cls):
+    # yield objects of a record class from a uemcli csv listing as soon as every row is read
+    # input -> uemcli command as argument list, record class
+    # output -> generator of record objects
+    for row in iterRows(cmd, cls):
+        record = cls.__new__(cls)
+        Record.__init__(record, row)
+        yield record
+
+inventoryEvents = collections.deque(maxlen=INVENTORY_EVENTS_KEPT) # change events of Listing.refresh(), oldest first
+
+def changeEvent(kind, old, new):
+    # change of a record between two listings
+    # input -> object kind (i.e. "snapshot"), previous record (None if created),
+    #          new record (None if deleted)
+    # output -> dictionary time, object, event (created, deleted, changed), id, name
+    #           and changes (field name -> [previous value, new value]) of a changed record
+    record = new or old
+    event = {"time": time.time(), "object": kind, "id": record.id, "name": record.name}
+    if old is None:
+        event["event"] = "created"
+    elif new is None:
+        event["event"] = "deleted"
+    else:
+        event["event"] = "changed"
+        event["changes"] = dict((name, [before, after]) for (name, field), before, after in zip(new.fields(), old.values(), new.values()) if before != after)
+    return event
+
+def describeEvent(event):
+    # one line description of a change event, i.e. "filesystem fs1 (res_1) changed: health OK (5) -> Degraded"
+    text = "{} {} ({}) {}".format(event["object"], event["name"], event["id"], event["event"])
+    changes = event.get("changes")
+    if changes:
+        text += ": " + ", ".join("{} {} -> {}".format(name, changes[name][0], changes[name][1]) for name in sorted(changes))
+    return text
+
+class Listing(object):
+    # uemcli listing of a record class refreshed incrementally: every csv row is
+    # compared with the row of the record with the same id in the previous listing,
+    # records of unchanged rows are reused without building them again, only new and
+    # changed rows become new records and every difference (by id) is added to
+    # inventoryEvents (nothing on the first listing); rows are kept only once, by
+    # their records
+
+    def __init__(self, cmd, cls, kind):
+        self.cmd = cmd
+        self.cls = cls
+        self.kind = kind
+        self.byId = None # id -> record of the last listing
+
+    def refresh(self):
+        # run the listing again
+        # output -> list of record objects in listing order
+        previous = self.byId
+        byId = {}
+        records = []
+        events = []
+        for row in iterRows(self.cmd, self.cls):
+            record = previous.get(decodeText(row[0])) if previous is not None else None
+            if record is None or not record.sameRow(row):
+                old = record
+                record = self.cls.__new__(self.cls)
+                Record.__init__(record, row)
+                if previous is not None:
+                    events.append(changeEvent(self.kind, old, record))
+            byId[record.id] = record
+            records.append(record)
+        if previous is not None:
+            for ID in previous:
+                if ID not in byId:
+                    events.append(changeEvent(self.kind, previous[ID], None))
+        self.byId = byId
+        inventoryEvents.extend(events)
+        if debug > 0 and previous is not None:
+            print("{} listing refreshed: {} records, {} changes".format(self.kind, len(records), len(events)))
+        return records
+
+filesystemListing = Listing(filesystem_show, Filesystem, "filesystem")
+nasServerListing = Listing(nasServer_show, Nasserver, "nas server")
+snapshotListing = Listing(snapshot_show, Snapshot, "snapshot")
+shareListing = Listing(share_show, Share, "share")
+poolListing = Listing(pool_show, Pool, "pool")
+
 def getSnaps():
     # create snap objects from all snapshot in unity by executing uemcli
-    global snapshot_show
     if debug > 0:
 	print("calling getSnaps()")
-    snaplist = []
-    output = subprocess.check_output(snapshot_show)
-    for snapline in output.splitlines()[1:]:
-        if debug > 1:
-            print("-debug1- print snap csv list getSnaps() --")
-            print(snapline.split(","))
-        id, name, state, attached, source, sourcetype, members, attachDetails = snapline.split(",")
-        snap = Snapshot(id, name, state, attached, source, sourcetype, members, attachDetails)
-        snaplist.append(snap)
-    return snaplist
+    return getSnapshots()
 
 def getShares():
     # create shares objects from all filesystem in unity by executing uemcli
-    global share_show
     if debug > 0:
         print("calling getShares()")
-    sharelist = []
-    output = subprocess.check_output(share_show)
-    for shareline in output.splitlines()[1:]:
-	if debug > 1:
-	    print("-- print share csv list getShares() --")
-	    print(shareline.split(","))
-        id, name, description, filesystem, path, export  = shareline.split(",")[0:6]
-        share = Share(id, name, description, filesystem, path, export)
-        sharelist.append(share)
-    return sharelist
+    return shareListing.refresh()
 
 def getPools():
     # create pools objects from unity system by executing uemcli
-    global pool_show
     if debug > 0:
 	print("calling getPools()")
-    poollist = []
-    output = subprocess.check_output(pool_show)
-    for poolline in output.splitlines()[1:]:
-	if debug > 2:
-	    print("-- print pool csv list getPools() --")
-	    print(poolline)
-	id,name,totalspace,freespace,subscriptionpercent,numberofdrives,raidlevel,stripelength,rebalancing,health,protectionsize,nonbasesizeused = poolline.split(",")
-	pool = Pool(id ,name,totalspace,freespace,subscriptionpercent,numberofdrives,raidlevel,stripelength,rebalancing,health      ,protectionsize,nonbasesizeused)
-        poollist.append(pool)
-    return poollist
+    return poolListing.refresh()
 
 
 def getFilesystems():
     # create Filesystem objects from all filesystem in unity by executing uemcli
-    global filesystem_show
     if debug > 0:
 	print("calling getFilesystems()")
-    fslist = []
-    output = subprocess.check_output(filesystem_show)
-    for fsline in output.splitlines()[1:]:
-	if debug > 2:
-	    print("-- print filesystem csv list getFilesystems() --")
-	    print(fsline)
-        id, name, description,health,fs,server,poolid,poolname,format,protocol,accessPolicy,folderRenamePolicy,lockingPolicy,size,sizeused,maxsize,protsizeused = fsline.split(",")
-        fs = Filesystem(id, name, description,health,fs,server,poolid,poolname,format,protocol,accessPolicy,folderRenamePolicy,lockingPolicy,size,sizeused,maxsize,protsizeused)
-        fslist.append(fs)
-    return fslist
+    return filesystemListing.refresh()
 
 def getFSnames():
     if debug > 0:
@@ -602,70 +1976,654 @@ def getFSbyName(name):
     # return Filesystem object from a query by name of Filesystem obj list
     # if not found return None
     if debug > 0:
-        print("calling getFSbyName()".format(name))
-    for fs in fileSystems:
-        if name == fs.name:
-	    return fs
-    return None
+        print("calling getFSbyName({})".format(name))
+    return inventory.fsByName.get(name)
 
 def getSnapshots():
     # create Snapshot objects from all snapshot in unity by executing uemcli
-    global snapshot_show
     if debug > 0:
 	print("calling getSnapshots()")
-    snaplist = []
-    output = subprocess.check_output(snapshot_show)
-    for snapline in output.splitlines()[1:]:
-	if debug > 2:
-	    print("-- print snap csv list getSnapshots() --")
-	    print(snapline)
-        id, name, state,attached,source,sourceType,members,attachDetails = snapline.split(",")
-        snap = Snapshot(id, name, state,attached,source,sourceType,members,attachDetails)
-        snaplist.append(snap)
-    return snaplist
+    return snapshotListing.refresh()
 
 
 def getItems(line):
     # return a list of items from a string (line input) and takes
     # care of opening and closing " characters for separating items 
-    lista = []
-    opened = False
-    e = ""
-    print(line)
-    for item in line.split(","):
-        if item.count('"') == 2:
-            lista.append(item)
-        elif (item.count('"') == 1) and not opened:
-            e = item.split('"')[1]
-            opened = True
-        elif (item.count('"') == 1) and opened:
-            e += ("," + item.split('"')[0])
-            opened = False
-            lista.append(e)
-        elif (item.count('"') == 0):
-            e += ("," + item)
-        else:
-            print("error in parsing string, exiting...")
-            exit()
-    return lista
+    if debug > 2:
+        print(line)
+    return next(csv.reader([line]), [])
 
 def getNASservers():
     # create Nasserver objects from all nas server in unity by executing uemcli
-    global nasServer_show
     if debug > 0:
 	print("calling getNASservers()")
-    naslist = []
     if debug > 0:
         print("CLI -> {}".format(nasServer_show))
-    output = subprocess.check_output(nasServer_show)
-    for nasline in output.splitlines()[1:]:
-	if debug > 2:
-	    print("-- print nas server csv list getNASservers() --")
-        #id, name, netbios, sp, poolname, tenant, interface, nfsEnabled, nfs3Enabled, nfs4Enabled, cifsEnabled, multiprotocol, unixDirectoryService, health = nasline.split(",")
-        id, name, netbios, sp, poolname, tenant, interface, nfsEnabled, nfs3Enabled, nfs4Enabled, cifsEnabled, multiprotocol, unixDirectoryService, health = getItems(nasline)
-        nas = Nasserver(id, name, netbios,sp,poolname,tenant,interface,nfsEnabled,nfs3Enabled,nfs4Enabled,cifsEnabled,multiprotocol,unixDirectoryService,health)
-        naslist.append(nas)
-    return naslist
+    return nasServerListing.refresh()
+
+def getReplicatedNASids():
+    # get ids of nas servers replicated to this system (destination of a nas server replication session)
+    # no input
+    # output -> list of nas server ids, exit() if uemcli fails
+    if debug > 0:
+        print("calling getReplicatedNASids()")
+    nasids = []
+    try:
+        rows = iterCSV(replication_show)
+        header = next(rows, None)
+        if header is None:
+            return nasids
+        rtype, role, destination = csvColumns(header, ("Resource type", "Local role", "Destination resource"))
+        for row in rows:
+            if len(row) != len(header):
+                continue
+            if row[rtype].strip().lower() == "nas server" and row[role].strip().lower() == "destination":
+                if row[destination] not in nasids:
+                    nasids.append(row[destination])
+    except Exception as e:
+        print("Cannot get replication sessions, exiting")
+        if debug > 0:
+            print(e)
+        exit()
+    return nasids
+
+def readInventoryCache(names=None):
+    # read the inventory saved by writeInventoryCache()
+    # input -> names of the listings wanted (all of them if None)
+    # output -> dictionary listing name -> object list of the listings still valid,
+    #           None if cache is missing, unreadable or saved for a different uemcli target
+    rows = readInventoryRows()
+    if rows is None:
+        return None
+    listings = {}
+    for name, function, variable, record in INVENTORY_LISTINGS:
+        if name in rows and (names is None or name in names):
+            listings[name] = [record.fromRow(row) for row in rows[name]]
+    return listings
+
+def readInventoryFile():
+    # read the local inventory cache file
+    # output -> dictionary version, cli, times (listing name -> time saved) and
+    #           listings (listing name -> list of rows), None if not valid
+    try:
+        with open(INVENTORY_CACHE_FILE, "rb") as f:
+            cache = marshal.load(f)
+    except Exception as e:
+        if debug > 0:
+            print("inventory cache not available ({})".format(e))
+        return None
+    if cache.get("version") != version or cache.get("cli") != cli or "times" not in cache:
+        if debug > 0:
+            print("inventory cache not valid")
+        return None
+    return cache
+
+def readInventoryRows():
+    # read the record rows saved by writeInventoryCache(), every listing is valid for
+    # INVENTORY_CACHE_TTL seconds since it was saved
+    # output -> dictionary listing name -> list of rows, None if cache is not valid
+    cache = readInventoryFile()
+    if cache is None:
+        return None
+    now = time.time()
+    rows = dict((name, cache["listings"][name]) for name in cache["listings"] if 0 <= now - cache["times"].get(name, 0) < INVENTORY_CACHE_TTL)
+    if debug > 0:
+        print("using inventory cache {} ({} of {} listings still valid)".format(INVENTORY_CACHE_FILE, len(rows), len(cache["listings"])))
+    return rows
+
+def writeInventoryCache(listings):
+    # save the loaded listings in a local binary file (marshal of the record rows,
+    # written to a temporary file and renamed so that a concurrent reader never gets
+    # a partial cache), listings of the file still valid and not loaded again are kept
+    # input -> dictionary listing name -> object list
+    tmpfile = "{}.{}".format(INVENTORY_CACHE_FILE, os.getpid())
+    now = time.time()
+    cache = readInventoryFile() or {"times": {}, "listings": {}}
+    rows = {}
+    times = {}
+    for name in cache["listings"]:
+        if 0 <= now - cache["times"].get(name, 0) < INVENTORY_CACHE_TTL:
+            rows[name] = cache["listings"][name]
+            times[name] = cache["times"][name]
+    for name in listings:
+        rows[name] = [obj.row() for obj in listings[name]]
+        times[name] = now
+    try:
+        fd = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump({"version": version, "cli": cli, "times": times, "listings": rows}, f, 2)
+        os.rename(tmpfile, INVENTORY_CACHE_FILE)
+    except Exception as e:
+        if debug > 0:
+            print("could not write inventory cache ({})".format(e))
+
+def invalidateInventoryCache():
+    # remove the local inventory cache, called after every command changing unity configuration
+    try:
+        os.remove(INVENTORY_CACHE_FILE)
+        if debug > 0:
+            print("inventory cache invalidated")
+    except OSError:
+        pass
+
+# uemcli listings loaded by loadInventory(), listing name -> (function, global list name, record class)
+INVENTORY_LISTINGS = [
+    ("filesystems", getFilesystems, "fileSystems", Filesystem),
+    ("nasservers", getNASservers, "nasServers", Nasserver),
+    ("snapshots", getSnapshots, "snapshots", Snapshot),
+    ("shares", getShares, "shares", Share),
+    ("pools", getPools, "pools", Pool),
+]
+
+def buildInventory():
+    # index the global object lists (inventory shares the lists, it does not copy them)
+    global inventory
+    inventory = Inventory(fileSystems, nasServers, snapshots, shares, pools)
+
+def useInventoryCache(listings):
+    # set the global object lists from the local inventory cache (unless --refresh)
+    # input -> names of the listings needed
+    # output -> True if cache was valid and contained all listings
+    if serving:
+        # --daemon keeps all the listings in memory
+        return True
+    if len(useCachedListings(listings)) < len(listings):
+        return False
+    buildInventory()
+    return True
+
+def useCachedListings(listings):
+    # set the global object lists of the listings still valid in the local inventory
+    # cache (unless --refresh)
+    # input -> names of the listings needed
+    # output -> names of the listings set from the cache
+    cache = None if refresh else readInventoryCache(listings)
+    if cache is None:
+        return []
+    for name, function, variable, record in INVENTORY_LISTINGS:
+        if name in cache:
+            globals()[variable] = cache[name]
+    return list(cache)
+
+def loadInventory(listings=None, verbose=False, cached=False):
+    # run the uemcli listings at the same time (each uemcli pays its own startup
+    # and login) and set the global object lists when all of them are completed
+    # exit() as soon as one of the listings fails, naming the failed listing
+    # input -> names of the listings to load (all of them if None), verbose to
+    #          print how long every listing took, cached to use the local inventory
+    #          cache if still valid (only the listings missing or expired in the cache
+    #          are loaded, loaded listings are saved in the cache)
+    # output -> dictionary listing name -> seconds taken (empty if inventory came from cache)
+    if listings is None:
+        listings = [name for name, function, variable, record in INVENTORY_LISTINGS]
+    if debug > 0:
+        print("calling loadInventory({})".format(",".join(listings)))
+    if cached:
+        if serving:
+            # --daemon keeps all the listings in memory
+            return {}
+        found = useCachedListings(listings)
+        listings = [name for name in listings if name not in found]
+        if not listings:
+            buildInventory()
+            return {}
+    done = Queue.Queue()
+
+    def load(name, function):
+        start = time.time()
+        try:
+            with timings.phase("inventory", name):
+                result = function()
+            done.put((name, result, None, time.time() - start))
+        except Exception as e:
+            done.put((name, None, e, time.time() - start))
+
+    for name, function, variable, record in INVENTORY_LISTINGS:
+        if name in listings:
+            t = threading.Thread(target=load, args=(name, function))
+            t.daemon = True
+            t.start()
+    loaded = {}
+    took = {}
+    start = time.time()
+    while len(took) < len(listings):
+        try:
+            # short waits keep the main thread interruptible, every listing ends within
+            # the uemcli timeout (and retries) of its command
+            name, result, error, elapsed = done.get(True, 0.5)
+        except Queue.Empty:
+            continue
+        if error is not None:
+            print("could not get {} listing from unity after {:.2f}s: {}".format(name, elapsed, error))
+            if debug > 0 and getattr(error, "output", None):
+                print(error.output)
+            exit()
+        loaded[name] = result
+        took[name] = elapsed
+    with inventoryLock:
+        for name, function, variable, record in INVENTORY_LISTINGS:
+            if name in loaded:
+                globals()[variable] = loaded[name]
+        buildInventory()
+    writeInventoryCache(loaded)
+    if verbose:
+        for name in listings:
+            print("  {:<12} {:>7} items in {:.2f}s".format(name, len(loaded[name]), took[name]))
+        print("  inventory loaded in {:.2f}s".format(time.time() - start))
+    return took
+
+# uemcli object path and inventory name index of the listings with a targeted show
+TARGETED_LOOKUPS = {
+    "filesystems": ("/stor/prov/fs", "fsByName"),
+    "nasservers": ("/net/nas/server", "nasByName"),
+    "snapshots": ("/prot/snap", "snapByName"),
+    "shares": ("/stor/prov/fs/cifs", "shareByName"),
+}
+
+def queryRecords(listing, name):
+    # ask uemcli only for the objects with a given name (one small show instead of
+    # the whole listing)
+    # input -> listing name (see TARGETED_LOOKUPS), object name
+    # output -> list of record objects (empty if uemcli reports that object does
+    #           not exist), None if the targeted query is not possible
+    path, index = TARGETED_LOOKUPS[listing]
+    record = [r for n, f, v, r in INVENTORY_LISTINGS if n == listing][0]
+    cmd = cli.split() + [path, "-name", name, "show", "-output", "csv"]
+    if debug > 0:
+        print("calling queryRecords({},{})".format(listing, name))
+    try:
+        return list(iterRecords(cmd, record))
+    except subprocess.CalledProcessError as e:
+        if e.output and e.output.find("does not exist") >= 0:
+            return []
+        if debug > 0:
+            print("targeted query failed ({}), using full listing".format(e))
+        return None
+
+def lookupRecords(listing, name):
+    # find the objects with a given name for the single object show commands:
+    # local inventory cache if still valid, then a targeted uemcli query and
+    # the full uemcli listing as fallback (columns of the listing with --columnar)
+    # input -> listing name (see TARGETED_LOOKUPS), object name
+    # output -> list of record objects (more than one only for snapshots of
+    #           different filesystems with the same name)
+    if columnar and not serving:
+        store = loadColumns(listing)
+        found = store.records(store.equal("name", name))
+        return found if listing == "snapshots" else found[:1]
+    if not useInventoryCache([listing]):
+        records = queryRecords(listing, name)
+        if records is not None:
+            return records
+        loadInventory([listing], cached=True)
+    if listing == "snapshots":
+        return [snap for snap in snapshots if snap.name == name]
+    path, index = TARGETED_LOOKUPS[listing]
+    record = getattr(inventory, index).get(name)
+    return [record] if record else []
+
+class ColumnStore(object):
+    # rows of a uemcli listing kept by column instead of one record object per row:
+    # sizes in integer arrays, ids ("res_12", "38654705006") as a dictionary encoded
+    # prefix and an integer array, columns with few distinct values (Record.interned)
+    # as dictionary codes in the smallest integer array that fits them, other text
+    # columns as one string with an array of value offsets; filters return row numbers
+    # and record objects are built only for the rows asked by records()
+
+    def __init__(self, cls, rows, chunk=5000):
+        # rows are read by chunks and every column of a chunk is converted at once
+        # input -> record class, iterable of rows in record columns order, rows per chunk
+        self.cls = cls
+        self.count = 0
+        self.names = [name for name, field in cls.fields()]
+        self.kinds = []
+        self.data = []
+        self.irregular = {} # (column, row) -> text of a size or id not stored as a number
+        self.indexes = {} # column -> dictionary code -> array of row numbers, built on first equal()
+        for column, (name, field) in enumerate(cls.fields()):
+            if column == 0:
+                self.kinds.append("id")
+                self.data.append([{}, array.array("l"), array.array("l")])
+            elif field.decode is decodeSize:
+                self.kinds.append("size")
+                self.data.append(array.array("l"))
+            elif column in cls.interned:
+                self.kinds.append("code")
+                self.data.append([{}, array.array("l")])
+            else:
+                self.kinds.append("text")
+                self.data.append([[], array.array("l", [1])])
+        width = len(self.kinds)
+        rows = iter(rows)
+        while True:
+            block = [row if len(row) == width else (list(row) + [""] * width)[:width] for row in itertools.islice(rows, chunk)]
+            if not block:
+                break
+            for column, values in enumerate(zip(*block)):
+                self.extend(column, values)
+            self.count += len(block)
+        for column, kind in enumerate(self.kinds):
+            # dictionary of values -> list of values by code, codes in the smallest array
+            if kind in ("id", "code"):
+                index = self.data[column][0]
+                values = [None] * len(index)
+                for value, code in index.iteritems():
+                    values[code] = value
+                codes = self.data[column][1]
+                self.data[column][:2] = [values, index, array.array("B" if len(values) <= 256 else "H" if len(values) <= 65536 else "l", codes)]
+            elif kind == "text":
+                self.data[column] = ("\0" + "\0".join(self.data[column][0]) + "\0", self.data[column][1])
+
+    def extend(self, column, values):
+        # add the values of a column for a chunk of rows
+        kind = self.kinds[column]
+        if kind == "code":
+            index, codes = self.data[column]
+            setdefault = index.setdefault
+            codes.extend([setdefault(value.strip('"'), len(index)) for value in values])
+        elif kind == "text":
+            texts, offsets = self.data[column]
+            joined = "".join(values)
+            if '"' in joined or "\0" in joined:
+                values = [value.strip('"').replace("\0", "") for value in values]
+            texts.extend(values)
+            total = offsets[-1]
+            for value in values:
+                total += len(value) + 1
+                offsets.append(total)
+        elif kind == "size":
+            numbers = self.data[column]
+            for n, value in enumerate(values):
+                value = decodeSize(value)
+                if value.isdigit() and (value[0] != "0" or len(value) == 1):
+                    numbers.append(int(value))
+                else:
+                    numbers.append(-1)
+                    self.irregular[(column, self.count + n)] = value
+        else:
+            index, codes, numbers = self.data[column]
+            setdefault = index.setdefault
+            # usual case: ids of a listing share their prefix and their numbers have
+            # no leading zeros (str(int(number)) gives number back)
+            values = [value.strip('"') for value in values]
+            prefix = values[0].rstrip("0123456789")
+            size = len(prefix)
+            try:
+                tails = [value[size:] for value in values]
+                found = map(int, tails)
+                if [value[:size] for value in values] == [prefix] * len(values) and map(str, found) == tails:
+                    codes.extend([setdefault(prefix, len(index))] * len(values))
+                    numbers.extend(found)
+                    return
+            except ValueError:
+                pass
+            for n, value in enumerate(values):
+                prefix = value.rstrip("0123456789")
+                number = value[len(prefix):]
+                if not number or (number[0] == "0" and len(number) > 1):
+                    prefix, number = "", "-1"
+                    self.irregular[(column, self.count + n)] = value
+                codes.append(setdefault(prefix, len(index)))
+                numbers.append(int(number))
+
+    def value(self, column, n):
+        # text of column (position) of row n
+        kind = self.kinds[column]
+        if kind == "code":
+            return self.data[column][0][self.data[column][2][n]]
+        if kind == "text":
+            text, offsets = self.data[column]
+            return text[offsets[n]:offsets[n + 1] - 1]
+        if kind == "size":
+            number = self.data[column][n]
+        else:
+            number = self.data[column][3][n]
+        if number < 0:
+            return self.irregular[(column, n)]
+        if kind == "size":
+            return str(number)
+        return self.data[column][0][self.data[column][2][n]] + str(number)
+
+    def row(self, n):
+        # values of row n in record columns order
+        return [self.value(column, n) for column in range(len(self.kinds))]
+
+    def records(self, rows):
+        # record objects of row numbers
+        found = []
+        for n in rows:
+            record = self.cls.__new__(self.cls)
+            Record.__init__(record, self.row(n))
+            found.append(record)
+        return found
+
+    def equal(self, name, value):
+        # row numbers where a column (record attribute name) has a value
+        column = self.names.index(name)
+        kind = self.kinds[column]
+        if kind == "code":
+            code = self.data[column][1].get(value)
+            if code is None:
+                return []
+            if column not in self.indexes:
+                index = {}
+                for n, c in enumerate(self.data[column][2]):
+                    index.setdefault(c, array.array("l")).append(n)
+                self.indexes[column] = index
+            return list(self.indexes[column].get(code, []))
+        if kind == "text":
+            text, offsets = self.data[column]
+            rows = []
+            key = "\0" + value + "\0"
+            position = text.find(key)
+            while position >= 0:
+                rows.append(bisect.bisect_left(offsets, position + 1))
+                position = text.find(key, position + 1)
+            return rows
+        return [n for n in range(self.count) if self.value(column, n) == value]
+
+    def prefix(self, name, value):
+        # row numbers where a text column (record attribute name) starts with value
+        column = self.names.index(name)
+        if self.kinds[column] != "text":
+            return [n for n in range(self.count) if self.value(column, n).startswith(value)]
+        text, offsets = self.data[column]
+        rows = []
+        key = "\0" + value
+        position = text.find(key)
+        while position >= 0 and position < len(text) - 1:
+            rows.append(bisect.bisect_left(offsets, position + 1))
+            position = text.find(key, position + 1)
+        return rows
+
+    def sizes(self, name):
+        # integer array of a size column (-1 where the value is not a number)
+        return self.data[self.names.index(name)]
+
+columnStores = {} # listing name -> ColumnStore loaded by loadColumns()
+
+def loadColumns(listing):
+    # columns of a listing from the rows of the local inventory cache if still valid,
+    # otherwise from uemcli listing (records are never built for the whole listing)
+    # input -> listing name
+    # output -> ColumnStore
+    if listing not in columnStores:
+        record = [r for n, f, v, r in INVENTORY_LISTINGS if n == listing][0]
+        cached = None if refresh else readInventoryRows()
+        if cached is not None and listing in cached:
+            rows = cached[listing]
+        else:
+            rows = iterRows(LISTING_COMMANDS[listing], record)
+        start = time.time()
+        columnStores[listing] = ColumnStore(record, rows)
+        if debug > 0:
+            print("{} {} rows in columns in {:.2f}s".format(columnStores[listing].count, listing, time.time() - start))
+    return columnStores[listing]
+
+# commands answered by --daemon, with the number of values of the options they accept
+DAEMON_COMMANDS = ["--showNASSHARE", "--showNASFS", "--showSHARE", "--showSNAP", "--showNAS", "--showFS"]
+DAEMON_OPTIONS = {"--output": 1, "--debug": 0, "-fs": 1, "-prefix": 1, "-match": 1, "-state": 1, "--dr": 0, "--limit": 1, "--sort": 1}
+
+def daemonRequest(args):
+    # check if a command can be answered by --daemon
+    # input -> command arguments (without script name)
+    # output -> True if args are a single DAEMON_COMMANDS with DAEMON_OPTIONS only
+    commands = [arg for arg in args if arg in DAEMON_COMMANDS]
+    if len(commands) != 1:
+        return False
+    rest = list(args)
+    rest.remove(commands[0])
+    names = 0
+    i = 0
+    while i < len(rest):
+        if rest[i] in DAEMON_OPTIONS:
+            i += 1 + DAEMON_OPTIONS[rest[i]]
+        elif rest[i].startswith("-"):
+            return False
+        else:
+            names += 1
+            i += 1
+    return names <= 1 and i == len(rest)
+
+def queryDaemon(args):
+    # send a --show* command to --daemon (DAEMON_SOCKET) and print its answer
+    # input -> command arguments (without script name)
+    # output -> True if daemon answered, False if command has to run here (no
+    #           daemon, daemon for another unity, command not served by daemon)
+    if serving or not daemonRequest(args):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    answered = False
+    try:
+        sock.settimeout(60)
+        sock.connect(DAEMON_SOCKET)
+        sock.sendall(json.dumps({"version": version, "cli": cli, "args": args}) + "\n")
+        sock.shutdown(socket.SHUT_WR)
+        reply = sock.makefile("rb")
+        status = reply.readline().strip()
+        if status != "ok":
+            if "--debug" in args:
+                print("inventory daemon did not answer ({})".format(status))
+            return False
+        answered = True
+        for data in iter(lambda: reply.read(65536), ""):
+            sys.stdout.write(data)
+        return True
+    except socket.error as e:
+        if answered:
+            print("\nconnection to inventory daemon lost ({})".format(e))
+            exit()
+        if "--debug" in args:
+            print("inventory daemon not available ({})".format(e))
+        return False
+    finally:
+        sock.close()
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+    # one query of queryDaemon(): a json line with version, cli and command arguments,
+    # answered with "ok" and the command output or "error <reason>"
+
+    def handle(self):
+        global debug
+        global outputFormat
+        start = time.time()
+        try:
+            request = json.loads(self.rfile.readline())
+            args = [arg.encode("utf-8") for arg in request["args"]]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.wfile.write("error bad request\n")
+            return
+        if request.get("version") != version or request.get("cli") != cli:
+            self.wfile.write("error daemon serves another unity or version\n")
+            return
+        if not daemonRequest(args):
+            self.wfile.write("error command not served by daemon\n")
+            return
+        # queries use global options and lists, they run one at a time (a few ms each),
+        # options of the daemon are restored after every query
+        with inventoryLock:
+            options = (debug, outputFormat)
+            debug = 0
+            outputFormat = ""
+            argv[:] = [script] + args
+            self.server.output.capture()
+            try:
+                cmdParser()
+            except SystemExit:
+                pass
+            except Exception as e:
+                print("{}: {}".format(e.__class__.__name__, e))
+            finally:
+                text = self.server.output.release()
+                debug, outputFormat = options
+        self.wfile.write("ok\n")
+        self.wfile.write(text)
+        if self.server.verbose:
+            print("{} {} answered in {:.1f}ms".format(datetime.datetime.now().strftime("%H:%M:%S"), " ".join(args), (time.time() - start) * 1000))
+
+class DaemonServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+def serveDaemon(interval):
+    # --daemon: load the inventory, reload it every interval seconds (or as soon as
+    # another run invalidates the inventory cache) and answer DAEMON_COMMANDS on
+    # DAEMON_SOCKET until interrupted
+    # input -> seconds between inventory refreshes
+    global serving
+    if debug > 0:
+        print("calling serveDaemon({})".format(interval))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(DAEMON_SOCKET)
+        print("inventory daemon already running on {}".format(DAEMON_SOCKET))
+        exit()
+    except socket.error:
+        pass
+    finally:
+        sock.close()
+    if os.path.exists(DAEMON_SOCKET):
+        os.remove(DAEMON_SOCKET)
+    print("Loading inventory...")
+    loadInventory(verbose=True)
+    mask = os.umask(0177)
+    try:
+        server = DaemonServer(DAEMON_SOCKET, DaemonHandler)
+    finally:
+        os.umask(mask)
+    server.output = ThreadOutput(sys.stdout)
+    server.verbose = debug > 0
+    sys.stdout = server.output
+    serving = True
+
+    def refreshInventory():
+        last = time.time()
+        cached = os.path.exists(INVENTORY_CACHE_FILE)
+        while True:
+            time.sleep(1)
+            if time.time() - last < interval and (os.path.exists(INVENTORY_CACHE_FILE) or not cached):
+                continue
+            start = time.time()
+            try:
+                loadInventory()
+                now = datetime.datetime.now().strftime("%H:%M:%S")
+                print("{} inventory refreshed in {:.2f}s".format(now, time.time() - start))
+                while inventoryEvents:
+                    print("{} {}".format(now, describeEvent(inventoryEvents.popleft())))
+            except SystemExit:
+                print("inventory refresh failed, previous inventory is still used")
+            last = time.time()
+            cached = os.path.exists(INVENTORY_CACHE_FILE)
+
+    t = threading.Thread(target=refreshInventory)
+    t.daemon = True
+    t.start()
+    print("inventory daemon ready on {} (refreshed every {}s)".format(DAEMON_SOCKET, interval))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\ninventory daemon stopped")
+    finally:
+        os.remove(DAEMON_SOCKET)
 
 def getNASnames():
     # return Nasserver name list from nas server obj list
@@ -680,33 +2638,25 @@ def getSharebyName(name):
 	# get a NAS share from a queries name
 	# input -> name of a share
 	# output -> sha object 
-    global shares
     if len(shares) == 0:
-	shares = getShares()
-    # return Nasserver object from a query by name of nas server obj list
+	loadInventory(["shares"])
+    # return Share object from a query by name of share obj list
     # if not found return None
     if debug > 0:
         print("calling getSharebyName({})".format(name))
-    for share in shares:
-        if name == share.name:
-	    return share
-    return None
+    return inventory.shareByName.get(name)
 
 def getNASbyName(name):
 	# return a nas object from a queries name
 	# input -> name (string)
 	# output -> nas object
-    global nasServers
     if len(nasServers) == 0:
-	nasServers = getnasServers()
+	loadInventory(["nasservers"])
     # return Nasserver object from a query by name of nas server obj list
     # if not found return None
     if debug > 0:
         print("calling getNASbyName({})".format(name))
-    for nas in nasServers:
-        if name == nas.name:
-	    return nas
-    return None
+    return inventory.nasByName.get(name)
 
 def getNASbyID(ID):
     # return Nasserver object from a query by ID of nas server obj list
@@ -714,23 +2664,15 @@ def getNASbyID(ID):
 	# output -> nas object
     if debug > 0:
         print("calling getNASbyID({})".format(ID))
-    for nas in nasServers:
-	print(nas.id)
-        if ID == nas.id:
-	    return nas
-    return None
+    return inventory.nasById.get(ID)
 
 def getFSbyID(ID):
     # return filesystem object from a query by ID of filesystem obj list
 	# input -> filesystem id (string)
 	# output -> filesystem object
-    global fileSystems
     if debug > 0:
         print("calling getFSbyID({})".format(ID))
-    for fs in fileSystems:
-        if ID == fs.id:
-	    return fs
-    return None
+    return inventory.fsById.get(ID)
     
 
 def printNASlist():
@@ -755,21 +2697,117 @@ def getFSidsByNasID(NASid):
     # return a list of filesystem ids associated to a queries NAS Server id
     # input -> nas server id
     # output -> a list of file system id
-    global fileSystems
-    filesystem_ids = []
-    for fs in fileSystems:
-        if fs.server == NASid:
-	    filesystem_ids.append(fs.id)
-    return filesystem_ids
+    return [fs.id for fs in inventory.filesystemsOf(NASid)]
 
 def getNASidByName(name):
     # return an id of nas server ids associated to a queries NAS Server id
     # input -> nas server id
     # output -> nas server id
-    global nasServers
-    for nas in nasServers:
-        if nas.name == name:
-	    return nas.id
+    nas = inventory.nasByName.get(name)
+    if nas:
+	return nas.id
+
+class OutputWriter(object):
+    # --output writer of records as json (one array), jsonl (one object per line) or
+    # csv (header and one row per record): text is collected and written to the
+    # stream in big chunks instead of one print per value
+
+    def __init__(self, format, names, stream=None):
+        self.format = format
+        self.names = names
+        self.stream = stream or sys.stdout
+        self.buffer = []
+        self.count = 0
+        if format == "csv":
+            self.csv = csv.writer(self, lineterminator="\n")
+            self.csv.writerow(names)
+        else:
+            self.keys = [json.dumps(name) + ": " for name in names]
+            if format == "json":
+                self.write("[")
+
+    def write(self, text):
+        self.buffer.append(text)
+        if len(self.buffer) >= 1000:
+            self.flush()
+
+    def flush(self):
+        self.stream.write("".join(self.buffer))
+        self.buffer = []
+
+    def record(self, values):
+        # write values of a record (in names order)
+        if self.format == "csv":
+            self.csv.writerow(["" if value is None else value for value in values])
+        else:
+            text = "{" + ", ".join(key + jsonValue(value) for key, value in zip(self.keys, values)) + "}"
+            if self.format == "jsonl":
+                self.write(text + "\n")
+            else:
+                self.write(("\n  " if self.count == 0 else ",\n  ") + text)
+        self.count += 1
+
+    def close(self):
+        if self.format == "json":
+            self.write("\n]\n" if self.count else "]\n")
+        self.flush()
+        self.stream.flush()
+
+def jsonValue(value):
+    # json text of a record value (string, integer or None)
+    if value is None:
+        return "null"
+    if isinstance(value, basestring):
+        return json.encoder.encode_basestring_ascii(value)
+    return str(value)
+
+def writeRecords(records, cls):
+    # write records of a class in --output format as soon as they are available
+    # input -> iterable of record objects, record class
+    # output -> number of records written
+    writer = OutputWriter(outputFormat, [name for name, field in cls.fields()])
+    for record in records:
+        writer.record(record.values())
+    writer.close()
+    return writer.count
+
+# uemcli command of the listings, used to stream --output of a full listing
+LISTING_COMMANDS = {
+    "filesystems": filesystem_show,
+    "nasservers": nasServer_show,
+    "snapshots": snapshot_show,
+    "shares": share_show,
+    "pools": pool_show,
+}
+
+def streamListing(listing):
+    # records of a listing: local inventory cache if still valid, otherwise records
+    # are returned while uemcli listing is read (nothing is kept in memory)
+    # input -> listing name
+    # output -> iterable of record objects
+    for name, function, variable, record in INVENTORY_LISTINGS:
+        if name == listing:
+            if useInventoryCache([listing]):
+                return globals()[variable]
+            return iterRecords(LISTING_COMMANDS[listing], record)
+
+def nasObjects(name, listings):
+    # nas server of a name with its filesystems and their shares for showNASFS and
+    # showNASSHARE, only these records are built with --columnar
+    # input -> nas server name, listings needed
+    # output -> (Nasserver or None, list of its filesystems, function filesystem id -> shares)
+    if columnar and not serving:
+        found = lookupRecords("nasservers", name) if name else []
+        nas = found[0] if found else None
+        store = loadColumns("filesystems")
+        filesystems = store.records(store.equal("server", nas.id)) if nas else []
+        if "shares" not in listings:
+            return nas, filesystems, None
+        store = loadColumns("shares")
+        return nas, filesystems, lambda fsID: store.records(store.equal("filesystem", fsID))
+    loadInventory(listings, cached=True)
+    nas = getNASbyName(name)
+    return nas, inventory.filesystemsOf(nas.id) if nas else [], inventory.sharesOf
 
 def showNASFS(name=None):
     # show list of filesystem with details of a given nas server name passed as name argument
@@ -781,17 +2819,16 @@ def showNASFS(name=None):
     outlist=[]
     if debug > 0:
 	print("calling showNASFS({})".format(name))
-    nasServers = getNASservers()
-    NASid = getNASidByName(name)
+    nas, filesystems, sharesOf = nasObjects(name, ["nasservers", "filesystems"])
+    NASid = nas.id if nas else None
+    if outputFormat:
+        writeRecords(filesystems, Filesystem)
+        exit()
     if NASid:
-        fileSystems = getFilesystems()
-        fileSystem_ids = []
-        fileSystem_ids = getFSidsByNasID(NASid)
-	if len(fileSystems) > 0: 
-	    for fs in fileSystems:
-		if fs.server ==  NASid:
-		    outlist.append(fs)
-	    	    print("NAS: ({}) fs: ({})".format(name, fs.name))
+	if len(filesystems) > 0: 
+	    for fs in filesystems:
+		outlist.append(fs)
+		print("NAS: ({}) fs: ({})".format(name, fs.name))
 	else:
 	    print("no file system present".format(name)) 
     else:
@@ -810,19 +2847,15 @@ def showNASSHARE(name=None):
     global fileSystems
     if debug > 0:
 	print("calling showNASSHARE({})".format(name))
-    nasServers = getNASservers()
-    nas = getNASbyName(name)
+    nas, filesystems, sharesOf = nasObjects(name, ["nasservers", "shares", "filesystems"])
+    if outputFormat:
+        writeRecords([share for fs in filesystems for share in sharesOf(fs.id)], Share)
+        exit()
     if nas:
-        shares = getShares()
-        fileSystems = getFilesystems()
-        NASid = getNASidByName(name)
-        fileSystem_ids = []
-        fileSystem_ids = getFSidsByNasID(NASid)
-	if len(shares) > 0: 
-	    for share in shares:
-		if share.filesystem in fileSystem_ids:
-		    fs = getFSbyID(share.filesystem)
-	    	    print("NAS: ({}) share: ({}) fs: ({}) path: ({}) export: ({})".format(name, share.name, fs.name, share.path, share.export))
+	if any(sharesOf(fs.id) for fs in filesystems): 
+	    for fs in filesystems:
+		for share in sharesOf(fs.id):
+		    print("NAS: ({}) share: ({}) fs: ({}) path: ({}) export: ({})".format(name, share.name, fs.name, share.path, share.export))
 	else:
 	    print("no share present in nas server ()".format(name)) 
     else:
@@ -837,21 +2870,25 @@ def showSHARE(name=None):
 	# input -> share name (if no input all share will be printed) 
 	# output -> print only (no return)
     global shares
-    shares = getShares()
-    if len(shares) > 0: 
-	if debug > 0:
-	    print("calling showSHARE({})".format(name))
-	if name: 
-	    share = getSharebyName(name)
+    if debug > 0:
+	print("calling showSHARE({})".format(name))
+    if outputFormat:
+        writeRecords(lookupRecords("shares", name) if name else streamListing("shares"), Share)
+        return
+    if name: 
+	found = lookupRecords("shares", name)
+	if found:	
+	    share = found[0]
 	    print("-- share name --> {} --".format(share.name))
-	    if share:	
-		share.show()
-	    else:
-		print("share ({}) not found".format(name))
+	    share.show()
 	else:
-	    for share in shares:
-		print("-- share name --> {} --".format(share.name))
-		share.show()
+	    print("share ({}) not found".format(name))
+	return
+    loadInventory(["shares"], cached=True)
+    if len(shares) > 0: 
+	for share in shares:
+	    print("-- share name --> {} --".format(share.name))
+	    share.show()
     else:
 	print("no share listed in unity") 
 
@@ -862,17 +2899,20 @@ def showSNAP(name=None):
     # show snap detail (all snaps are displayed if no name arg is passed)
 	# input -> snap name (if no input all snap will be printed) 
 	# output -> print only (no return)
-    global shapshots
-    snapshots = getSnaps()
+    global snapshots
     if debug > 0:
         print("calling showSNAP({})".format(name))
+    if outputFormat:
+        writeRecords(lookupRecords("snapshots", name) if name else streamListing("snapshots"), Snapshot)
+        return
     if name: 
-        for snap in snapshots:
-            if snap.name == name:
-	        snap.show()
-        else:
+        found = lookupRecords("snapshots", name)
+        for snap in found:
+	    snap.show()
+        if not found:
             print("snap ({}) not found".format(name))
     else:
+        loadInventory(["snapshots"], cached=True)
         print("\nList of all snapshots:\n")
         for snap in snapshots:
             print("  {}".format(snap.name))
@@ -880,21 +2920,118 @@ def showSNAP(name=None):
                 snap.show()
                 print("---")
 
+# --showSNAP filters and their value (None for a switch)
+SNAP_FILTERS = {"-fs": "filesystem name", "-prefix": "name prefix", "-match": "name regular expression", "-state": "state", "--dr": None, "--limit": "number of snapshots", "--sort": "column"}
+SNAP_SORT_COLUMNS = {"id": 0, "name": 1, "state": 2, "source": 4} # --sort column -> Snapshot column
+
+def findSnaps(name, filters):
+    # snapshots matching a name (if not None) and --showSNAP filters: rows are tested
+    # while the listing is read (or the inventory cache rows) and only the matching
+    # ones become Snapshot objects, reading stops as soon as the result is complete
+    # (exact name of a filesystem snapshot, --limit without --sort), with --sort only
+    # the --limit first snapshots are kept (bounded heap); with --columnar only the
+    # rows selected in the columns by -fs, name or -prefix are tested
+    # input -> snapshot name or None, dictionary of filters (see SNAP_FILTERS)
+    # output -> list of Snapshot objects, None if -fs filesystem does not exist
+    tests = []
+    if name is not None:
+        tests.append(lambda row: decodeText(row[1]) == name)
+    if "-fs" in filters:
+        found = lookupRecords("filesystems", filters["-fs"])
+        if not found:
+            return None
+        fsID = found[0].id
+        tests.append(lambda row: decodeText(row[4]) == fsID)
+    if "-prefix" in filters:
+        tests.append(lambda row: decodeText(row[1]).startswith(filters["-prefix"]))
+    if "-match" in filters:
+        tests.append(lambda row: filters["-match"].search(decodeText(row[1])) is not None)
+    if "-state" in filters:
+        state = filters["-state"].lower()
+        tests.append(lambda row: decodeText(row[2]).lower() == state)
+    if "--dr" in filters:
+        tests.append(lambda row: DRTEST_SNAP_PATTERN.search(decodeText(row[1])) is not None)
+    limit = filters.get("--limit")
+    sort = filters.get("--sort")
+    if serving:
+        rows = (snap.row() for snap in snapshots)
+    elif columnar:
+        store = loadColumns("snapshots")
+        if "-fs" in filters:
+            candidates = store.equal("source", fsID)
+        elif name is not None:
+            candidates = store.equal("name", name)
+        elif "-prefix" in filters:
+            candidates = store.prefix("name", filters["-prefix"])
+        else:
+            candidates = xrange(store.count)
+        rows = (store.row(n) for n in candidates)
+    else:
+        cached = None if refresh else readInventoryRows()
+        rows = iter(cached["snapshots"]) if cached and "snapshots" in cached else iterRows(snapshot_show, Snapshot)
+    matches = (row for row in rows if all(test(row) for test in tests))
+    if sort:
+        column = SNAP_SORT_COLUMNS[sort.lstrip("-")]
+        key = lambda row: decodeText(row[column])
+        if limit is None:
+            found = sorted(matches, key=key, reverse=sort.startswith("-"))
+        else:
+            found = (heapq.nlargest if sort.startswith("-") else heapq.nsmallest)(limit, matches, key=key)
+    else:
+        if name is not None and "-fs" in filters:
+            # snapshot names are unique in a filesystem
+            limit = 1 if limit is None else min(limit, 1)
+        found = list(itertools.islice(matches, limit))
+    if hasattr(rows, "close"):
+        # stop uemcli if the listing was not read to the end
+        rows.close()
+    return [Snapshot.fromRow(row) for row in found]
+
+def showSnapMatches(name, filters):
+    # show the snapshots matching --showSNAP filters (details of every snapshot
+    # if a name is given, otherwise names only, details with --debug)
+    # input -> snapshot name or None, dictionary of filters (see SNAP_FILTERS)
+    # output -> print only
+    if debug > 0:
+        print("calling showSnapMatches({},{})".format(name, filters))
+    found = findSnaps(name, filters)
+    if found is None:
+        print("filesystem ({}) not found".format(filters["-fs"]))
+        return
+    if outputFormat:
+        writeRecords(found, Snapshot)
+        return
+    if name is not None:
+        for snap in found:
+            snap.show()
+        if not found:
+            print("snap ({}) not found".format(name))
+        return
+    print("\nList of {} snapshots matching {}:\n".format(len(found), " ".join("{} {}".format(option, getattr(value, "pattern", value)) if value is not True else option for option, value in sorted(filters.items()))))
+    for snap in found:
+        print("  {}".format(snap.name))
+        if debug > 0:
+            snap.show()
+            print("---")
+
 def showFS(name=None):
     # show filesystem detail (all fs are displayed if no name arg is passed)
 	# input -> filesystem name (if no input all fs will be printed) 
 	# output -> print only (no return)
     global fileSystems
-    fileSystems = getFilesystems()
     if debug > 0:
 	print("calling showFS({})".format(name))
+    if outputFormat:
+        writeRecords(lookupRecords("filesystems", name) if name else streamListing("filesystems"), Filesystem)
+        return
     if name: 
-        fs = getFSbyName(name)
-        if fs:	
-	        fs.show()
+        found = lookupRecords("filesystems", name)
+        if found:	
+	        found[0].show()
         else:
             print("filesystem ({}) not found".format(name))
     else:
+        loadInventory(["filesystems"], cached=True)
         for fs in fileSystems:
 	        fs.show()
 
@@ -904,69 +3041,142 @@ def showNAS(name=None):
     # show NAS server detail (all fs are displayed if no fsName arg is passed)
 	# input -> nas server name (if no input all nas server will be printed) 
 	# output -> print only (no return)
-    nasServers = getNASservers()
     if debug > 0:
 	print("calling showNAS({})".format(name))
+    if outputFormat:
+        writeRecords(lookupRecords("nasservers", name) if name else streamListing("nasservers"), Nasserver)
+        return
     if name: 
-	nas = getNASbyName(name)
+	found = lookupRecords("nasservers", name)
         print("-- nas server name --> {} --".format(name))
-	if nas:
-	    nas.show()
+	if found:
+	    found[0].show()
 	else:
 	    print("NAS ({}) not found".format(name))
     else:
+        loadInventory(["nasservers"], cached=True)
         for nas in nasServers:
             print("-- nas server name --> {} --".format(nas.name))
             nas.show()
 
-def createNAS(name):
+def sizeBytes(value):
+    # decoded size column as an integer (0 if not available)
+    return int(value) if value.isdigit() else 0
+
+# columns of --report capacity --output (total and free are pool values, headroom
+# is the space a filesystem can still grow: maximum size, or size if not set, less size used)
+CAPACITY_COLUMNS = ["group", "name", "filesystems", "total", "free", "provisioned", "used", "protection", "headroom"]
+
+def reportCapacity(top=REPORT_TOP):
+    # --report capacity: provisioned, used and snapshot protection space of the
+    # filesystems per pool, nas server and tenant, computed in one pass, and the top
+    # filesystems with the least growth headroom (heap of top items, no full sort);
+    # with --columnar sizes are read from the integer arrays of the filesystem columns
+    # and objects are built only for the filesystems of the headroom list
+    # input -> number of filesystems of the growth headroom list
+    # output -> print only
+    if debug > 0:
+        print("calling reportCapacity({})".format(top))
+    if columnar and not serving:
+        loadInventory(["nasservers", "pools"], cached=True)
+        store = loadColumns("filesystems")
+        sizes = [store.sizes(name) for name in ("size", "sizeused", "protsizeused", "maxsize")]
+        poolid = store.names.index("poolid")
+        server = store.names.index("server")
+        # (key, size, used, protection, maximum size, pool id, nas server id) of every filesystem
+        filesystems = ((n, ) + tuple(max(column[n], 0) for column in sizes) + (store.value(poolid, n), store.value(server, n)) for n in xrange(store.count))
+        count = store.count
+        build = store.records
+    else:
+        loadInventory(["filesystems", "nasservers", "pools"], cached=True)
+        filesystems = ((fs, sizeBytes(fs.size), sizeBytes(fs.sizeused), sizeBytes(fs.protsizeused), sizeBytes(fs.maxsize), fs.poolid, fs.server) for fs in fileSystems)
+        count = len(fileSystems)
+        build = list
+    start = time.time()
+    # group name -> [filesystems, provisioned, used, protection]
+    byPool = dict((pool.id, [0, 0, 0, 0]) for pool in pools)
+    byNas = {}
+    byTenant = {}
+    tenantOf = dict((nas.id, nas.tenant or "(none)") for nas in nasServers)
+    least = []
+    for n, (key, size, used, protection, maxsize, fspool, fsserver) in enumerate(filesystems):
+        for totals in (byPool.setdefault(fspool, [0, 0, 0, 0]), byNas.setdefault(fsserver, [0, 0, 0, 0]), byTenant.setdefault(tenantOf.get(fsserver, "(none)"), [0, 0, 0, 0])):
+            totals[0] += 1
+            totals[1] += size
+            totals[2] += used
+            totals[3] += protection
+        # -headroom: the heap root is the filesystem with the most headroom kept so far
+        # (-n: the first of equal headrooms in listing order is kept)
+        item = (-(max(maxsize, size) - used), -n, key)
+        if len(least) < top:
+            heapq.heappush(least, item)
+        elif top > 0 and item > least[0]:
+            heapq.heapreplace(least, item)
+    least = sorted(least, reverse=True)
+    least = zip([-headroom for headroom, n, key in least], build([key for headroom, n, key in least]))
+    poolsById = dict((pool.id, pool) for pool in pools)
+    nasNames = dict((nas.id, nas.name) for nas in nasServers)
+    rows = []
+    for ID in sorted(byPool, key=lambda ID: poolsById[ID].name if ID in poolsById else ID):
+        pool = poolsById.get(ID)
+        rows.append(["pool", pool.name if pool else ID, byPool[ID][0], sizeBytes(pool.totalspace) if pool else None, sizeBytes(pool.freespace) if pool else None] + byPool[ID][1:] + [None])
+    for ID in sorted(byNas, key=lambda ID: nasNames.get(ID, ID)):
+        rows.append(["nasserver", nasNames.get(ID, ID), byNas[ID][0], None, None] + byNas[ID][1:] + [None])
+    for name in sorted(byTenant):
+        rows.append(["tenant", name, byTenant[name][0], None, None] + byTenant[name][1:] + [None])
+    for headroom, fs in least:
+        rows.append(["filesystem", fs.name, 1, None, None, sizeBytes(fs.size), sizeBytes(fs.sizeused), sizeBytes(fs.protsizeused), headroom])
+    if debug > 0:
+        print("{} filesystems aggregated in {:.3f}s".format(count, time.time() - start))
+    if outputFormat:
+        writer = OutputWriter(outputFormat, CAPACITY_COLUMNS)
+        for row in rows:
+            writer.record(row)
+        writer.close()
+        return
+    titles = {"pool": "Pools", "nasserver": "NAS servers", "tenant": "Tenants", "filesystem": "Filesystems with the least growth headroom"}
+    group = None
+    for row in rows:
+        if row[0] != group:
+            group = row[0]
+            print("\n{}\n{:<24} {:>6} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}".format(titles[group], "name", "fs", "total", "free", "provisioned", "used", "protection", "headroom"))
+        print("{:<24} {:>6} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}".format(row[1], row[2], *["" if value is None else getHumanReadableSize(value) for value in row[3:]]))
+
+def createNAS(name, pool=None):
     #create nas server in unity given nas server name (uemcli execution)
-    # input -> filesystem id (i.e. "res_1")
-    # snap name will be set according to variable "snapshot"
-    # output -> snapshot obj
+    # input -> nas server name, pool (global pool_id if None)
+    # output -> nas server obj (values not returned by create are read when needed)
     global cli
     global pool_id
     if name == "":
         print("empty nas name not allowed, exiting.")
         exit()
-    cmd = "{} -u {} /net/nas/server create -name {} -sp spa -pool {}".format(cli,uemcli_user,name,pool_id)
+    if pool is None:
+        pool = pool_id
+    cmd = "{} -u {} /net/nas/server create -name {} -sp spa -pool {}".format(cli,uemcli_user,name,pool)
     if debug > 0:
 	print("calling createNAS({})".format(name))
 	if debug > 1:
 	    print(cmd)
     try:
-        output = subprocess.check_output(cmd, shell=True)
+        output = checkOutput(cmd)
+        invalidateInventoryCache()
     except Exception as e:
         if debug>0:
             print(e.output)
         print("could not create nas server with uemcli, exiting")
         exit()
-	if (output.find("Operation completed successfully")>=0) and (output.find("ID") >= 0):
-	    for nasline in output.splitline():
-		if nasline.find("ID = "):
-		    nas_id = nasline.split("=")[1].strip()
-            # create nas server object of newly created snap
-            # first get nas server entry from uemcli command filtering by nas_id
-            # then create obj from output
-            if nas_id.find("nas") >= 0: #if find > 0 then string is found 
-                cmd = "{} /net/nas/server -id {} show -output csv".format(cli, nas_id)
-            try:
-                output = subprocess.check_output(cmd, shell=True)
-                nasline = output.splitlines()[1:]
-                id, name, netbios, sp, poolname, tenant, interface, nfsEnabled, nfs3Enabled, nfs4Enabled, cifsEnabled, multiprotocol, unixDirectoryService, health = nasline.split(",")
-                nas = Nasserver(id, name, netbios,sp,poolname,tenant,interface,nfsEnabled,nfs3Enabled,nfs4Enabled,cifsEnabled,multiprotocol,unixDirectoryService,health)
-                nasServers.append(nas)
-                return nas
-            except:
-                print("could not create nas server object, exiting")
-                exit()
-                return None
-            else:
-                print("could not find nas server with id -> {} , exiting".format(nas_id))    
-                exit()
-            return None
-                
-    return False
+    nas_id = ""
+    for nasline in output.splitlines():
+        if nasline.startswith("ID = "):
+            nas_id = nasline.split("=")[1].strip()
+    if nas_id.find("nas") < 0:
+        print("could not find id of nas server ({}) in uemcli output, exiting:\n{}".format(name, output))
+        exit()
+    # nas server object is built from the values already known, no uemcli show is needed
+    nas = Nasserver(nas_id, name, None, "spa", pool, None, None, None, None, None, None, None, None, None)
+    inventory.addNasserver(nas)
+    return nas
 
 def showPROXYSHARE(nasname):
     # create a proxy nas server in unity by executing svc_nas
@@ -974,16 +3184,27 @@ def showPROXYSHARE(nasname):
     # true or false according to result of this command
     global nasServers
     global nasServer
-    nasServers = getNASservers()
+    loadInventory(["nasservers"], cached=True)
     if nasname and nasname != "":
         for nas in nasServers:
             if nas.name == nasname:
                 nasServer = nas
                 proxynas = nas.name + DRTEST_PROXYNAS_SUFFIX
-                cmd = "sudo svc_nas {} -proxy_share -show".format(proxynas)
+                cmd = "{} {} -proxy_share -show".format(svcnas, proxynas)
                 if debug > 0:
                     print("calling showPROXYSHARE({}) ".format(nasname)) 
-                os.system(cmd)
+                if outputFormat:
+                    try:
+                        proxyshares = parseProxyShares(checkOutput(cmd))
+                    except Exception as e:
+                        print("Cannot check proxy nas status, exiting")
+                        exit()
+                    writer = OutputWriter(outputFormat, ["share", "target", "path"])
+                    for share_name in sorted(proxyshares):
+                        writer.record([share_name, proxyshares[share_name][0], proxyshares[share_name][1]])
+                    writer.close()
+                    exit()
+                systemCMD(cmd)
                 exit()
         if not nasServer:
             print("Please specify a valid replicated nas server")
@@ -997,16 +3218,28 @@ def showPROXY(nasname):
     # true or false according to result of this command
     global nasServers
     global nasServer
-    nasServers = getNASservers()
+    loadInventory(["nasservers"], cached=True)
     if nasname and nasname != "":
         for nas in nasServers:
             if nas.name == nasname:
                 nasServer = nas
                 proxynas = nas.name + DRTEST_PROXYNAS_SUFFIX
-                cmd = "sudo svc_nas {} -proxy -show".format(proxynas)
+                cmd = "{} {} -proxy -show".format(svcnas, proxynas)
                 if debug > 0:
                     print("calling showPROXY({}) ".format(nasname)) 
-                os.system(cmd)
+                if outputFormat:
+                    try:
+                        output = checkOutput(cmd)
+                    except Exception as e:
+                        print("Cannot check proxy nas status, exiting")
+                        exit()
+                    writer = OutputWriter(outputFormat, ["proxy", "nasserver"])
+                    for line in output.splitlines():
+                        if line.strip().startswith("NAS server:"):
+                            writer.record([proxynas, line.split(":", 1)[1].strip()])
+                    writer.close()
+                    exit()
+                systemCMD(cmd)
                 exit()
         if not nasServer:
             print("Please specify a valid replicated nas server")
@@ -1017,14 +3250,14 @@ def createProxyNAS(proxynas, nas):
     # create a proxy nas server in unity by executing svc_nas
     # input -> string of proxy nas and nas server
     # true or false according to result of this command
-    cmd = "sudo svc_nas {} -proxy -show".format(proxynas)
+    cmd = "{} {} -proxy -show".format(svcnas, proxynas)
     output=""
     if debug > 0:
         print("calling createProxyNAS({},{}) ".format(proxynas,nas)) 
         print("executing cmd:\n{}".format(cmd)) 
     try:
 	# subprocess "svc_nas" must be run with shell=True
-	output = subprocess.check_output(cmd,shell=True)
+	output = checkOutput(cmd)
 	if output.find("NAS server: ") >= 0 and output.find(nas.name) >=0:
 	    print("found Proxy NAS ({}) already associated with nas server ({})".format(proxynas,nas.name))
         # cleanup = raw_input("do you want to clean existing shares ?")
@@ -1039,12 +3272,13 @@ def createProxyNAS(proxynas, nas):
             print("Cannot check proxy nas status...")
     
     print("Setting Proxy NAS ({}) association with nas server ({})".format(proxynas,nas))
-    cmd = "sudo svc_nas {} -proxy -add {}".format(proxynas, nas.name)
+    cmd = "{} {} -proxy -add {}".format(svcnas, proxynas, nas.name)
     if debug > 0:
         print(cmd)
     try:
         # subprocess "svc_nas" must be run with shell=True
-        output = subprocess.check_output(cmd,shell=True)
+        output = checkOutput(cmd)
+        invalidateInventoryCache()
         print("done")
         return True
     except Exception as e:
@@ -1052,10 +3286,10 @@ def createProxyNAS(proxynas, nas):
             print(e.message)
         print("cannot create proxy nas server ({}) of replicated nas server ({})".format(proxynas, nas.name))
         print("please check if it already exists:")
-        cmd = "sudo svc_nas {} -proxy -show".format(proxynas)
+        cmd = "{} {} -proxy -show".format(svcnas, proxynas)
     try:
         # subprocess "svc_nas" must be run with shell=True
-        output = subprocess.check_output(cmd,shell=True)
+        output = checkOutput(cmd)
     except Exception as e:
         if debug>0:
             print(e.message)
@@ -1063,6 +3297,101 @@ def createProxyNAS(proxynas, nas):
         exit()
     return False
 
+def snapRetentionDays():
+    # days of DRTEST_SNAP_RETENTION (i.e. "15d" -> 15)
+    return int(DRTEST_SNAP_RETENTION.rstrip("d"))
+
+def drSnapDate(name):
+    # date embedded in a DR snapshot name ("<fs>_TESTDR_05Mar2020", also with text
+    # added after the date)
+    # input -> snapshot name
+    # output -> datetime.date, None if name is not a DR snapshot or has no valid date
+    match = DRTEST_SNAP_PATTERN.search(name)
+    if not match:
+        return None
+    try:
+        return datetime.datetime.strptime(match.group(1), "%d%b%Y").date()
+    except ValueError:
+        return None
+
+DRTEST_SNAP_PATTERN = re.compile(re.escape(DRTEST_PROXYNAS_SUFFIX) + r"_(\d{1,2}[A-Za-z]{3}\d{4})")
+
+
+def usedDrSnaps():
+    # names of the snapshots used by proxy shares of the proxy nas servers
+    # (first directory of proxy share path), proxy nas servers are read at the same time
+    # no input (nas servers must be loaded)
+    # output -> set of (replicated nas name, snapshot name)
+    proxies = [nas for nas in nasServers if nas.name.endswith(DRTEST_PROXYNAS_SUFFIX)]
+    used = set()
+    for proxy, result in zip(proxies, runCommands(["{} {} -proxy_share -show".format(svcnas, proxy.name) for proxy in proxies])):
+        if not isinstance(result, CommandResult) or result.status:
+            print("Cannot check proxy shares of proxy NAS server ({}), exiting".format(proxy.name))
+            exit()
+        for target, path in parseProxyShares(result.stdout).values():
+            used.add((target, path.strip("/").split("/")[0]))
+    return used
+
+def purgeSNAP(names, days, unattached=False, dryrun=False, rate=DRTEST_PURGE_RATE):
+    # delete DR snapshots ("<fs>_TESTDR_<ddMonYYYY>...") older than days or (unattached)
+    # not used by any proxy share, at the same time (at most MAX_PROCESSES uemcli and
+    # rate deletions per second)
+    # input -> filesystems, glob patterns or nas server names (all filesystems if empty),
+    #          age in days, unattached, dryrun to only list the snapshots to delete, rate
+    # output -> print only
+    if debug > 0:
+        print("calling purgeSNAP({},{},{},{},{})".format(names, days, unattached, dryrun, rate))
+    loadInventory(["filesystems", "snapshots", "nasservers"])
+    if names:
+        filesystems, unknown = resolveFilesystems(names)
+        if unknown:
+            print("Could not find filesystem or NAS server ({}) please check your command".format(", ".join(unknown)))
+            exit()
+    else:
+        filesystems = fileSystems
+    used = usedDrSnaps() if unattached else set()
+    today = datetime.date.today()
+    purge = []
+    for fs in filesystems:
+        nas = inventory.nasById.get(fs.server)
+        for snap in inventory.snapshotsOf(fs.id):
+            if not DRTEST_SNAP_PATTERN.search(snap.name):
+                continue
+            date = drSnapDate(snap.name)
+            age = (today - date).days if date else None
+            if age is not None and age > days:
+                purge.append((fs, snap, "{} days old".format(age)))
+            elif unattached and (nas.name if nas else "", snap.name) not in used:
+                purge.append((fs, snap, "not used by proxy shares"))
+    print("{:<24} {:<40} {}".format("filesystem", "snapshot", "reason"))
+    for fs, snap, reason in purge:
+        print("{:<24} {:<40} {}".format(fs.name, snap.name, reason))
+    if dryrun or not purge:
+        print("\n{} DR snapshots to delete{}".format(len(purge), " (dry run, nothing deleted)" if dryrun else ""))
+        return
+    limiter = RateLimiter(rate)
+
+    def purgeJob(job):
+        fs, snap, reason = job
+        limiter.wait()
+        if not deleteSNAP(snap.id):
+            print("could not delete snap ({}) of filesystem ({})".format(snap.name, fs.name))
+            exit()
+        return True
+
+    print("\nDeleting {} DR snapshots, {} at a time, at most {} per second".format(len(purge), min(len(purge), MAX_PROCESSES), rate))
+    start = time.time()
+    results = runParallel(purgeJob, purge, MAX_PROCESSES, failfast=False)
+    summary = {}
+    for (fs, snap, reason), (result, error) in zip(purge, results):
+        deleted, failed = summary.get(fs.name, (0, 0))
+        summary[fs.name] = (deleted + (error is None), failed + (error is not None))
+    print("\n{:<24} {:>8} {:>8}".format("filesystem", "deleted", "failed"))
+    for name in sorted(summary):
+        print("{:<24} {:>8} {:>8}".format(name, summary[name][0], summary[name][1]))
+    print("\n{} of {} DR snapshots deleted in {:.1f}s".format(sum(deleted for deleted, failed in summary.values()), len(purge), time.time() - start))
+    clientPolicy.report()
+
 def deleteSNAP(snapID):
     #delete fs snapshot in unity given snapshot id (uemcli execution)
     # input -> snapshot id (i.e. "123456654321")
@@ -1074,7 +3403,9 @@ def deleteSNAP(snapID):
 	if debug > 1:
 	    print(cmd)
     try:
-	output = subprocess.check_output(cmd, shell=True)
+	output = checkOutput(cmd)
+	invalidateInventoryCache()
+	inventory.removeSnapshot(snapID)
 	return True
     except:
 	return False
@@ -1096,38 +3427,112 @@ def createSNAP(fsID,snapname):
 	if debug > 1:
 	    print(cmd)
     try:
-        output = subprocess.check_output(cmd, shell=True)
+        output = checkOutput(cmd)
+        invalidateInventoryCache()
     except Exception as e:
         print("could not create snapshot:\n{}".format(e.output))
         if debug > 0:
             print (e)
         exit()
     # check if command return a successful message
-    snap_id = (output.split("\n")[0]).split(" = ")[1]
-    cmd = "{} /prot/snap -id {} show -output csv".format(cli, snap_id)
-    if debug>0:
-        print("snap name --> ({}) snap_id --> ({})".format(snapname,snap_id))
     try:
-        # create snapshot object of newly created snap
-        # first get snap entry from uemcli command filtering by snap_id
-        # then create obj from output
-        output = subprocess.check_output(cmd, shell=True)
-        snapline = output.splitlines()[1:]
-        if debug > 1:
-            print(snapline)
-        id, name, state, attached, source, sourceType, members, attachDetails = snapline[0].split(",")
-        s = Snapshot(id, name, state, attached, source, sourceType, members, attachDetails)
-        snapshots.append(s)
-        return s
-    except Exception as e:
-        print("could not create snapshot object, exiting")
-        print(e.message)
+        snap_id = (output.split("\n")[0]).split(" = ")[1].strip()
+    except IndexError:
+        print("could not find id of snapshot ({}) in uemcli output, exiting:\n{}".format(snapname, output))
         exit()
-        return None
-    else:
-        print("could not find snapshot with id -> {} , exiting".format(snap_id))    
+    if debug>0:
+        print("snap name --> ({}) snap_id --> ({})".format(snapname,snap_id))
+    # snapshot object is built from the values already known (values not returned by
+    # create are read with one uemcli show only if they are needed)
+    s = Snapshot(snap_id, snapname, None, None, fsID, None, None, None)
+    inventory.addSnapshot(s)
+    return s
+
+def snapNameIndex():
+    # index of the numbered snapshot names ("<prefix>_snapN") already used
+    # no input (snapshots must be loaded)
+    # output -> dictionary prefix -> set of numbers N
+    index = {}
+    for snap in snapshots:
+        prefix, sep, number = snap.name.rpartition("_snap")
+        if sep and number.isdigit():
+            index.setdefault(prefix, set()).add(int(number))
+    return index
+
+def allocateSnapName(index, prefix):
+    # first "<prefix>_snapN" name not used yet, reserved in the index
+    # input -> snapNameIndex() result, prefix (filesystem name)
+    # output -> snapshot name
+    numbers = index.setdefault(prefix, set())
+    x = 1
+    while x in numbers:
+        x += 1
+    numbers.add(x)
+    return prefix + "_snap" + str(x)
+
+GLOB_CHARACTERS = re.compile(r"[*?[]") # a name with one of them is a glob pattern
+
+def resolveFilesystems(names):
+    # filesystems matching names of filesystems, glob patterns or nas servers
+    # input -> list of names
+    # output -> list of filesystem objects (each one once), names not matching anything
+    found = []
+    unknown = []
+    for name in names:
+        if name in inventory.fsByName:
+            matches = [inventory.fsByName[name]]
+        elif name in inventory.nasByName:
+            matches = inventory.filesystemsOf(inventory.nasByName[name].id)
+        else:
+            matches = [fs for fs in fileSystems if fnmatch.fnmatchcase(fs.name, name)]
+        if not matches:
+            unknown.append(name)
+        for fs in matches:
+            if fs not in found:
+                found.append(fs)
+    return found, unknown
+
+def createFsSnaps(names, snapname=""):
+    # create snapshots of filesystems given by name, glob pattern or nas server name
+    # at the same time (at most MAX_PROCESSES uemcli running), names of the snapshots
+    # are snapname or the first "<filesystem>_snapN" not used
+    # input -> list of names, snapshot name ("" to allocate one per filesystem)
+    # output -> print only
+    if debug > 0:
+        print("calling createFsSnaps({},{})".format(names, snapname))
+    loadInventory(["filesystems", "snapshots", "nasservers"])
+    if len(names) == 2 and not snapname and names[0] in inventory.fsByName and not GLOB_CHARACTERS.search(names[1]) and resolveFilesystems(names[1:])[1]:
+        # "--snap filesystem snapname": only with a single filesystem and a second
+        # name that is not a pattern, a mistyped name of the bulk form is an error
+        snapname = names.pop()
+    if len(names) == 1 and names[0] in inventory.fsByName:
+        createFsSnap(names[0], snapname)
+    filesystems, unknown = resolveFilesystems(names)
+    if unknown:
+        print("Could not find filesystem or NAS server ({}) please check your command".format(", ".join(unknown)))
+        print("(the snapshot name of several filesystems is given with -name)")
         exit()
-    return None
+    index = snapNameIndex()
+    jobs = [(fs, snapname or allocateSnapName(index, fs.name)) for fs in filesystems]
+    created = {}
+
+    def snapJob(job):
+        fs, name = job
+        snap = createSNAP(fs.id, name)
+        created[fs.id] = time.time()
+        print("snap ({}) of filesystem ({}) created, id {}".format(name, fs.name, snap.id))
+        return snap
+
+    print("Creating {} snapshots, {} at a time".format(len(jobs), min(len(jobs), MAX_PROCESSES)))
+    start = time.time()
+    results = runParallel(snapJob, jobs, MAX_PROCESSES, failfast=False)
+    failed = [fs.name for (fs, name), (result, error) in zip(jobs, results) if error is not None]
+    print("\n{} of {} snapshots created in {:.1f}s".format(len(created), len(jobs), time.time() - start))
+    clientPolicy.report()
+    if len(created) > 1:
+        print("first and last snapshot created {:.2f}s apart".format(max(created.values()) - min(created.values())))
+    if failed:
+        print("snapshots failed for filesystems: {}".format(", ".join(failed)))
 
 def createFsSnap(fsname,snapname):
     # create snapshot of a filesystem
@@ -1138,22 +3543,13 @@ def createFsSnap(fsname,snapname):
     global debug
     if debug>0:
         print("Calling createFsSnap({},{})".format(fsname,snapname))
-    fileSystems = getFilesystems()
+    # inventory is loaded by createFsSnaps()
     if snapname == "":
-        snapshots = getSnaps()
-        x=1
-        not_found = True
-        while not_found:
-            if debug > 0:
-                print("check if snapshot name is already used")
-            snapname = fsname + "_snap" + str(x)
-            snap = findSNAP(snapname)
-            if snap: 
-                if debug > 0:
-                    print("snapshot name ({}) already used".format(snapname))
-                x+=1
-            else:
-                not_found = False # snapshot found
+        if len(snapshots) == 0:
+            loadInventory(["filesystems", "snapshots"])
+        snapname = allocateSnapName(snapNameIndex(), fsname)
+    elif len(fileSystems) == 0:
+        loadInventory(["filesystems"])
     fs = getFSbyName(fsname)
     if fs:
         
@@ -1170,52 +3566,204 @@ def createFsSnap(fsname,snapname):
 
 def sendSUDOCMD(cmd):
     try:
-        output = subprocess.check_output(cmd,shell=True)
+        output = checkOutput(cmd)
         return output
     except Exception as e:
         print(e.message)
         return None
 
-def proxyshareCOPY(list_of_shares, snap, proxynas, nasname):
-    # copy list of shares from nas server to proxy name 
-    # input -> list of share obj, snap object and string proxynas name
-    # output -> True or False according to the results
-    if debug > 0:
-        print("calling proxyshareCOPY({},{},{}) ".format(list_of_shares,snap.name,proxynas,nasname)) 
-    global shares
-    global snapshot
-    shares = getShares()
-    fileSystem_ids = []
-    fileSystem_ids = getFSidsByNasID(nas.id)
-    cmd = "sudo svc_nas {} -proxy_share -show".format(proxynas)
+SVC_NAS_BATCH_MARKER = "@@unity_nashelper svc_nas"
+
+def svcnasSucceeded(output):
+    # check svc_nas output of a single proxy share command
+    return output is not None and (output.find(" : commands processed: 1") >= 0) and (output.find("command(s) succeeded") >= 0)
+
+def runSvcNas(proxynas, share_name, args):
+    # run a single svc_nas command of a proxy nas server
+    # input -> proxy nas name, share name, list of svc_nas arguments
+    # output -> (share name, succeeded, output)
+    cmdoutput = sendSUDOCMD("{} {} {}".format(svcnas, proxynas, " ".join(pipes.quote(arg) for arg in args)))
+    return (share_name, svcnasSucceeded(cmdoutput), cmdoutput)
+
+def runSvcNasBatch(proxynas, operations):
+    # run svc_nas commands of a proxy nas server through one shell for every
+    # SVC_NAS_BATCH_SIZE commands (instead of one sudo + shell + svc_nas startup per
+    # command), a marker echoed after every command splits the output per command;
+    # if the batch cannot run commands are sent one by one; commands failing with a
+    # transient error are run again in a new batch (clientPolicy)
+    # input -> proxy nas name, list of (share name, list of svc_nas arguments)
+    # output -> list of (share name, succeeded, output) in operations order
+    results = {}
+    if svcnas.split()[0] == "sudo":
+        if not sudoBatch:
+            # a sudo shell is root access wider than svc_nas, sites that allow only
+            # svc_nas would refuse it: it is used only with --sudo-batch
+            return [runSvcNas(proxynas, share_name, args) for share_name, args in operations]
+        # privileged shell without password prompt (-n): when sudo does not allow sh
+        # the batch fails at once
+        shell = ["sudo", "-n", "sh", "-s"]
+        command = svcnas.split(None, 2)[2]
+    else:
+        shell = ["sh", "-s"]
+        command = svcnas
+    pending = list(enumerate(operations))
+    attempt = 0
+    while pending:
+        retry = []
+        for first in range(0, len(pending), SVC_NAS_BATCH_SIZE):
+            batch = pending[first:first + SVC_NAS_BATCH_SIZE]
+            script = []
+            for n, (index, (share_name, args)) in enumerate(batch):
+                script.append("{} {} {} 2>&1".format(command, pipes.quote(proxynas), " ".join(pipes.quote(arg) for arg in args)))
+                script.append('echo "{} {} $?"'.format(SVC_NAS_BATCH_MARKER, n))
+            if debug > 0:
+                print("running {} svc_nas commands on proxy nas ({}) in one batch".format(len(batch), proxynas))
+                if debug > 1:
+                    print("\n".join(script))
+            try:
+                result = runCommand(shell, input="\n".join(script) + "\n", family="svc_nas", timeout=COMMAND_TIMEOUTS["svc_nas"] + SVC_NAS_BATCH_COMMAND_TIMEOUT * len(batch), label="{} {} (batch of {} commands)".format(command, proxynas, len(batch)), ctype="svc_nas batch")
+                output = result.stdout + result.stderr
+            except CommandTimeout as e:
+                # commands completed before the timeout are kept, the others failed
+                print(e)
+                output = e.output or ""
+            outputs = {}
+            lines = []
+            for line in output.splitlines(True):
+                if line.startswith(SVC_NAS_BATCH_MARKER):
+                    outputs[int(line.split()[2])] = "".join(lines)
+                    lines = []
+                else:
+                    lines.append(line)
+            if not outputs:
+                # batch could not run (i.e. sudo not allowed for sh) or not even its first
+                # command completed before the timeout, send commands one by one
+                if debug > 0:
+                    print("svc_nas batch failed:\n{}".format(output))
+                for index, (share_name, args) in batch:
+                    results[index] = runSvcNas(proxynas, share_name, args)
+                continue
+            for n, (index, (share_name, args)) in enumerate(batch):
+                cmdoutput = outputs.get(n)
+                succeeded = svcnasSucceeded(cmdoutput)
+                results[index] = (share_name, succeeded, cmdoutput)
+                if not succeeded and cmdoutput and classifyError(cmdoutput) != "permanent":
+                    retry.append((index, (share_name, args)))
+        if retry and not clientPolicy.retry("{} {} -proxy_share batch".format(command, proxynas), "".join(results[index][2] for index, operation in retry), attempt):
+            break
+        pending = retry
+        attempt += 1
+    return [results[index] for index in range(len(operations))]
+
+def parseProxyShares(output):
+    # parse "svc_nas <proxy> -proxy_share -show" output, one proxy share per line
+    # with key=value items (i.e. "share=share1 target=nas1 path=/snap1/dir1")
+    # input -> svc_nas output
+    # output -> dictionary share name -> (target nas name, path)
+    proxyshares = {}
+    for line in output.splitlines():
+        items = dict(re.findall(r"(\w+)=(.*?)(?=\s+\w+=|\s*$)", line))
+        name = items.get("share", items.get("name"))
+        if name:
+            proxyshares[name] = (items.get("target", ""), items.get("path", ""))
+    return proxyshares
+
+def getProxyShares(proxynas):
+    # get proxy shares configured in a proxy nas server
+    # input -> proxy nas name
+    # output -> dictionary share name -> (target nas name, path), exit() if svc_nas fails
+    cmd = "{} {} -proxy_share -show".format(svcnas, proxynas)
     try:
         # subprocess "svc_nas" must be run with shell=True
         print("Check if Proxy Shares are already available in Proxy NAS server ({})".format(proxynas))
-        output = subprocess.check_output(cmd,shell=True)
+        output = checkOutput(cmd)
     except Exception as e:
         print("Cannot check proxy nas status, exiting")
         exit()
+    proxyshares = parseProxyShares(output)
+    if debug > 0:
+        print("{} proxy shares found in Proxy NAS server ({})".format(len(proxyshares), proxynas))
+    return proxyshares
+
+def diffProxyShares(nasname, desired, current):
+    # compute the svc_nas commands bringing proxy shares from current to desired state
+    # (a share already pointing to the same nas server and path is left untouched)
+    # input -> replicated nas name, list of (share name, path) wanted,
+    #          current proxy shares as returned by getProxyShares()
+    # output -> list of (share name, svc_nas arguments), number of unchanged shares
+    operations = []
+    unchanged = 0
+    for name, path in desired:
+        if current.get(name) == (nasname, path):
+            unchanged += 1
+            continue
+        if name in current:
+            # same share name with different target or path: replace it
+            operations.append((name, ["-proxy_share", "-remove", "-share", name]))
+        operations.append((name, ["-proxy_share", "-add", nasname, "-share", name, "-path", path]))
+    return operations, unchanged
+
+def runProxyShares(proxynas, nasname, desired, current):
+    # bring proxy shares of a proxy nas server to the desired state with the minimal
+    # number of svc_nas commands, sent in one batch
+    # input -> proxy nas name, replicated nas name, list of (share name, path),
+    #          current proxy shares (getProxyShares())
+    # output -> list of names of the shares failed
+    operations, unchanged = diffProxyShares(nasname, desired, current)
+    failed = []
+    for (share_name, args), (name, succeeded, cmdoutput) in zip(operations, runSvcNasBatch(proxynas, operations)):
+        if args[1] == "-remove":
+            if succeeded and debug > 0:
+                print("Deleted Proxy share ({}) already present in Proxy NAS server ({})".format(share_name,proxynas))
+        elif succeeded:
+            if debug > 0:
+                print("Added Proxy share ({}) in Proxy NAS server ({})".format(share_name,proxynas))
+        else:
+            print("Cannot add Proxy share ({}) in Proxy NAS server ({}):\n{}".format(share_name,proxynas,cmdoutput))
+            failed.append(share_name)
+    if operations:
+        invalidateInventoryCache()
+    if debug > 0:
+        print("Proxy NAS server ({}): {} proxy shares unchanged, {} svc_nas commands, {} failed".format(proxynas, unchanged, len(operations), len(failed)))
+    return failed
+
+def applyProxyShares(proxynas, nasname, desired, current):
+    # runProxyShares() with True or False according to the results
+    return len(runProxyShares(proxynas, nasname, desired, current)) == 0
+
+def pruneProxyShares(proxynas, nas, current):
+    # remove proxy shares pointing to a replicated nas server share that no longer exists
+    # input -> proxy nas name, replicated nas object, current proxy shares (getProxyShares())
+    # output -> number of proxy shares removed
+    names = set(share.name for fs in inventory.filesystemsOf(nas.id) for share in inventory.sharesOf(fs.id))
+    operations = [(name, ["-proxy_share", "-remove", "-share", name]) for name in sorted(current) if current[name][0] == nas.name and name not in names]
+    removed = 0
+    with timings.phase("proxy shares", nas.name):
+        results = runSvcNasBatch(proxynas, operations)
+    for name, succeeded, cmdoutput in results:
+        if succeeded:
+            print("Removed stale Proxy share ({}) from Proxy NAS server ({})".format(name, proxynas))
+            removed += 1
+        else:
+            print("Cannot remove stale Proxy share ({}) from Proxy NAS server ({}):\n{}".format(name, proxynas, cmdoutput))
+    if operations:
+        invalidateInventoryCache()
+    return removed
+
+def proxyshareCOPY(list_of_shares, snap, proxynas, nasname, current=None):
+    # copy list of shares from nas server to proxy name 
+    # input -> list of share obj, snap object, string proxynas name, replicated nas name
+    #          and proxy shares already configured (read from proxy nas if None)
+    # output -> True or False according to the results
+    if debug > 0:
+        print("calling proxyshareCOPY({},{},{}) ".format(list_of_shares,snap.name,proxynas,nasname)) 
+    if current is None:
+        current = getProxyShares(proxynas)
+    desired = []
     for share in list_of_shares:
-        proxy_share_path = "/" + snap.name + share.path
-        proxy_share_name = share.name
         if share.filesystem == snap.source: # compare filesystem id of share and snap
-            if output.find(proxy_share_name) >= 0:
-                if debug > 0:
-                    print("Proxy share ({}) already present in Proxy NAS server ({})".format(share.name,proxynas)) 
-                removecmd = "sudo svc_nas {} -proxy_share -remove -share {}".format(proxynas,proxy_share_name)
-                cmdoutput = sendSUDOCMD(removecmd) 
-                if (cmdoutput.find(" : commands processed: 1") >= 0) and (cmdoutput.find("command(s) succeeded") >= 0):
-                    if debug > 0:
-                        print("Deleted Proxy share ({}) already present in Proxy NAS server ({})".format(share.name,proxynas))
-            addsharecmd = "sudo svc_nas {} -proxy_share -add {} -share {} -path {}".format(proxynas,nasname,proxy_share_name,proxy_share_path)
-            cmdoutput = sendSUDOCMD(addsharecmd) 
-            if (cmdoutput.find(" : commands processed: 1") >= 0) and (cmdoutput.find("command(s) succeeded") >= 0):
-                if debug > 0:
-                    print("Added Proxy share ({}) in Proxy NAS server ({})".format(share.name,proxynas))
-            else:
-                # error return false
-                return False
-    return True 
+            desired.append((share.name, "/" + snap.name + share.path))
+    return applyProxyShares(proxynas, nasname, desired, current)
 
 def proxyshareDUP(proxynas,nas):
     # duplicate proxy share copying from nas server replication
@@ -1223,38 +3771,15 @@ def proxyshareDUP(proxynas,nas):
     # output -> True or False according to the results
     if debug > 0:
         print("calling proxyshareDUP({},{}) ".format(proxynas,nas)) 
-    global shares
     global snapshot
-    shares = getShares()
-    fileSystem_ids = []
-    fileSystem_ids = getFSidsByNasID(nas.id)
-    cmd = "sudo svc_nas {} -proxy_share -show".format(proxynas)
-    try:
-	    # subprocess "svc_nas" must be run with shell=True
-	    print("Check if Proxy Shares are already available in Proxy NAS server ({})".format(proxynas))
-	    output = subprocess.check_output(cmd,shell=True)
-    except Exception as e:
-        print("Cannot check proxy nas status, exiting")
+    current = getProxyShares(proxynas)
+    desired = []
+    for fs in inventory.filesystemsOf(nas.id):
+        for share in inventory.sharesOf(fs.id):
+            desired.append((share.name, "/" + snapshot + share.path))
+    if not applyProxyShares(proxynas, nas.name, desired, current):
+        print("Cannot copy proxy share...")
         exit()
-    for share in shares:
-        if share.filesystem in fileSystem_ids:
-            if output.find("/" + snapshot + share.path) >= 0:
-                print("Proxy share ({}) already available in Proxy NAS server ({})".format(share.name,proxynas)) 
-            else:
-                path = "/" + snapshot + share.path
-                cmd = "sudo svc_nas {} -proxy_share -add {} -share {} -path {}".format(proxynas,nas.name,share.name,path)
-                if debug > 0:
-                    print(cmd)
-                try:
-                    print("Copy Proxy share ({}) to Proxy NAS server ({}).".format(share.name, proxynas))
-                    # subprocess "svc_nas" must be run with shell=True
-                    output = subprocess.check_output(cmd,shell=True)
-                except Exception as e:
-                    if output.find("") >=0: # check if output contains "already exists"
-                        print("Proxy share ({}) with path ({}) already exists in server ({})".format(share.name,path,proxynas)) 
-                    else:
-                        print("Cannot copy proxy share...")
-                        exit()
     return True 
 
 
@@ -1265,35 +3790,24 @@ def findNAS(name):
     # output -> nas server object or None
     if debug > 0:
 	print("calling findNAS({})".format(name))
-    for nas in nasServers:
-	if nas.name == name:
-	    return nas
-    return None
+    return inventory.nasByName.get(name)
 
 def getSnapByName(snapname):
     # find return (if found) a snapshot object given a snap name in input
     # input -> snapshot name (i.e. "snap1")
     # output -> snapshot object or None
-    global snapshots
     if debug > 0:
         print("calling getSnapByName({})".format(snapname))
-    for snap in snapshots:
-        if snap.name == snapname:
-            return snap
-    return None
+    return inventory.snapByName.get(snapname)
     
 
 def getSnapByID(snapID):
     # find return (if found) a snapshot object given a snap id in input
     # input -> snapshot id (i.e. "snap_id")
     # output -> snapshot object or None
-    global snapshots
     if debug > 0:
         print("calling getSnapByID({})".format(snapID))
-    for snap in snapshots:
-        if snap.id == snapID:
-            return snap
-    return None
+    return inventory.snapById.get(snapID)
        
 def findSNAP(name):
     #find return (if found) a snapshot object given a name in input
@@ -1301,10 +3815,7 @@ def findSNAP(name):
     # output -> snapshot object or None
     if debug > 0:
         print("calling findSNAP({})".format(name))
-    for snap in snapshots:
-        if snap.name == name:
-            return snap
-    return None    
+    return inventory.snapByName.get(name)    
 
 
 def snap_filesystem(filesystem):
@@ -1314,11 +3825,131 @@ def getNASfsList(nasobj):
     # return a list of filesystem objects that belong to a nas server
     # input -> nas server obj
     # output -> nas obj list
-    filesystem_list = []
-    for fs in fileSystems:
-        if fs.server == nas.id:
-            filesystem_list.append(fs)
-    return filesystem_list
+    return list(inventory.filesystemsOf(nasobj.id))
+
+class Journal(object):
+    # append-only journal (json lines) of the completed --testDR steps: proxy nas
+    # association, snapshot (with its id) and proxy shares of every filesystem;
+    # every line is on disk before the next step starts, --resume reads it back
+    # to skip the steps still valid in unity
+
+    def __init__(self, filename):
+        self.base = filename
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.active = False
+        self.proxies = set()
+        self.snapshots = {} # filesystem name -> snapshot step
+        self.proxyshares = {} # filesystem name -> list of share names
+
+    def begin(self, nasnames):
+        # start the journal of a --testDR run of some nas servers, with --resume
+        # the previous journal is kept if it is for the same nas servers
+        nasnames = sorted(nasnames)
+        self.filename = self.fileOf(nasnames)
+        if resume:
+            steps = self.read()
+            if steps and steps[0].get("step") == "start" and steps[0].get("nasservers") == nasnames:
+                for step in steps:
+                    self.load(step)
+                print("Resuming DR run started {} ({} proxy NAS servers, {} snapshots, {} filesystems already set up)".format(steps[0]["time"], len(self.proxies), len(self.snapshots), len(self.proxyshares)))
+                self.active = True
+                return
+            print("No DR run of NAS servers ({}) to resume, starting a new one".format(", ".join(nasnames)))
+        try:
+            with open(self.filename, "w") as f:
+                f.write(json.dumps({"step": "start", "nasservers": nasnames, "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}) + "\n")
+            os.chmod(self.filename, 0600)
+            self.active = True
+        except (IOError, OSError) as e:
+            print("cannot write journal ({}), --resume will not be possible: {}".format(self.filename, e))
+
+    def fileOf(self, nasnames):
+        # journal file of a set of nas servers: runs of different nas servers at the
+        # same time do not overwrite (or remove) each other's journal
+        # input -> sorted list of nas server names
+        # output -> file name
+        suffix = "+".join(nasnames)
+        if len(suffix) > 64:
+            suffix = hashlib.sha1(suffix).hexdigest()
+        return "{}.{}".format(self.base, suffix)
+
+    def read(self):
+        # steps of the journal file (a line cut by a crash is ignored)
+        steps = []
+        try:
+            with open(self.filename) as f:
+                for line in f:
+                    try:
+                        steps.append(json.loads(line))
+                    except ValueError:
+                        break
+        except IOError:
+            pass
+        return steps
+
+    def load(self, step):
+        if step["step"] == "proxy":
+            self.proxies.add(step["nas"])
+        elif step["step"] == "snapshot":
+            self.snapshots[step["filesystem"]] = step
+        elif step["step"] == "proxyshares":
+            self.proxyshares[step["filesystem"]] = step["shares"]
+
+    def record(self, step, **values):
+        # append a completed step and make sure it is on disk
+        if not self.active:
+            return
+        values["step"] = step
+        with self.lock:
+            self.load(values)
+            try:
+                with open(self.filename, "a") as f:
+                    f.write(json.dumps(values) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except (IOError, OSError) as e:
+                print("cannot write journal ({}): {}".format(self.filename, e))
+
+    def proxyDone(self, nas):
+        # True if the proxy nas of a nas server was set up and is still present
+        return nas.name in self.proxies and findNAS(nas.name + DRTEST_PROXYNAS_SUFFIX) is not None
+
+    def choice(self, fs):
+        # chooseDrSnap(fs) result reusing the snapshot created by the previous run
+        # if it is still present, None otherwise
+        step = self.snapshots.get(fs.name)
+        if step:
+            snap = inventory.snapById.get(step["id"])
+            if snap and snap.name == step["name"] and snap.source == fs.id:
+                return ("reuse", snap.name, snap)
+        return None
+
+    def fsDone(self, fs, nas, proxyshares):
+        # True if snapshot and proxy shares of a filesystem were set up and are still
+        # present, proxy shares pointing to the journaled snapshot (proxyshares as
+        # returned by getProxyShares())
+        shares = self.proxyshares.get(fs.name)
+        choice = self.choice(fs)
+        if shares is None or proxyshares is None or not choice:
+            return False
+        prefix = "/" + choice[1]
+        for name in shares:
+            target, path = proxyshares.get(name, (None, ""))
+            if target != nas.name or not (path == prefix or path.startswith(prefix + "/")):
+                return False
+        return True
+
+    def finish(self):
+        # remove the journal when the run is completed
+        if self.active:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+            self.active = False
+
+journal = Journal(DRTEST_JOURNAL_FILE)
 
 def createDrProxy(nas):
     # create or reuse existing proxy NAS of a given nas server 
@@ -1331,74 +3962,425 @@ def createDrProxy(nas):
         print("setting it as proxy nas of NAS server ({})".format(nas.name)) 
     else:
         print("Proxy NAS server ({}) not present, creating it...".format(proxyNAS_name))
-        proxyNAS = createNAS(proxyNAS_name)    
+        proxyNAS = createNAS(proxyNAS_name, nas.poolname)    
         print("setting it as proxy nas of NAS server ({})".format(nas.name))
     return createProxyNAS(proxyNAS_name, nas)    
 
-def createDrSnap(fs):
-    # create or reuse existing snapshot of a given filesystem 
+def chooseDrSnap(fs):
+    # decide (asking the user if a DR snapshot is already present) what to do with
+    # the DR snapshot of a given filesystem
     # input -> fs object
-    # output -> snap object
+    # output -> (action, snap name, existing snap object) where action is
+    #           "create", "reuse" or "recreate"
     global snapshot
     snapshot = fs.name + DRTEST_SNAP_SUFFIX
     snap = findSNAP(snapshot)
-    if snap: # snap is found
-        print("\nSnap for DR testing is already present ({})".format(snap.name))
-        if debug>0:
-            snap.show()
-            print("-----")
-        reuse = ""
+    if not snap:
+        return ("create", snapshot, None)
+    print("\nSnap for DR testing is already present ({})".format(snap.name))
+    if debug>0:
+        snap.show()
+        print("-----")
+    reuse = ""
+    try:
+        reuse = raw_input("snap ({}) already exists, do you wish to use this for DR testing ? [y/n]: ".format(snapshot))
+    except KeyboardInterrupt:
+        print("\nUser interruption, exiting")
+        exit()
+    if (reuse == "y") or (reuse == "yes") or (reuse == "Y"):
+        return ("reuse", snapshot, snap)
+    elif (reuse == "n") or (reuse == "no") or (reuse == "N"):
+        delete = ""
         try:
-            reuse = raw_input("snap ({}) already exists, do you wish to use this for DR testing ? [y/n]: ".format(snapshot))
+            delete = raw_input("do you wish to delete it and recreate it with the same name ? [y/n]: ") 
         except KeyboardInterrupt:
             print("\nUser interruption, exiting")
             exit()
-        if (reuse == "y") or (reuse == "yes") or (reuse == "Y"):
-            pass
-        elif (reuse == "n") or (reuse == "no") or (reuse == "N"):
-            delete = ""
-            try:
-                delete = raw_input("do you wish to delete it and recreate it with the same name ? [y/n]: ") 
-            except KeyboardInterrupt:
-                print("\nUser interruption, exiting")
-                exit()
-            if (delete == "y") or (delete == "yes") or (delete == "Y"):
-                print("deleting snap ({})".format(snap.name))
-                if deleteSNAP(snap.id):
-                    print("creating snap ({})".format(snap.name))
-                    snap = createSNAP(fs.id, snapshot)
-                else:
-                    print("Failed deleting snap ({}) of filesystem ({}) , exiting.".format(snap.id,fs.name))
-                    exit()
-            elif (delete == "n") or (delete == "no") or (delete == "N"):
-                snapshot = raw_input("Please enter fs ({}) snapshot name that will be used: ".format(fs.name))
-                print("creating snap ({})".format(snapshot))
-                snap = createSNAP(fs.id, snapshot)
+        if (delete == "y") or (delete == "yes") or (delete == "Y"):
+            return ("recreate", snapshot, snap)
+        elif (delete == "n") or (delete == "no") or (delete == "N"):
+            snapshot = raw_input("Please enter fs ({}) snapshot name that will be used: ".format(fs.name))
+            return ("create", snapshot, None)
+    print("not sure what you want to do with snapshot, exiting.")
+    exit()
+
+def createDrSnap(fs, choice=None):
+    # create or reuse existing snapshot of a given filesystem 
+    # input -> fs object, optional choice already returned by chooseDrSnap(fs)
+    # output -> snap object
+    if choice is None:
+        choice = chooseDrSnap(fs)
+    action, snapname, snap = choice
+    if action == "reuse":
+        return snap
+    if action == "recreate":
+        print("deleting snap ({})".format(snap.name))
+        if deleteSNAP(snap.id):
+            print("creating snap ({})".format(snap.name))
+            snap = createSNAP(fs.id, snapname)
         else:
-            print("not sure what you want to do with snapshot, exiting.")
+            print("Failed deleting snap ({}) of filesystem ({}) , exiting.".format(snap.id,fs.name))
             exit()
     else:
-        print "creating snap ({})".format(snapshot),  # end comma will make print stay on the same line
-        snap = createSNAP(fs.id, snapshot)
+        sys.stdout.write("creating snap ({}) ".format(snapname))  # no newline, print stays on the same line
+        snap = createSNAP(fs.id, snapname)
         print(snap)
         if debug > 0:
             print(snap.show())
     return snap
 
+def setupDrFs(fs, nas, choice=None, proxyshares=None):
+    # create DR snapshot of a filesystem belonging to a replicated nas server, its proxy
+    # shares are set up with the ones of the other filesystems by setupDrShares()
+    # input -> fs object, nas object, optional chooseDrSnap(fs) result
+    #          and proxy shares already configured (getProxyShares())
+    # output -> snap object (exit() on failure)
+    if journal.fsDone(fs, nas, proxyshares):
+        print("\nfile system ({}) already set up, skipped".format(fs.name))
+        return journal.choice(fs)[2]
+    if choice is None:
+        choice = journal.choice(fs)
+    with timings.phase("snapshot", fs.name):
+        snap = createDrSnap(fs, choice)
+    if not snap:
+        print("Create DR snap failed for FS ({})".format(fs.name))
+        exit()
+    journal.record("snapshot", nas=nas.name, filesystem=fs.name, fsid=fs.id, name=snap.name, id=snap.id)
+    return snap
+
+def drProxyShares(fs, snap):
+    # proxy shares of the shares exported from a filesystem, pointing to its DR snapshot
+    # input -> fs object, snap object
+    # output -> list of (share name, path)
+    return [(share.name, "/" + snap.name + share.path) for share in inventory.sharesOf(fs.id) if share.filesystem == snap.source]
+
+def setupDrShares(nas, snaps, proxyshares):
+    # create or update the proxy shares of all the filesystems of a replicated nas server
+    # with a DR snapshot in one svc_nas batch (instead of one batch per filesystem)
+    # input -> nas object, list of (fs object, snap object), proxy shares already
+    #          configured (getProxyShares())
+    # output -> list of names of the filesystems whose proxy shares failed
+    proxyNAS_name = nas.name + DRTEST_PROXYNAS_SUFFIX
+    desired = [(fs, drProxyShares(fs, snap)) for fs, snap in snaps]
+    with timings.phase("proxy shares", nas.name):
+        failed = set(runProxyShares(proxyNAS_name, nas.name, [entry for fs, entries in desired for entry in entries], proxyshares))
+    failedfs = []
+    for fs, entries in desired:
+        names = [name for name, path in entries]
+        if failed.intersection(names):
+            print("\nProxy shares copy failed for file system ({})".format(fs.name))
+            failedfs.append(fs.name)
+        else:
+            journal.record("proxyshares", nas=nas.name, filesystem=fs.name, shares=names)
+    print("\nProxy shares copied for {} of {} file systems of NAS server ({})".format(len(desired) - len(failedfs), len(desired), nas.name))
+    return failedfs
+
+def prepareDrNas(nas):
+    # create or update the proxy nas of a replicated nas server and read its proxy shares
+    # input -> nas object
+    # output -> proxy shares already configured (getProxyShares()), exit() on failure
+    with timings.phase("proxy NAS", nas.name):
+        if not journal.proxyDone(nas):
+            if not createDrProxy(nas):
+                print("Proxy NAS server setup failed for NAS server ({})".format(nas.name))
+                exit()
+            journal.record("proxy", nas=nas.name, proxy=nas.name + DRTEST_PROXYNAS_SUFFIX)
+        return getProxyShares(nas.name + DRTEST_PROXYNAS_SUFFIX)
+
+def selectDrNasServers():
+    # nas servers selected by --testDR (-nas NAS1 NAS2 ... or --all-replicated)
+    # no input (inventory must be loaded)
+    # output -> list of nas objects, exit() if a nas server is not found
+    if allReplicated:
+        nas_list = [nas for nas in (getNASbyID(nasid) for nasid in getReplicatedNASids()) if nas]
+        if len(nas_list) == 0:
+            print("No replicated NAS servers found in this system")
+            exit()
+        return nas_list
+    nas_list = []
+    for name in drNasServers or [nasServer]:
+        nas = getNASbyName(name)
+        if not nas:
+            print("NAS server name ({}) not found in NAS server list".format(name))
+            print("Please check in this NAS server list\n-------")
+            printNASlist()
+            exit()
+        if nas not in nas_list:
+            nas_list.append(nas)
+    return nas_list
+
+def readProxyState(nas):
+    # read association and proxy shares of the proxy nas of a replicated nas server
+    # input -> nas object
+    # output -> (True if proxy nas is associated to nas server, proxy shares as
+    #           returned by getProxyShares()), exit() if svc_nas fails
+    proxynas = nas.name + DRTEST_PROXYNAS_SUFFIX
+    try:
+        output = checkOutput("{} {} -proxy -show".format(svcnas, proxynas))
+        associated = output.find("NAS server: ") >= 0 and output.find(nas.name) >= 0
+        proxyshares = parseProxyShares(checkOutput("{} {} -proxy_share -show".format(svcnas, proxynas)))
+    except Exception as e:
+        print("Cannot check proxy nas ({}) status: {}".format(proxynas, e))
+        exit()
+    return associated, proxyshares
+
+def planDrNas(nas, proxystate):
+    # actions needed to set up DR testing environment of a replicated nas server
+    # input -> nas object, readProxyState(nas) result (None if proxy nas does not exist)
+    # output -> dictionary with proxy nas, snapshots and proxy shares actions
+    proxynas = nas.name + DRTEST_PROXYNAS_SUFFIX
+    associated, current = proxystate or (False, {})
+    plan = {
+        "name": nas.name,
+        "id": nas.id,
+        "pool": nas.poolname,
+        "proxy": {"name": proxynas, "action": "reuse" if proxystate else "create", "associate": not associated},
+        "snapshots": [],
+        "proxyshares": [],
+    }
+    desired = []
+    for fs in inventory.filesystemsOf(nas.id):
+        snapname = fs.name + DRTEST_SNAP_SUFFIX
+        snap = [snap for snap in inventory.snapshotsOf(fs.id) if snap.name == snapname]
+        plan["snapshots"].append({"filesystem": fs.name, "fsid": fs.id, "name": snapname, "action": "reuse" if snap else "create", "id": snap[0].id if snap else None})
+        for share in inventory.sharesOf(fs.id):
+            desired.append((share.name, "/" + snapname + share.path))
+    operations, unchanged = diffProxyShares(nas.name, desired, current)
+    names = set(name for name, path in desired)
+    # proxy shares pointing to shares of the nas server that no longer exist
+    operations += [(name, ["-proxy_share", "-remove", "-share", name]) for name in sorted(current) if current[name][0] == nas.name and name not in names]
+    for name, args in operations:
+        if args[1] == "-add":
+            plan["proxyshares"].append({"share": name, "action": "add", "target": args[2], "path": args[6]})
+        else:
+            plan["proxyshares"].append({"share": name, "action": "remove", "target": current[name][0], "path": current[name][1]})
+    plan["unchanged"] = unchanged
+    return plan
+
+def planDR():
+    # --testDR --plan FILE: write the actions needed to set up DR testing environment
+    # of the selected nas servers, nothing is changed in unity
+    # no input
+    # no output, plan is written to planFile
+    start = time.time()
+    loadInventory(cached=True)
+    nas_list = selectDrNasServers()
+    # proxy nas servers already present are checked at the same time, a plan is not
+    # written unless the state of all of them is known
+    present = [nas for nas in nas_list if findNAS(nas.name + DRTEST_PROXYNAS_SUFFIX)]
+    results = runParallel(readProxyState, present, MAX_PROCESSES)
+    failed = [nas.name for nas, (result, error) in zip(present, results) if error is not None]
+    if failed:
+        print("cannot read proxy NAS state of NAS servers ({}), plan not written".format(", ".join(failed)))
+        exit(1)
+    states = dict(zip([nas.id for nas in present], [result for result, error in results]))
+    plan = {
+        "version": DRTEST_PLAN_VERSION,
+        "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "cli": cli,
+        "nasservers": [planDrNas(nas, states.get(nas.id)) for nas in nas_list],
+    }
+    try:
+        with open(planFile, "w") as f:
+            json.dump(plan, f, indent=2, sort_keys=True)
+    except IOError as e:
+        print("cannot write plan file ({}): {}".format(planFile, e))
+        exit()
+    print("{:<24} {:<8} {:>8} {:>8} {:>10} {:>10}".format("NAS server", "proxy", "snaps", "create", "shares +", "shares -"))
+    for nasplan in plan["nasservers"]:
+        actions = [share["action"] for share in nasplan["proxyshares"]]
+        print("{:<24} {:<8} {:>8} {:>8} {:>10} {:>10}".format(nasplan["name"], nasplan["proxy"]["action"], len(nasplan["snapshots"]), len([snap for snap in nasplan["snapshots"] if snap["action"] != "reuse"]), actions.count("add"), actions.count("remove")))
+    print("\nplan written to {} in {:.2f}s, run it with --apply {}".format(planFile, time.time() - start, planFile))
+
+def applyDrSnap(snapplan):
+    # run the action of a snapshot of a plan
+    # input -> snapshot entry of a plan
+    # output -> snap object (None if reused), exit() on failure
+    with timings.phase("snapshot", snapplan["filesystem"]):
+        if snapplan["action"] == "recreate":
+            print("deleting snap ({})".format(snapplan["name"]))
+            if not deleteSNAP(snapplan["id"]):
+                print("Failed deleting snap ({}) of filesystem ({}) , exiting.".format(snapplan["id"], snapplan["filesystem"]))
+                exit()
+        if snapplan["action"] in ("create", "recreate"):
+            print("creating snap ({})".format(snapplan["name"]))
+            return createSNAP(snapplan["fsid"], snapplan["name"])
+
+def applyDrProxy(nasplan):
+    # create and associate the proxy nas of a plan
+    # input -> nas server entry of a plan
+    # output -> True, exit() on failure
+    proxy = nasplan["proxy"]
+    with timings.phase("proxy NAS", nasplan["name"]):
+        if proxy["action"] == "create" and findNAS(proxy["name"]):
+            # created after the plan was written, it is not created twice
+            print("Proxy NAS server ({}) already present, reusing it".format(proxy["name"]))
+        elif proxy["action"] == "create":
+            print("Proxy NAS server ({}) not present, creating it...".format(proxy["name"]))
+            createNAS(proxy["name"], nasplan["pool"])
+        if proxy["associate"] and not createProxyNAS(proxy["name"], getNASbyName(nasplan["name"])):
+            print("Proxy NAS server setup failed for NAS server ({})".format(nasplan["name"]))
+            exit()
+    return True
+
+def applyDrShares(nasplan):
+    # run the proxy share commands of a plan in one svc_nas batch
+    # input -> nas server entry of a plan
+    # output -> list of names of the shares failed
+    operations = []
+    for share in nasplan["proxyshares"]:
+        if share["action"] == "add":
+            operations.append((share["share"], ["-proxy_share", "-add", share["target"], "-share", share["share"], "-path", share["path"]]))
+        else:
+            operations.append((share["share"], ["-proxy_share", "-remove", "-share", share["share"]]))
+    with timings.phase("proxy shares", nasplan["name"]):
+        results = runSvcNasBatch(nasplan["proxy"]["name"], operations)
+    if operations:
+        invalidateInventoryCache()
+    failed = [name for name, succeeded, output in results if not succeeded]
+    print("Proxy NAS server ({}): {} proxy share commands, {} failed".format(nasplan["proxy"]["name"], len(operations), len(failed)))
+    for name, succeeded, output in results:
+        if not succeeded:
+            print("Proxy share ({}) failed:\n{}".format(name, output))
+    return failed
+
+def applyDrPlan(filename):
+    # --apply FILE: run the actions of a plan written by --plan, proxy nas servers of all
+    # nas servers first, then all snapshots and then proxy shares of every nas server in
+    # one svc_nas batch, each step at the same time for all nas servers
+    # input -> plan file name
+    # no output, per nas server summary is printed
+    try:
+        with open(filename) as f:
+            plan = json.load(f)
+    except (IOError, ValueError) as e:
+        print("cannot read plan file ({}): {}".format(filename, e))
+        exit()
+    if plan.get("version") != DRTEST_PLAN_VERSION:
+        print("plan file ({}) version {} not supported".format(filename, plan.get("version")))
+        exit()
+    if plan.get("cli") != cli:
+        print("plan file ({}) was created for a different uemcli ({})".format(filename, plan.get("cli")))
+        exit()
+    start = time.time()
+    nasplans = plan["nasservers"]
+    print("Applying plan ({}) created {} for NAS servers ({})".format(filename, plan["created"], ", ".join(nasplan["name"] for nasplan in nasplans)))
+    # nas servers are read again: a proxy nas created since the plan is not created twice
+    loadInventory(["nasservers"])
+    results = runParallel(applyDrProxy, nasplans, len(nasplans), failfast=False)
+    ready = [nasplan for nasplan, (result, error) in zip(nasplans, results) if error is None]
+    snaps = [(nasplan, snapplan) for nasplan in ready for snapplan in nasplan["snapshots"] if snapplan["action"] != "reuse"]
+    print("\nCreating {} snapshots, {} at a time".format(len(snaps), MAX_PROCESSES))
+    results = runParallel(lambda (nasplan, snapplan): applyDrSnap(snapplan), snaps, MAX_PROCESSES, failfast=False)
+    failed = {}
+    for (nasplan, snapplan), (result, error) in zip(snaps, results):
+        if error is not None:
+            failed.setdefault(nasplan["name"], []).append(snapplan["filesystem"])
+    ready = [nasplan for nasplan in ready if nasplan["name"] not in failed]
+    print("\nSetting up proxy shares of {} NAS servers".format(len(ready)))
+    results = runParallel(applyDrShares, ready, len(ready), failfast=False)
+    shares_failed = dict((nasplan["name"], result if error is None else ["all"]) for nasplan, (result, error) in zip(ready, results))
+    print("\n{:<24} {:<32} {:>10} {:>10}  {}".format("NAS server", "proxy NAS server", "snapshots", "shares", "status"))
+    done = 0
+    for nasplan in nasplans:
+        name = nasplan["name"]
+        planned = len([snapplan for snapplan in nasplan["snapshots"] if snapplan["action"] != "reuse"])
+        if name in shares_failed and not shares_failed[name]:
+            status = "ready"
+            done += 1
+        elif name in shares_failed:
+            status = "failed: proxy shares " + ", ".join(shares_failed[name])
+        elif name in failed:
+            status = "failed: snapshots of " + ", ".join(failed[name])
+        else:
+            status = "failed: proxy NAS server not set up"
+        print("{:<24} {:<32} {:>10} {:>10}  {}".format(name, nasplan["proxy"]["name"], planned, len(nasplan["proxyshares"]), status))
+    print("\n{} of {} NAS servers ready in {:.1f}s".format(done, len(nasplans), time.time() - start))
+    clientPolicy.report()
+
+def testDRservers():
+    # set up DR testing environment of several replicated nas servers at the same time
+    # (--testDR -nas NAS1 NAS2 ... or --testDR --all-replicated), inventory is loaded once,
+    # then proxy nas servers and filesystems of all nas servers are set up concurrently
+    # (--parallel filesystems of every nas server, at most MAX_PROCESSES commands at a time)
+    # no input
+    # no output, per nas server summary is printed
+    print("Getting system info...")
+    loadInventory(verbose=True)
+    nas_list = selectDrNasServers()
+    print("\nSet up DR testing environment for NAS servers ({})".format(", ".join(nas.name for nas in nas_list)))
+    start = time.time()
+    journal.begin([nas.name for nas in nas_list])
+    # questions about already existing snapshots are asked upfront for all filesystems
+    jobs = []
+    choices = {}
+    for nas in nas_list:
+        for fs in getNASfsList(nas):
+            choices[fs.id] = journal.choice(fs) or chooseDrSnap(fs)
+            jobs.append((nas, fs))
+    print("\nSetting up {} proxy NAS servers".format(len(nas_list)))
+    results = runParallel(prepareDrNas, nas_list, len(nas_list), failfast=False)
+    proxyshares = {}
+    for nas, (result, error) in zip(nas_list, results):
+        if error is None:
+            proxyshares[nas.id] = result
+    jobs = [(nas, fs) for nas, fs in jobs if nas.id in proxyshares]
+    print("\nSetting up {} filesystems, {} at a time".format(len(jobs), min(len(jobs), parallel * len(proxyshares))))
+    results = runParallel(lambda (nas, fs): setupDrFs(fs, nas, choices[fs.id], proxyshares[nas.id]), jobs, parallel * len(proxyshares), failfast=False)
+    failed = {}
+    snaps = {}
+    for (nas, fs), (result, error) in zip(jobs, results):
+        if error is not None:
+            failed.setdefault(nas.id, []).append(fs.name)
+        else:
+            snaps.setdefault(nas.id, []).append((fs, result))
+    # proxy shares of the filesystems with a snapshot, one svc_nas batch per proxy nas
+    sharing = [nas for nas in nas_list if nas.id in snaps]
+    print("\nSetting up proxy shares of {} NAS servers".format(len(sharing)))
+    results = runParallel(lambda nas: setupDrShares(nas, snaps[nas.id], proxyshares[nas.id]), sharing, len(sharing), failfast=False)
+    for nas, (result, error) in zip(sharing, results):
+        result = result if error is None else [fs.name for fs, snap in snaps[nas.id]]
+        if result:
+            failed.setdefault(nas.id, []).extend(result)
+    # stale proxy shares are removed only from nas servers completely set up
+    ready = [nas for nas in nas_list if nas.id in proxyshares and nas.id not in failed]
+    runParallel(lambda nas: pruneProxyShares(nas.name + DRTEST_PROXYNAS_SUFFIX, nas, proxyshares[nas.id]), ready, len(ready), failfast=False)
+    print("\n{:<24} {:<32} {:>12}  {}".format("NAS server", "proxy NAS server", "filesystems", "status"))
+    for nas in nas_list:
+        total = len(getNASfsList(nas))
+        if nas.id not in proxyshares:
+            status = "failed: proxy NAS server not set up"
+            done = 0
+        elif nas.id in failed:
+            status = "failed: " + ", ".join(failed[nas.id])
+            done = total - len(failed[nas.id])
+        else:
+            status = "ready"
+            done = total
+        print("{:<24} {:<32} {:>12}  {}".format(nas.name, nas.name + DRTEST_PROXYNAS_SUFFIX, "{}/{}".format(done, total), status))
+    print("\n{} of {} NAS servers ready in {:.1f}s".format(len(ready), len(nas_list), time.time() - start))
+    clientPolicy.report()
+    if len(ready) == len(nas_list):
+        journal.finish()
+    else:
+        print("run the same command with --resume to complete it")
+
 if __name__ == '__main__':
     fs = None
     nas = None
     snap = None
     pool = None
     is_proxy_nas_server_present = False
-    if cmdParser():
+    parsed = cmdParser()
+    if parsed and planFile:
+        planDR()
+    elif parsed and (allReplicated or len(drNasServers) > 1):
+        testDRservers()
+    elif parsed and nasServer:
         print("\nSet up DR testing environment for NAS server ({})".format(nasServer))
         print("Getting system info...")
-        fileSystems = getFilesystems()
-        nasServers = getNASservers()
-        snapshots = getSnapshots()
-        shares = getShares()
-        pool = getPools()
+        loadInventory(verbose=True)
+        pool = pools
         fs = getFSbyName(fileSystem)
         nas = getNASbyName(nasServer)
         if len(fileSystems)==0: # if found fs in not Null
@@ -1434,29 +4416,40 @@ if __name__ == '__main__':
             exit()
     	proxyNAS_name = nas.name + DRTEST_PROXYNAS_SUFFIX
         # create or update proxy NAS
-        createDrProxy(nas)
+        # proxy shares already configured are read once, only missing or different ones are changed
+        journal.begin([nas.name])
+        with timings.phase("proxy NAS", nas.name):
+            if not journal.proxyDone(nas) and createDrProxy(nas):
+                journal.record("proxy", nas=nas.name, proxy=proxyNAS_name)
+            proxyshares = getProxyShares(proxyNAS_name)
         # get all fs belonging to NAS server
         nasfs_list = getNASfsList(nas)
         # for every fs create the snapshot and proxy shares
-        for fs in nasfs_list:
-            sharelist=[]
-            snap = createDrSnap(fs) 
-            if not snap:
-                print("Create DR snap failed for FS ({})".format(fs.name))
+        if parallel > 1:
+            # questions about already existing snapshots are asked upfront,
+            # then filesystems are processed by the worker pool
+            choices = {}
+            for fs in nasfs_list:
+                choices[fs.id] = journal.choice(fs) or chooseDrSnap(fs)
+            print("\nSetting up {} filesystems, {} at a time".format(len(nasfs_list), parallel))
+            results = runParallel(lambda fs: setupDrFs(fs, nas, choices[fs.id], proxyshares), nasfs_list, parallel)
+            failed = [f.name for f, (result, error) in zip(nasfs_list, results) if error is not None]
+            if failed:
+                print("\nDR test environment setup stopped, filesystems not completed: {}".format(", ".join(failed)))
+                print("run the same command with --resume to complete it")
                 exit()
-            # create share
-            # get shares exported from this filesystem
-            for share in shares:
-              if share.filesystem == fs.id:
-                  sharelist.append(share)
-            # copyShare(sharelist, snap.name, proxyNAS_name)
-            if len(sharelist) > 0:
-                ok_result = proxyshareCOPY(sharelist, snap, proxyNAS_name, nas.name)
-                if ok_result:
-                    print("\nProxy shares copied for file system ({})".format(fs.name))
-                else:
-                    print("\nProxy shares copy failed for file system ({})".format(fs.name))
-                    exit()
+            snaps = [(f, result) for f, (result, error) in zip(nasfs_list, results)]
+        else:
+            snaps = [(fs, setupDrFs(fs, nas, None, proxyshares)) for fs in nasfs_list]
+        # proxy shares of all filesystems in one svc_nas batch
+        failed = setupDrShares(nas, snaps, proxyshares)
+        if failed:
+            print("\nDR test environment setup stopped, proxy shares not completed for filesystems: {}".format(", ".join(failed)))
+            print("run the same command with --resume to complete it")
+            exit()
+        pruneProxyShares(proxyNAS_name, nas, proxyshares)
+        journal.finish()
         print("DR test environment ready for proxy NAS ({})".format(proxyNAS_name))
+        clientPolicy.report()
     else:
         usage()